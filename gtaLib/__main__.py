@@ -0,0 +1,444 @@
+# GTA DragonFF - Blender scripts to edit basic GTA formats
+# Copyright (C) 2019  Parik
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Command line interface over gtaLib, runs without Blender:
+#   python -m gtaLib info models/*.dff
+#   python -m gtaLib convert -j 8 --rw-version 0x36003 -o out models/
+#   python -m gtaLib txd-extract -o textures "txd/**/*.txd"
+#   python -m gtaLib img-extract -o out gta3.img "*.dff"
+
+import argparse
+import fnmatch
+import glob
+import os
+import sys
+import zlib
+
+from concurrent.futures import ProcessPoolExecutor
+from struct import pack
+
+from .batch import BatchConverter, converters
+from .col import coll
+from .dff import dff, types, scan_chunks, map_file, Sections
+from .img import img
+from .txd import txd
+
+type_names = {value: name for name, value in types.items()}
+
+#######################################################
+def glob_root(pattern):
+
+    # Directory part of a glob before its first wildcard
+    while glob.has_magic(pattern):
+        pattern = os.path.dirname(pattern)
+    return pattern
+
+#######################################################
+def expand_paths(patterns, extensions=None):
+
+    # Expands globs (shells on Windows don't) and directories, yielding
+    # (path, root) where root is what output paths are made relative to
+    def supported(path):
+        return extensions is None or os.path.splitext(path)[1].lower() in extensions
+
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            paths = sorted(glob.glob(pattern, recursive=True))
+            if not paths:
+                print("%s: no matches" % pattern, file=sys.stderr)
+            root = glob_root(pattern)
+        else:
+            paths = [pattern]
+            root = None
+
+        for path in paths:
+            if os.path.isdir(path):
+                for directory, _, files in os.walk(path):
+                    for filename in sorted(files):
+                        if supported(filename):
+                            yield os.path.join(directory, filename), path if root is None else root
+
+            elif supported(path):
+                yield path, os.path.dirname(path) if root is None else root
+
+            elif root is None:
+                print("%s: skipped, unsupported file type" % path, file=sys.stderr)
+
+#######################################################
+def parallel_map(function, items, jobs):
+
+    # Results come back in order, so the output is stable for any job count
+    if jobs == 1:
+        return map(function, items)
+
+    executor = ProcessPoolExecutor(jobs)
+    results = executor.map(function, items, chunksize=8)
+    executor.shutdown(wait=False)
+
+    return results
+
+#######################################################
+def write_png(filename, width, height, rgba):
+
+    def chunk(type, data):
+        return pack(">I", len(data)) + type + data + pack(">I", zlib.crc32(type + data))
+
+    stride = width * 4
+    rows = bytearray()
+    for y in range(height):
+        rows += b"\0" + rgba[y * stride:(y + 1) * stride]
+
+    with open(filename, mode='wb') as file:
+        file.write(b"\x89PNG\r\n\x1a\n")
+        file.write(chunk(b"IHDR", pack(">2I5B", width, height, 8, 6, 0, 0, 0)))
+        file.write(chunk(b"IDAT", zlib.compress(bytes(rows), 6)))
+        file.write(chunk(b"IEND", b""))
+
+#######################################################
+def format_version(version):
+    return "0x%X" % version if isinstance(version, int) else "unknown"
+
+#######################################################
+def describe_dff(filename):
+    model = dff()
+    model.load_file(filename)
+
+    lines = ["%s: DFF RW %s, %d frames, %d geometries, %d atomics, %d collisions" % (
+        filename, format_version(model.rw_version), len(model.frame_list),
+        len(model.geometry_list), len(model.atomic_list), len(model.collisions))]
+
+    for index, geometry in enumerate(model.geometry_list):
+        lines.append("  geometry %d: %d vertices, %d triangles, %d materials, %d uv layers%s" % (
+            index, len(geometry.vertices), len(geometry.triangles),
+            len(geometry.materials), len(geometry.uv_layers),
+            ", native" if geometry.native_platform_type else ""))
+
+    return lines
+
+#######################################################
+def describe_txd(filename):
+    dictionary = txd()
+    dictionary.load_file(filename)
+
+    textures = len(dictionary.native_textures) or len(dictionary.textures)
+    lines = ["%s: TXD RW %s, %d textures" % (
+        filename, format_version(dictionary.rw_version), textures)]
+
+    for texture in dictionary.native_textures:
+        lines.append("  %s: %dx%d, %d levels, platform %d, raster 0x%X" % (
+            texture.name, texture.width, texture.height, texture.num_levels,
+            texture.platform_id, texture.raster_format_flags))
+
+    for texture, images in zip(dictionary.textures, dictionary.images):
+        lines.append("  %s: %dx%d, %d levels, %d bit" % (
+            texture.name, images[0].width, images[0].height, len(images),
+            images[0].depth))
+
+    return lines
+
+#######################################################
+def describe_col(filename, verbose=False):
+    collision = coll()
+    collision.load_file(filename)
+
+    lines = ["%s: COL, %d models" % (filename, len(collision.models))]
+
+    for model in collision.models:
+        lines.append("  %s (id %d): COL%d, %d spheres, %d boxes, %d vertices, %d faces, "
+                     "%d shadow vertices, %d shadow faces" % (
+            model.model_name, model.model_id, model.version, len(model.spheres),
+            len(model.boxes), len(model.mesh_verts), len(model.mesh_faces),
+            len(model.shadow_verts), len(model.shadow_faces)))
+
+        if verbose:
+            lines.append("    bounds: %s" % (model.bounds,))
+            for name in ("spheres", "boxes", "mesh_verts", "mesh_faces",
+                         "face_groups", "lines", "shadow_verts", "shadow_faces"):
+                for item in getattr(model, name):
+                    lines.append("    %s: %s" % (name, item))
+
+    return lines
+
+#######################################################
+def describe_img(filename):
+    with img.open(filename) as archive:
+        entries = archive.directory_entries
+        return ["%s: IMG version %d, %d entries, %d sectors" % (
+            filename, archive.version, len(entries),
+            max((e.offset + e.size for e in entries), default=0))]
+
+#######################################################
+def describe_tree(filename):
+    lines = [filename]
+
+    with map_file(filename) as data:
+        for chunk in scan_chunks(data):
+            lines.append("%s%s (%d bytes, RW %s) @ %d" % (
+                "  " * (chunk.depth + 1), type_names.get(chunk.type, "0x%X" % chunk.type),
+                chunk.size, format_version(Sections.get_rw_version(chunk.version)),
+                chunk.offset))
+
+    return lines
+
+describers = {
+    ".dff" : describe_dff,
+    ".txd" : describe_txd,
+    ".col" : describe_col,
+    ".img" : describe_img,
+}
+
+#######################################################
+def inspect_file(task):
+    filename, tree = task
+    extension = os.path.splitext(filename)[1].lower()
+
+    try:
+        if tree and extension in (".dff", ".txd"):
+            return describe_tree(filename), None
+        if extension not in describers:
+            raise ValueError("Unsupported file type: %s" % extension)
+        return describers[extension](filename), None
+
+    except Exception as e:
+        return [], "%s: %s: %s" % (filename, type(e).__name__, e)
+
+#######################################################
+def validate_file(filename):
+    extension = os.path.splitext(filename)[1].lower()
+
+    try:
+        # Check the chunk structure before parsing the contents
+        if extension in (".dff", ".txd"):
+            with map_file(filename) as data:
+                if not list(scan_chunks(data)):
+                    raise RuntimeError("Empty file")
+
+        if extension == ".col":
+            collision = coll()
+            collision.load_file(filename)
+            if not collision.models:
+                raise RuntimeError("No collision models found")
+
+        elif extension == ".img":
+            size = os.path.getsize(filename)
+            with img.open(filename) as archive:
+                for entry in archive.directory_entries:
+                    if (entry.offset + entry.size - 1) * 2048 >= size:
+                        raise RuntimeError("Entry %s is out of bounds" % entry.name)
+
+        elif extension in describers:
+            describers[extension](filename)
+
+        else:
+            raise ValueError("Unsupported file type: %s" % extension)
+
+    except Exception as e:
+        return "%s: %s: %s" % (filename, type(e).__name__, e)
+
+#######################################################
+def extract_txd(task):
+    filename, output_dir, raw = task
+    written = []
+
+    try:
+        dictionary = txd()
+        dictionary.load_file(filename)
+
+        directory = os.path.join(output_dir, os.path.splitext(os.path.basename(filename))[0])
+        os.makedirs(directory, exist_ok=True)
+
+        textures = [(t.name, t.width, t.height, t) for t in dictionary.native_textures]
+        textures += [(t.name, images[0].width, images[0].height, images[0])
+                     for t, images in zip(dictionary.textures, dictionary.images)]
+
+        for name, width, height, texture in textures:
+            rgba = texture.to_rgba(0)
+            if rgba is None:
+                print("%s: unsupported texture format" % name, file=sys.stderr)
+                continue
+
+            if raw:
+                path = os.path.join(directory, "%s_%dx%d.rgba" % (name, width, height))
+                with open(path, mode='wb') as file:
+                    file.write(rgba)
+            else:
+                path = os.path.join(directory, name + ".png")
+                write_png(path, width, height, rgba)
+
+            written.append(path)
+
+        return written, None
+
+    except Exception as e:
+        return written, "%s: %s: %s" % (filename, type(e).__name__, e)
+
+#######################################################
+def command_info(args):
+    failed = False
+    tasks = [(path, args.tree) for path, _ in expand_paths(args.files, describers)]
+
+    for lines, error in parallel_map(inspect_file, tasks, args.jobs):
+        for line in lines:
+            print(line)
+        if error:
+            print(error, file=sys.stderr)
+            failed = True
+
+    return 1 if failed else 0
+
+#######################################################
+def command_validate(args):
+    files = [path for path, _ in expand_paths(args.files, describers)]
+    errors = [e for e in parallel_map(validate_file, files, args.jobs) if e]
+
+    for error in errors:
+        print(error, file=sys.stderr)
+
+    print("%d files checked, %d failed" % (len(files), len(errors)))
+    return 1 if errors else 0
+
+#######################################################
+def command_convert(args):
+    tasks = [(path, os.path.join(args.output, os.path.relpath(path, root) if root else path))
+             for path, root in expand_paths(args.files, converters)]
+
+    converter = BatchConverter(args.jobs, version=args.rw_version)
+    failed = 0
+
+    for result in converter.convert(tasks):
+        if result.error:
+            print("%s: %s" % (result.source, result.error), file=sys.stderr)
+            failed += 1
+        elif args.verbose:
+            print("%s -> %s (%d bytes, %.3fs)" % (
+                result.source, result.destination, result.size, result.elapsed))
+
+    print("%d files converted, %d failed" % (len(tasks) - failed, failed))
+    return 1 if failed else 0
+
+#######################################################
+def command_txd_extract(args):
+    failed = False
+    tasks = [(path, args.output, args.raw) for path, _ in expand_paths(args.files, (".txd",))]
+
+    for written, error in parallel_map(extract_txd, tasks, args.jobs):
+        for path in written:
+            print(path)
+        if error:
+            print(error, file=sys.stderr)
+            failed = True
+
+    return 1 if failed else 0
+
+#######################################################
+def command_col_dump(args):
+    failed = False
+
+    for path, _ in expand_paths(args.files, (".col",)):
+        try:
+            for line in describe_col(path, verbose=True):
+                print(line)
+        except Exception as e:
+            print("%s: %s: %s" % (path, type(e).__name__, e), file=sys.stderr)
+            failed = True
+
+    return 1 if failed else 0
+
+#######################################################
+def command_img_list(args):
+    with img.open(args.archive) as archive:
+        for entry in archive.directory_entries:
+            if fnmatch.fnmatch(entry.name.lower(), args.pattern.lower()):
+                print("%-24s %10d %8d" % (entry.name, entry.offset, entry.size * 2048))
+
+    return 0
+
+#######################################################
+def command_img_extract(args):
+    patterns = [pattern.lower() for pattern in args.patterns or ["*"]]
+    os.makedirs(args.output, exist_ok=True)
+
+    with img.open(args.archive) as archive:
+        for index, entry in enumerate(archive.directory_entries):
+            if not any(fnmatch.fnmatch(entry.name.lower(), p) for p in patterns):
+                continue
+
+            name, data = archive.read_entry(index)
+            path = os.path.join(args.output, os.path.basename(name))
+            with open(path, mode='wb') as file:
+                file.write(data)
+
+            del data
+            print(path)
+
+    return 0
+
+#######################################################
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="gtaLib",
+                                     description="Inspect and convert GTA RenderWare files")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                        help="number of worker processes (default: all cores)")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    command = commands.add_parser("info", help="summarize DFF, TXD, COL and IMG files")
+    command.add_argument("files", nargs="+", help="files, directories or globs")
+    command.add_argument("--tree", action="store_true",
+                         help="print the chunk tree of RenderWare files")
+    command.set_defaults(function=command_info)
+
+    command = commands.add_parser("validate", help="check that files parse")
+    command.add_argument("files", nargs="+", help="files, directories or globs")
+    command.set_defaults(function=command_validate)
+
+    command = commands.add_parser("convert", help="re-export DFF, TXD and COL files")
+    command.add_argument("files", nargs="+", help="files, directories or globs")
+    command.add_argument("-o", "--output", required=True, help="output directory")
+    command.add_argument("--rw-version", type=lambda v: int(v, 0),
+                         help="target RenderWare version, e.g. 0x36003 (default: keep)")
+    command.add_argument("-v", "--verbose", action="store_true")
+    command.set_defaults(function=command_convert)
+
+    command = commands.add_parser("txd-extract", help="extract TXD textures")
+    command.add_argument("files", nargs="+", help="files, directories or globs")
+    command.add_argument("-o", "--output", required=True, help="output directory")
+    command.add_argument("--raw", action="store_true",
+                         help="write raw RGBA8888 instead of PNG")
+    command.set_defaults(function=command_txd_extract)
+
+    command = commands.add_parser("col-dump", help="dump COL models")
+    command.add_argument("files", nargs="+", help="files, directories or globs")
+    command.set_defaults(function=command_col_dump)
+
+    command = commands.add_parser("img-list", help="list IMG archive entries")
+    command.add_argument("archive")
+    command.add_argument("pattern", nargs="?", default="*", help="name filter, e.g. *.dff")
+    command.set_defaults(function=command_img_list)
+
+    command = commands.add_parser("img-extract", help="extract IMG archive entries")
+    command.add_argument("archive")
+    command.add_argument("patterns", nargs="*", help="name filters (default: all)")
+    command.add_argument("-o", "--output", required=True, help="output directory")
+    command.set_defaults(function=command_img_extract)
+
+    args = parser.parse_args(argv)
+    args.jobs = max(1, args.jobs)
+
+    return args.function(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,185 @@
+# GTA DragonFF - Blender scripts to edit basic GTA formats
+# Copyright (C) 2019  Parik
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from itertools import islice
+from time import perf_counter
+
+from .col import coll
+from .dff import dff, GeomSurfPro
+from .txd import txd
+
+# Outcome of converting one file. data only holds the converted file when
+# it's requested, otherwise the results stay a few hundred bytes each.
+BatchResult = namedtuple("BatchResult", "source destination size elapsed error data")
+
+#######################################################
+def convert_dff(filename, version):
+    model = dff()
+    model.load_file(filename)
+
+    if not model.rw_version:
+        raise RuntimeError("Invalid format")
+
+    # Surface properties moved from geometries to materials in RW 3.4, carry
+    # them over when converting across
+    for geometry in model.geometry_list:
+        for material in geometry.materials:
+            if material.surface_properties is None:
+                material.surface_properties = geometry.surface_properties or GeomSurfPro(0, 0, 0)
+
+        if geometry.surface_properties is None:
+            geometry.surface_properties = geometry.materials[0].surface_properties \
+                if geometry.materials else GeomSurfPro(0, 0, 0)
+
+    return model.write_memory(version or model.rw_version)
+
+#######################################################
+def convert_txd(filename, version):
+    dictionary = txd()
+    dictionary.load_file(filename)
+
+    if not dictionary.rw_version:
+        raise RuntimeError("Invalid format")
+
+    return dictionary.write_memory(version or dictionary.rw_version)
+
+#######################################################
+def convert_col(filename, version):
+    collision = coll()
+    collision.load_file(filename)
+
+    return collision.write_memory()
+
+converters = {
+    ".dff" : convert_dff,
+    ".txd" : convert_txd,
+    ".col" : convert_col,
+}
+
+#######################################################
+def convert_file(source, destination=None, version=None, return_data=False):
+
+    # Loads and re-serializes a single file. Failures are reported in the
+    # result rather than raised, so one broken model doesn't stop a batch.
+    start = perf_counter()
+    data, size, error = None, 0, None
+
+    try:
+        extension = os.path.splitext(source)[1].lower()
+        if extension not in converters:
+            raise ValueError("Unsupported file type: %s" % extension)
+
+        data = converters[extension](source, version)
+        size = len(data)
+
+        if destination:
+            directory = os.path.dirname(destination)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+            with open(destination, mode='wb') as file:
+                file.write(data)
+
+    except Exception as e:
+        error = "%s: %s" % (type(e).__name__, e)
+
+    return BatchResult(source, destination, size, perf_counter() - start, error,
+                       bytes(data) if return_data and data is not None else None)
+
+#######################################################
+def convert_chunk(tasks, version, return_data):
+    return [convert_file(source, destination, version, return_data)
+            for source, destination in tasks]
+
+#######################################################
+class BatchConverter:
+
+    # Converts files across a pool of worker processes. The parsers keep
+    # global state (e.g. Sections.library_id) and are CPU bound, so they
+    # are run in processes rather than threads. Tasks are submitted in
+    # chunks with a bounded number in flight, which keeps the overhead low
+    # and the memory flat on batches of tens of thousands of files.
+
+    #######################################################
+    def __init__(self, workers=None, chunk_size=16, version=None, return_data=False):
+        self.workers     = workers or os.cpu_count() or 1
+        self.chunk_size  = max(1, chunk_size)
+        self.version     = version
+        self.return_data = return_data
+
+    #######################################################
+    def convert(self, tasks):
+
+        # Takes source paths or (source, destination) pairs and yields a
+        # BatchResult per file in completion order
+        tasks = ((task, None) if isinstance(task, (str, os.PathLike)) else task
+                 for task in tasks)
+        tasks = ((os.fspath(source), destination) for source, destination in tasks)
+
+        # Runs in this process, e.g. when spawning workers isn't possible
+        if self.workers == 1:
+            for source, destination in tasks:
+                yield convert_file(source, destination, self.version, self.return_data)
+            return
+
+        executor = ProcessPoolExecutor(self.workers)
+        pending = set()
+
+        try:
+            while True:
+                chunk = list(islice(tasks, self.chunk_size))
+                if not chunk:
+                    break
+
+                pending.add(executor.submit(convert_chunk, chunk, self.version,
+                                            self.return_data))
+
+                if len(pending) >= self.workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield from future.result()
+
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from future.result()
+
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown()
+
+    #######################################################
+    def convert_directory(self, source_dir, output_dir=None):
+
+        # Converts every supported file below source_dir, mirroring the
+        # directory layout into output_dir when one is given
+        return self.convert(
+            (source, output_dir and os.path.join(output_dir, os.path.relpath(source, source_dir)))
+            for source in BatchConverter.find_files(source_dir)
+        )
+
+    #######################################################
+    @staticmethod
+    def find_files(directory):
+        for root, _, files in os.walk(directory):
+            for filename in sorted(files):
+                if os.path.splitext(filename)[1].lower() in converters:
+                    yield os.path.join(root, filename)
@@ -0,0 +1,460 @@
+# GTA DragonFF - Blender scripts to edit basic GTA formats
+# Copyright (C) 2019  Parik
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Benchmarks every parser and writer on synthetic files, no game assets
+# are needed. Run from the add-on directory:
+#   python -m gtaLib.benchmark --size medium --save baseline.json
+#   python -m gtaLib.benchmark --size medium --baseline baseline.json
+
+import argparse
+import gc
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import tracemalloc
+
+from collections import namedtuple
+from contextlib import redirect_stdout
+from struct import pack
+from time import perf_counter
+
+from . import col, dff, txd
+from .data import map_data
+from .img import img
+from .map import MapDataUtility, TextIPLData
+from .native_gc import NativeGCTexture, GVRFMT_RGBA8888
+from .native_ps2 import NativePS2Texture
+from .native_psp import NativePSPTexture
+from .native_xbox import NativeXboxTexture
+
+# size, item count and unit of a benchmark, along with the measured code
+BenchmarkCase = namedtuple("BenchmarkCase", "name size items unit function")
+BenchmarkResult = namedtuple("BenchmarkResult", "name seconds mb_per_s items_per_s peak_kib")
+
+# Multiplier applied to the corpus sizes
+scales = {
+    "small"  : 1,
+    "medium" : 4,
+    "large"  : 16,
+}
+
+RW_VERSION = 0x36003
+
+#######################################################
+def random_bytes(rand, length):
+    return rand.getrandbits(length * 8).to_bytes(length, 'little') if length else b""
+
+#######################################################
+def generate_dff(vertices, triangles, seed=0, version=RW_VERSION):
+
+    # A single clump with prelighting, normals, two UV layers, two
+    # materials and extra vertex colours
+    rand = random.Random(seed)
+    model = dff.dff()
+
+    frame = dff.Frame()
+    frame.name = "root"
+    frame.rotation_matrix = dff.Matrix(dff.Vector(1, 0, 0), dff.Vector(0, 1, 0),
+                                       dff.Vector(0, 0, 1))
+    frame.position = dff.Vector(0, 0, 0)
+    model.frame_list.append(frame)
+
+    geometry = dff.Geometry()
+    geometry.surface_properties = dff.GeomSurfPro(1, 1, 1)
+    geometry.bounding_sphere = dff.Sphere(0, 0, 0, 100)
+    geometry.vertices = [dff.Vector(rand.uniform(-100, 100), rand.uniform(-100, 100),
+                                    rand.uniform(-100, 100)) for _ in range(vertices)]
+    geometry.normals = [dff.Vector(rand.uniform(-1, 1), rand.uniform(-1, 1),
+                                   rand.uniform(-1, 1)) for _ in range(vertices)]
+    geometry.prelit_colors = [dff.RGBA(*random_bytes(rand, 4)) for _ in range(vertices)]
+    geometry.uv_layers = [[dff.TexCoords(rand.random(), rand.random()) for _ in range(vertices)]
+                          for _ in range(2)]
+    geometry.triangles = sorted(
+        (dff.Triangle(rand.randrange(vertices), rand.randrange(vertices), rand.randrange(2),
+                      rand.randrange(vertices)) for _ in range(triangles)),
+        key=lambda triangle: triangle.material
+    )
+    geometry.extensions['extra_vert_color'] = dff.ExtraVertColorExtension(
+        [dff.RGBA(*random_bytes(rand, 4)) for _ in range(vertices)])
+
+    for index in range(2):
+        material = dff.Material()
+        material.color = dff.RGBA(255, 255, 255, 255)
+        material.surface_properties = dff.GeomSurfPro(1, 1, 1)
+
+        texture = dff.Texture()
+        texture.filters = 0
+        texture.name = "texture%d" % index
+        texture.mask = ""
+        material.textures.append(texture)
+
+        geometry.materials.append(material)
+
+    model.geometry_list.append(geometry)
+
+    atomic = dff.Atomic()
+    atomic.frame, atomic.geometry, atomic.flags = 0, 0, 4
+    model.atomic_list.append(atomic)
+
+    return bytes(model.write_memory(version))
+
+#######################################################
+def generate_txd(size, seed=0, version=RW_VERSION):
+
+    # D3D9 textures of the common raster formats, each with a full mip chain
+    rand = random.Random(seed)
+    dictionary = txd.txd()
+    dictionary.device_id = txd.DeviceType.DEVICE_D3D9
+
+    D3D, Raster = txd.D3DFormat, txd.RasterFormat
+    formats = (
+        ("8888", D3D.D3D_8888, Raster.RASTER_8888, 32, 0),
+        ("565",  D3D.D3D_565,  Raster.RASTER_565,  16, 0),
+        ("1555", D3D.D3D_1555, Raster.RASTER_1555, 16, 0),
+        ("dxt1", D3D.D3D_DXT1, Raster.RASTER_565,  16, 0),
+        ("dxt5", D3D.D3D_DXT5, Raster.RASTER_4444, 16, 0),
+        ("pal8", D3D.D3D_8888, Raster.RASTER_8888,  8, 0x2000),
+    )
+
+    levels = size.bit_length()
+    for name, d3d_format, raster, depth, palette_flag in formats:
+        texture = txd.TextureNative()
+        texture.platform_id = dff.NativePlatformType.D3D9
+        texture.name, texture.mask = name, ""
+        texture.d3d_format = d3d_format
+        texture.width = texture.height = size
+        texture.depth = depth
+        texture.num_levels = levels
+        texture.raster_type = 4
+        texture.raster_format_flags = raster << 8 | palette_flag | 0x8000
+
+        compressed = name.startswith("dxt")
+        texture.platform_properties = texture.read_platform_properties(
+            bytes((0b0001 | (0b1000 if compressed else 0),)), 0)
+
+        if palette_flag:
+            texture.palette = random_bytes(rand, 1024)
+
+        for level in range(levels):
+            width = height = max(size >> level, 1)
+            if compressed:
+                blocks = max(1, width // 4) * max(1, height // 4)
+                length = blocks * (8 if name == "dxt1" else 16)
+            else:
+                length = width * height * depth // 8
+            texture.pixels.append(random_bytes(rand, length))
+
+        dictionary.native_textures.append(texture)
+
+    return bytes(dictionary.write_memory(version))
+
+#######################################################
+def generate_col(models, faces, seed=0, version=3):
+    rand = random.Random(seed)
+    collision = col.coll()
+    col.Sections.init_sections(version)
+
+    surface = col.TSurface(1, 0, 0, 0)
+    for index in range(models):
+        model = col.ColModel()
+        model.version = version
+        model.model_name = "model%d" % index
+        model.model_id = index
+        model.bounds = col.TBounds((-100, -100, -100), (100, 100, 100), (0, 0, 0), 175.0)
+        model.spheres = [col.TSphere((0, 0, 0), 1.0, surface)]
+        model.boxes = [col.TBox((0, 0, 0), (1, 1, 1), surface)]
+        model.mesh_verts = [(rand.randint(-12800, 12800) / 128, rand.randint(-12800, 12800) / 128,
+                             rand.randint(-12800, 12800) / 128) for _ in range(faces // 2)]
+        model.mesh_faces = [col.TFace(rand.randrange(faces // 2), rand.randrange(faces // 2),
+                                      rand.randrange(faces // 2), 1, 0) for _ in range(faces)]
+        collision.models.append(model)
+
+    return bytes(collision.write_memory())
+
+#######################################################
+def generate_img(filename, entries, entry_data):
+    with img.create(filename) as archive:
+        for index in range(entries):
+            archive.add_entry("model%d.dff" % index, io.BytesIO(entry_data))
+
+#######################################################
+def generate_ipl(instances, seed=0):
+
+    # Returns the same SA instances as a text and a binary IPL
+    rand = random.Random(seed)
+    structure = map_data.data[map_data.game_version.SA]['structures']['inst']
+
+    rows = [(rand.randrange(20000), rand.uniform(-3000, 3000), rand.uniform(-3000, 3000),
+             rand.uniform(0, 200), rand.random(), rand.random(), rand.random(), rand.random())
+            for _ in range(instances)]
+
+    text = io.StringIO()
+    MapDataUtility.write_text_ipl_to_stream(text, map_data.game_version.SA, TextIPLData(
+        [structure(*map(str, (id, "model%d" % id, 0, x, y, z, rx, ry, rz, rw, -1)))
+         for id, x, y, z, rx, ry, rz, rw in rows], []))
+
+    binary = bytearray(pack("4siiiiiii", b"bnry", instances, 0, 0, 0, 0, 0, 32))
+    for id, x, y, z, rx, ry, rz, rw in rows:
+        binary += pack("fffffffiii", x, y, z, rx, ry, rz, rw, id, 0, -1)
+
+    return text.getvalue().encode('latin-1'), bytes(binary)
+
+#######################################################
+def build_cases(scale, directory):
+
+    cases = []
+    seed = 1
+
+    # DFF
+    vertices, triangles = 20000 * scale, 40000 * scale
+    dff_data = generate_dff(vertices, triangles, seed)
+
+    def load_dff():
+        model = dff.dff()
+        model.load_memory(dff_data)
+        return model
+
+    loaded_dff = load_dff()
+
+    cases += [
+        BenchmarkCase("dff.load", len(dff_data), vertices, "vertices", load_dff),
+        BenchmarkCase("dff.write", len(dff_data), vertices, "vertices",
+                      lambda: loaded_dff.write_memory(RW_VERSION)),
+    ]
+
+    # TXD
+    txd_data = generate_txd(256 * scale, seed)
+
+    def load_txd():
+        dictionary = txd.txd()
+        dictionary.load_memory(txd_data)
+        return dictionary
+
+    loaded_txd = load_txd()
+    texels = sum(texture.width * texture.height for texture in loaded_txd.native_textures)
+
+    cases += [
+        BenchmarkCase("txd.load", len(txd_data), texels, "texels", load_txd),
+        BenchmarkCase("txd.write", len(txd_data), texels, "texels",
+                      lambda: loaded_txd.write_memory(RW_VERSION)),
+        BenchmarkCase("txd.to_rgba", len(txd_data), texels, "texels",
+                      lambda: [texture.to_rgba(0) for texture in loaded_txd.native_textures]),
+    ]
+
+    # Texture encoders, they need numpy
+    if txd.numpy is not None:
+        size = 256 * scale
+        image = loaded_txd.native_textures[0].to_rgba(0)
+        mipmaps = lambda mip_filter: txd.ImageEncoder.mipmaps(image, size, size, mip_filter)
+
+        cases += [
+            BenchmarkCase("txd.encode_dxt1", len(image), size * size, "texels",
+                          lambda: txd.ImageEncoder.bc1(image, size, size, True)),
+            BenchmarkCase("txd.encode_dxt5", len(image), size * size, "texels",
+                          lambda: txd.ImageEncoder.bc3(image, size, size)),
+            BenchmarkCase("txd.encode_pal8", len(image), size * size, "texels",
+                          lambda: txd.ImageEncoder.pal8([(image, size, size)])),
+            BenchmarkCase("txd.mipmaps_box", len(image), size * size, "texels",
+                          lambda: mipmaps('BOX')),
+            BenchmarkCase("txd.mipmaps_kaiser", len(image), size * size, "texels",
+                          lambda: mipmaps('KAISER')),
+        ]
+
+    # COL
+    models, faces = 50 * scale, 2000
+    col_data = generate_col(models, faces, seed)
+
+    def load_col():
+        collision = col.coll()
+        collision.load_memory(col_data)
+        return collision
+
+    loaded_col = load_col()
+    cases += [
+        BenchmarkCase("col.load", len(col_data), models * faces, "faces", load_col),
+        BenchmarkCase("col.write", len(col_data), models * faces, "faces",
+                      loaded_col.write_memory),
+    ]
+
+    # IMG
+    entries = 500 * scale
+    entry_data = generate_dff(200, 400, seed)
+    img_path = os.path.join(directory, "benchmark.img")
+    generate_img(img_path, entries, entry_data)
+    img_size = os.path.getsize(img_path)
+
+    def read_img():
+        with img.open(img_path) as archive:
+            return sum(len(archive.read_entry(i)[1]) for i in range(len(archive.directory_entries)))
+
+    cases += [
+        BenchmarkCase("img.read", img_size, entries, "entries", read_img),
+        BenchmarkCase("img.write", img_size, entries, "entries",
+                      lambda: generate_img(os.path.join(directory, "write.img"), entries, entry_data)),
+    ]
+
+    # IPL
+    instances = 20000 * scale
+    text_ipl, binary_ipl = generate_ipl(instances, seed)
+    structures = map_data.data[map_data.game_version.SA]['structures']
+    aliases = map_data.data[map_data.game_version.SA]['IPL_aliases']
+
+    def load_text_ipl():
+        stream = io.StringIO(text_ipl.decode('latin-1'))
+        stream.name = "benchmark.ipl"
+        with redirect_stdout(io.StringIO()):
+            return MapDataUtility.read_text_file_from_stream(stream, structures, aliases)
+
+    def load_binary_ipl():
+        with redirect_stdout(io.StringIO()):
+            return MapDataUtility.read_binary_ipl_from_stream(io.BytesIO(binary_ipl), structures)
+
+    ipl_data = TextIPLData(load_text_ipl()['inst'], [])
+    cases += [
+        BenchmarkCase("ipl.load_text", len(text_ipl), instances, "instances", load_text_ipl),
+        BenchmarkCase("ipl.load_binary", len(binary_ipl), instances, "instances", load_binary_ipl),
+        BenchmarkCase("ipl.write_text", len(text_ipl), instances, "instances",
+                      lambda: MapDataUtility.write_text_ipl_to_stream(
+                          io.StringIO(), map_data.game_version.SA, ipl_data)),
+    ]
+
+    # Native platform texture layouts
+    size = 256 * scale
+    raster = random_bytes(random.Random(seed), size * size * 4)
+    cases += [
+        BenchmarkCase("ps2.unswizzle8", size * size, size * size, "texels",
+                      lambda: NativePS2Texture.unswizzle8(raster, size, size)),
+        BenchmarkCase("ps2.unswizzle4", size * size // 2, size * size, "texels",
+                      lambda: NativePS2Texture.unswizzle4(raster, size, size)),
+        BenchmarkCase("gc.unswizzle", size * size * 4, size * size, "texels",
+                      lambda: NativeGCTexture.unswizzle(raster, size, size, GVRFMT_RGBA8888)),
+        BenchmarkCase("psp.unswizzle", size * size, size * size, "texels",
+                      lambda: NativePSPTexture.unswizzle(raster, size, size, 8)),
+        BenchmarkCase("xbox.unswizzle", size * size * 4, size * size, "texels",
+                      lambda: NativeXboxTexture.unswizzle(raster, size, size, 4)),
+    ]
+
+    return cases
+
+#######################################################
+def measure(case, repeat):
+
+    # Best of several runs, then one traced run for the peak allocation so
+    # the tracing overhead doesn't skew the timings
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        start = perf_counter()
+        case.function()
+        timings.append(perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        case.function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    seconds = min(timings)
+    return BenchmarkResult(case.name, seconds,
+                           case.size / seconds / 1e6 if seconds else 0.0,
+                           case.items / seconds if seconds else 0.0,
+                           peak / 1024)
+
+#######################################################
+def run(size="small", repeat=3, names=None):
+    with tempfile.TemporaryDirectory() as directory:
+        cases = build_cases(scales[size], directory)
+        return [measure(case, repeat) for case in cases
+                if not names or any(name in case.name for name in names)]
+
+#######################################################
+def compare(results, baseline, tolerance):
+
+    # Returns the names of benchmarks that are slower than the baseline by
+    # more than the tolerance
+    regressions = []
+
+    for result in results:
+        reference = baseline.get(result.name)
+        if reference and result.seconds > reference["seconds"] * (1 + tolerance):
+            regressions.append(result.name)
+
+    return regressions
+
+#######################################################
+def format_results(results, baseline=None):
+    lines = ["%-18s %10s %10s %16s %12s%s" % (
+        "benchmark", "time (ms)", "MB/s", "items/s", "peak (KiB)",
+        " %9s" % "vs base" if baseline else "")]
+
+    for result in results:
+        change = ""
+        if baseline and result.name in baseline:
+            change = " %+8.1f%%" % ((result.seconds / baseline[result.name]["seconds"] - 1) * 100)
+
+        lines.append("%-18s %10.2f %10.1f %16.0f %12.0f%s" % (
+            result.name, result.seconds * 1000, result.mb_per_s, result.items_per_s,
+            result.peak_kib, change))
+
+    return lines
+
+#######################################################
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="gtaLib.benchmark",
+                                     description="Benchmark gtaLib parsers and writers")
+    parser.add_argument("--size", choices=scales, default="small", help="corpus size")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per benchmark")
+    parser.add_argument("--filter", nargs="*", help="only run benchmarks matching these names")
+    parser.add_argument("--save", help="write the results to a baseline JSON file")
+    parser.add_argument("--baseline", help="compare against a baseline JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed slowdown against the baseline (default: 0.25)")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            stored = json.load(file)
+        if stored.get("size") != args.size:
+            print("Baseline was recorded with --size %s" % stored.get("size"), file=sys.stderr)
+        baseline = stored["results"]
+
+    results = run(args.size, max(1, args.repeat), args.filter)
+
+    for line in format_results(results, baseline):
+        print(line)
+
+    if args.save:
+        with open(args.save, mode='w') as file:
+            json.dump({"size": args.size,
+                       "results": {result.name: result._asdict() for result in results}},
+                      file, indent=2)
+
+    if baseline:
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("Slower than baseline: %s" % ", ".join(regressions), file=sys.stderr)
+            return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
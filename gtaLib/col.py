@@ -17,7 +17,7 @@
 from struct import unpack_from, calcsize, pack
 from struct import error as StructError
 from collections import namedtuple
-from .dff import strlen
+from .dff import strlen, map_file
 
 class ColModel:
     def __init__(self):
@@ -367,9 +367,11 @@ class coll:
     #######################################################
     def load_file(self, filename):
 
-        with open(filename, mode='rb') as file:
-            content = file.read()
-            self.load_memory(content)
+        with map_file(filename) as content:
+            try:
+                self.load_memory(content)
+            finally:
+                self._data = b""
 
     #######################################################
     def __write_block(self, block_type, blocks, write_count = True):
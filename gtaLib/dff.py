@@ -14,14 +14,23 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import mmap
+import sys
+
+from array import array
 from collections import defaultdict, namedtuple
-from struct import unpack_from, calcsize, pack
-from enum import Enum, IntEnum
+from collections.abc import Sequence
+from itertools import chain, compress
+from operator import and_, ne
+from contextlib import contextmanager
+from struct import unpack_from, calcsize, pack, error as StructError
+from enum import Enum, IntEnum, IntFlag
 
 from .pyffi.utils import tristrip
 
 # Data types
 Chunk         = namedtuple("Chunk"         , "type size version")
+ChunkHeader   = namedtuple("ChunkHeader"   , "type size version offset depth")
 Clump         = namedtuple("Clump"         , "atomics lights cameras")
 Vector        = namedtuple("Vector"        , "x y z")
 Matrix        = namedtuple("Matrix"        , "right up at")
@@ -80,6 +89,16 @@ class UserDataType(IntEnum):
     USERDATAFLOAT = 2
     USERDATASTRING = 3
 
+# Sections read by dff.load_memory, see dff.load_sections
+class DffSection(IntFlag):
+    FRAMES              = 0x01
+    GEOMETRY            = 0x02 # geometry structs and material lists
+    GEOMETRY_EXTENSIONS = 0x04 # skin, bin mesh, native data, 2dfx, ...
+    ATOMICS             = 0x08
+    COLLISION           = 0x10
+    UV_ANIMATIONS       = 0x20
+    ALL                 = 0x3f
+
 # Native Platform Type
 class NativePlatformType(IntEnum):
     D3D7        = 0x1
@@ -136,6 +155,23 @@ types = {
     "SAMP Collision Model"    : 39056127,
 }
 
+# Chunks whose payload is a sequence of child chunks rather than raw data
+container_types = frozenset((
+    types["Extension"],
+    types["Texture"],
+    types["Material"],
+    types["Material List"],
+    types["Frame List"],
+    types["Geometry"],
+    types["Clump"],
+    types["Atomic"],
+    types["Texture Native"],
+    types["Texture Dictionary"],
+    types["Geometry List"],
+    types["PI Texture Dictionary"],
+    types["UV Animation Dictionary"],
+))
+
 #######################################################
 def strlen(bytes, offset=0):
 
@@ -152,6 +188,193 @@ def strlen(bytes, offset=0):
         
     return i-offset
 
+#######################################################
+@contextmanager
+def map_file(filename):
+
+    # Maps a file read-only and yields a memoryview over it. Slicing the view
+    # doesn't copy, so nested chunks can be handed down as views. Anything
+    # that is kept after loading must be copied out before the block exits.
+    with open(filename, mode='rb') as file:
+        try:
+            mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            mapping = None # empty files can't be mapped
+
+    if mapping is None:
+        yield memoryview(b"")
+        return
+
+    view = memoryview(mapping)
+    try:
+        yield view
+    finally:
+        try:
+            view.release()
+            mapping.close()
+
+        # A view is still referenced somewhere (e.g. by a traceback), the
+        # mapping is then closed once the last view is garbage collected
+        except BufferError:
+            pass
+
+#######################################################
+def scan_chunks(data, offset=0, end=None, max_depth=None):
+
+    # Walks the chunk tree yielding a ChunkHeader for every chunk in stream
+    # order. Only the 12 byte headers are unpacked, payloads are jumped over
+    # by their size, so it's cheap even on mapped files of any size. Chunks
+    # listed in container_types are descended into up to max_depth.
+    chunk_format = Sections.formats[Chunk]
+
+    if end is None:
+        end = len(data)
+
+    ends = [end]
+    while ends:
+        end = ends[-1]
+
+        # Trailing bytes that can't hold a header (e.g. sector padding)
+        if offset + 12 > end:
+            offset = end
+            ends.pop()
+            continue
+
+        type, size, version = unpack_from(chunk_format, data, offset)
+        depth = len(ends) - 1
+
+        # Zero filled padding after the stream (e.g. IMG sectors)
+        if depth == 0 and type == 0 and size == 0:
+            break
+
+        payload = offset + 12
+        if payload + size > end:
+            raise RuntimeError("Chunk 0x%X at offset %d overruns its parent" % (type, offset))
+
+        yield ChunkHeader(type, size, version, offset, depth)
+
+        if type in container_types and (max_depth is None or depth < max_depth):
+            ends.append(payload + size)
+            offset = payload
+        else:
+            offset = payload + size
+
+#######################################################
+def scan_file(filename, max_depth=None):
+    with map_file(filename) as data:
+        yield from scan_chunks(data, max_depth=max_depth)
+
+#######################################################
+class ChunkReader:
+
+    # Cursor over a RenderWare stream shared by the file readers. The data is
+    # held as a memoryview, so raw() and the sub-buffers passed down to the
+    # from_mem/unpack functions are views into it rather than copies.
+
+    #######################################################
+    def _read(self, size):
+        current_pos = self.pos
+        self.pos += size
+        
+        return current_pos
+
+    #######################################################
+    def raw(self, size, offset=None):
+
+        if offset is None:
+            offset = self.pos
+        
+        return self.data[offset:offset+size]
+
+    #######################################################
+    def read_chunk(self):
+        chunk = Sections.read(Chunk, self.data, self._read(12))
+        return chunk
+
+    #######################################################
+    def load_file(self, filename):
+
+        with map_file(filename) as content:
+            try:
+                self.load_memory(content)
+            finally:
+                self.data = b""
+
+#######################################################
+class ChunkWriter:
+
+    # Counterpart of ChunkReader. Nested chunks are serialized in a single
+    # pass into one buffer: a chunk header is written with a zero size when
+    # the chunk is opened and its size is backpatched when it's closed, so
+    # parent chunks never copy their children.
+
+    #######################################################
+    def __init__(self):
+        self.data = bytearray()
+        self._chunks = []
+
+    #######################################################
+    def tell(self):
+        return len(self.data)
+
+    #######################################################
+    def write(self, data):
+        self.data += data
+
+    #######################################################
+    def patch(self, offset, data):
+        self.data[offset:offset+len(data)] = data
+
+    #######################################################
+    def begin_chunk(self, type):
+        self._chunks.append(self.tell())
+        self.write(pack("<III", type, 0, Sections.library_id))
+
+    #######################################################
+    def end_chunk(self):
+        offset = self._chunks.pop()
+        self.patch(offset + 4, pack("<I", self.tell() - offset - 12))
+
+    #######################################################
+    @contextmanager
+    def chunk(self, type):
+        self.begin_chunk(type)
+        yield self
+        self.end_chunk()
+
+    #######################################################
+    def write_chunk(self, data, type):
+        self.write(pack("<III", type, len(data), Sections.library_id))
+        self.write(data)
+
+#######################################################
+class FileChunkWriter(ChunkWriter):
+
+    # ChunkWriter streaming straight into a seekable file object. Chunk sizes
+    # are backpatched by seeking back to the header, so only the chunk being
+    # written is ever held in memory.
+
+    #######################################################
+    def __init__(self, file):
+        super().__init__()
+        self.file = file
+        self.data = None
+
+    #######################################################
+    def tell(self):
+        return self.file.tell()
+
+    #######################################################
+    def write(self, data):
+        self.file.write(data)
+
+    #######################################################
+    def patch(self, offset, data):
+        end = self.file.tell()
+        self.file.seek(offset)
+        self.file.write(data)
+        self.file.seek(end)
+
 #######################################################
 class Sections:
 
@@ -205,6 +428,64 @@ class Sections:
         else:
             raise NotImplementedError("unknown type", type)
 
+    #######################################################
+    def read_stream(type, data, offset, count):
+
+        # Reads `count` consecutive elements of a homogeneous type (e.g. "<3f")
+        # with a single copy into a typed array instead of unpacking them one
+        # by one. The returned view materializes the namedtuples on access.
+        unpacker = Sections.formats[type]
+        width, typecode = int(unpacker[1:-1]), unpacker[-1]
+
+        buffer = array(typecode)
+        size = count * width * buffer.itemsize
+        stream = data[offset:offset + size]
+        if len(stream) != size:
+            raise StructError("stream of %d %s requires a buffer of %d bytes"
+                              % (count, type.__name__, size))
+
+        buffer.frombytes(stream)
+        if sys.byteorder != 'little':
+            buffer.byteswap()
+
+        return StreamView(type, width, buffer)
+
+    #######################################################
+    def compact_stream(type, items):
+
+        # Packs a sequence of namedtuples (or another view) into the typed
+        # array read_stream would have produced for the same data
+        unpacker = Sections.formats[type]
+        width, typecode = int(unpacker[1:-1]), unpacker[-1]
+
+        if isinstance(items, StreamView):
+            if items.buffer.typecode == typecode:
+                return items
+            return StreamView(type, width, array(typecode, items.buffer))
+
+        if not items:
+            return items
+
+        return StreamView(type, width, array(typecode, chain.from_iterable(items)))
+
+    #######################################################
+    def write_stream(type, items):
+
+        # Packs a whole sequence of a homogeneous type with a single call,
+        # straight from the typed array when it's a StreamView
+        unpacker = Sections.formats[type]
+        width, typecode = int(unpacker[1:-1]), unpacker[-1]
+
+        if isinstance(items, StreamView):
+            buffer = items.buffer
+            if buffer.typecode != typecode or sys.byteorder != 'little':
+                buffer = array(typecode, buffer)
+                if sys.byteorder != 'little':
+                    buffer.byteswap()
+            return buffer.tobytes()
+
+        return pack("<%d%s" % (len(items) * width, typecode), *chain.from_iterable(items))
+
     #######################################################
     def pad_string(str):
 
@@ -268,6 +549,59 @@ class Sections:
     def set_library_id(version, build):
         Sections.library_id = Sections.get_library_id(version,build)
         
+#######################################################
+class StreamView(Sequence):
+
+    # Read-only sequence over a flat typed array, e.g. the "x y z" floats of
+    # all vertices in a geometry. The flat array is exposed as `buffer` for
+    # bulk consumers, while indexing and iteration still yield namedtuples.
+
+    __slots__ = [
+        'type',
+        'width',
+        'buffer'
+    ]
+
+    #######################################################
+    def __init__(self, type, width, buffer):
+        self.type   = type
+        self.width  = width
+        self.buffer = buffer
+
+    #######################################################
+    def __len__(self):
+        return len(self.buffer) // self.width
+
+    #######################################################
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        length = len(self)
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError("stream index out of range")
+
+        start = index * self.width
+        return self.type._make(self.buffer[start:start + self.width])
+
+    #######################################################
+    def __iter__(self):
+        return map(self.type._make, zip(*[iter(self.buffer)] * self.width))
+
+    #######################################################
+    def __eq__(self, other):
+        if isinstance(other, StreamView):
+            return self.width == other.width and self.buffer == other.buffer
+        if isinstance(other, Sequence):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    #######################################################
+    def __repr__(self):
+        return "StreamView(%s, %d)" % (self.type.__name__, len(self))
+
 #######################################################
 class Texture:
 
@@ -977,7 +1311,7 @@ class SkinPLG:
                 self.bones_used.append(unpack_from("<B", data, pos)[0])
 
             pos = 4 + self._num_used_bones
-            vertices_count = len(geometry.vertices)
+            vertices_count = geometry.get_vertex_count()
 
             # Read vertex bone indices
             _data = unpack_from("<%dB" % (vertices_count * 4), data, pos)
@@ -1059,7 +1393,7 @@ class ExtraVertColorExtension:
         magic = unpack_from("<I", data, offset)[0]
         if magic != 0:
             colors = []
-            for i in range(len(geometry.vertices)):
+            for i in range(geometry.get_vertex_count()):
 
                 offset += 4
                 colors.append(
@@ -1257,7 +1591,7 @@ class PedAttractor2dfx:
         self.queue_direction = Sections.read(Vector, data, offset + 4)
         self.use_direction = Sections.read(Vector, data, offset + 16)
         self.forward_direction = Sections.read(Vector, data, offset + 28)
-        external_script = data[offset + 40:offset + 48]
+        external_script = unpack_from("<8s", data, offset + 40)[0]
         self.ped_existing_probability, self.unk = unpack_from("<II", data, offset + 48)
 
         self.external_script = external_script[:strlen(external_script)].decode('ascii')
@@ -1795,8 +2129,18 @@ class Geometry:
         '_num_triangles',
         '_num_vertices',
         '_vertex_bone_weights',
-        '_hasMatFX'
+        '_hasMatFX',
+        '_lazy_loaders'
     ]
+
+    # Streams that lazily loaded geometries decode on first access
+    lazy_streams = (
+        'triangles',
+        'vertices',
+        'prelit_colors',
+        'uv_layers',
+        'normals'
+    )
     
     ##################################################################
     def __init__(self):
@@ -1830,16 +2174,39 @@ class Geometry:
             "exclude_geo_faces"  : False,
         }
         self._hasMatFX = False
+        self._lazy_loaders = []
 
     #######################################################
-    @staticmethod
-    def from_mem(data, parent_chunk):
+    def __getattr__(self, name):
+
+        # Only called for unset slots, i.e. streams of a lazy geometry
+        if name in Geometry.lazy_streams and self._lazy_loaders:
+            loaders, self._lazy_loaders = self._lazy_loaders, []
+
+            for stream in Geometry.lazy_streams:
+                if not hasattr(self, stream):
+                    setattr(self, stream, [])
 
-        # Note: In the following function, I have used a loop
-        #      to load the texture coordinates or prelit colors,
-        #      although I feel that it might be more efficient to
-        #      convert an array to an array of namedtuples.
-        #      I have not found a way yet to implement such a function.
+            for loader in loaders:
+                loader()
+
+            return getattr(self, name)
+
+        raise AttributeError("'Geometry' object has no attribute '%s'" % name)
+
+    #######################################################
+    def defer(self, loader):
+
+        # Runs the loader along with the streams of a lazy geometry, or right
+        # away if they're already loaded
+        if self._lazy_loaders:
+            self._lazy_loaders.append(loader)
+        else:
+            loader()
+
+    #######################################################
+    @staticmethod
+    def from_mem(data, parent_chunk, lazy=False):
 
         self = Geometry()
         
@@ -1854,64 +2221,119 @@ class Geometry:
             self.surface_properties = Sections.read(GeomSurfPro, data, pos)
             pos = 28
 
+        # Skip over the streams, their size is known from the header
+        streams_pos = pos
+        if self.flags & rpGEOMETRYNATIVE == 0:
+            if self.flags & rpGEOMETRYPRELIT:
+                pos += 4 * self._num_vertices
+            pos += 8 * self._num_vertices * self.get_tex_count()
+            pos += 8 * self._num_triangles
+
+        # Read  morph targets (This should be only once)
+        self.bounding_sphere = Sections.read(Sphere, data, pos)
+        
+        pos += 16
+        self.has_vertices = unpack_from("<I", data, pos)[0]
+        self.has_normals = unpack_from("<I", data, pos + 4)[0]
+        pos += 8
+
+        if self.has_vertices:
+            pos += 12 * self._num_vertices
+        if self.has_normals:
+            pos += 12 * self._num_vertices
+
+        if lazy:
+            # Keep a copy of the streams to decode them on first access
+            streams = bytes(data[streams_pos:pos])
+            for stream in Geometry.lazy_streams:
+                delattr(self, stream)
+            self._lazy_loaders.append(lambda: self.read_streams(streams, 0))
+        else:
+            self.read_streams(data, streams_pos)
+
+        return self
+
+    #######################################################
+    def get_vertex_count(self):
+
+        # Known from the header without decoding the streams, unless the
+        # vertices come from native data
+        if self.flags & rpGEOMETRYNATIVE:
+            return len(self.vertices)
+
+        return self._num_vertices if self.has_vertices else 0
+
+    #######################################################
+    def get_tex_count(self):
+        if self.flags & (rpGEOMETRYTEXTURED | rpGEOMETRYTEXTURED2) == 0:
+            return 0
+
+        texCount = (self.flags & 0x00FF0000) >> 16
+        if texCount == 0:
+            texCount = 2 if (self.flags & rpGEOMETRYTEXTURED2) else \
+                1 if (self.flags & rpGEOMETRYTEXTURED) else 0
+
+        return texCount
+
+    #######################################################
+    def read_streams(self, data, pos):
+
+        # Vertex streams are read in bulk into typed arrays, see StreamView
         if self.flags & rpGEOMETRYNATIVE == 0:
 
             # Read prelighting colors
             if self.flags & rpGEOMETRYPRELIT:
-                self.prelit_colors = []
-                
-                for i in range(self._num_vertices):
-                    prelit_color = Sections.read(RGBA, data, pos)
-                    self.prelit_colors.append(prelit_color)
-
-                    pos += 4
+                self.prelit_colors = Sections.read_stream(
+                    RGBA, data, pos, self._num_vertices)
+                pos += 4 * self._num_vertices
 
             # Read Texture Mapping coordinates
             if self.flags & (rpGEOMETRYTEXTURED | rpGEOMETRYTEXTURED2):
-                texCount = (self.flags & 0x00FF0000) >> 16
-                if texCount == 0:
-                    texCount = 2 if (self.flags & rpGEOMETRYTEXTURED2) else \
-                        1 if (self.flags & rpGEOMETRYTEXTURED) else 0
-
                 self.uv_layers = []
-                for i in range(texCount):
-
-                    self.uv_layers.append([]) #add empty new layer
-                    
-                    for j in range(self._num_vertices):
-                        
-                        tex_coord = Sections.read(TexCoords, data, pos)
-                        self.uv_layers[i].append(tex_coord)
-                        pos += 8
+                for i in range(self.get_tex_count()):
+                    self.uv_layers.append(Sections.read_stream(
+                        TexCoords, data, pos, self._num_vertices))
+                    pos += 8 * self._num_vertices
 
             # Read Triangles
-            for i in range(self._num_triangles):
-                triangle = Sections.read(Triangle, data, pos)
-                self.triangles.append(triangle)
-                
-                pos += 8
+            self.triangles = Sections.read_stream(
+                Triangle, data, pos, self._num_triangles)
+            pos += 8 * self._num_triangles
 
-        # Read  morph targets (This should be only once)
-        self.bounding_sphere = Sections.read(Sphere, data, pos)
-        
-        pos += 16
-        self.has_vertices = unpack_from("<I", data, pos)[0]
-        self.has_normals = unpack_from("<I", data, pos + 4)[0]
-        pos += 8
+        # Skip bounding sphere and has_vertices, has_normals
+        pos += 24
 
         # read vertices
         if self.has_vertices:
-            for i in range(self._num_vertices):
-                vertice = Sections.read(Vector, data, pos)
-                self.vertices.append(vertice)
-                pos += 12
+            self.vertices = Sections.read_stream(
+                Vector, data, pos, self._num_vertices)
+            pos += 12 * self._num_vertices
             
         # read normals
         if self.has_normals:
-            for i in range(self._num_vertices):
-                normal = Sections.read(Vector, data, pos)
-                self.normals.append(normal)
-                pos += 12
+            self.normals = Sections.read_stream(
+                Vector, data, pos, self._num_vertices)
+            pos += 12 * self._num_vertices
+
+    #######################################################
+    def compact(self):
+
+        # Keeps every vertex and index stream as a flat typed array (float32
+        # positions, uint16 triangles, uint8 colors) behind a StreamView,
+        # instead of lists holding a namedtuple per element
+        self.vertices      = Sections.compact_stream(Vector, self.vertices)
+        self.normals       = Sections.compact_stream(Vector, self.normals)
+        self.prelit_colors = Sections.compact_stream(RGBA, self.prelit_colors)
+        self.triangles     = Sections.compact_stream(Triangle, self.triangles)
+        self.uv_layers     = [Sections.compact_stream(TexCoords, layer) for layer in self.uv_layers]
+
+        if 'mat_split' in self.extensions:
+            self.extensions['mat_split'] = Sections.compact_stream(
+                Triangle, self.extensions['mat_split'])
+
+        extra_vert_color = self.extensions.get('extra_vert_color')
+        if extra_vert_color is not None:
+            extra_vert_color.colors = Sections.compact_stream(RGBA, extra_vert_color.colors)
 
         return self
 
@@ -1971,6 +2393,11 @@ class Geometry:
             data += self.write_bin_split()
         
         for extension in self.extensions:
+
+            # Read back from the Bin Mesh PLG, which is rebuilt above
+            if extension == 'mat_split':
+                continue
+
             if self.extensions[extension] is not None:
                 data += self.extensions[extension].to_mem()
 
@@ -1983,6 +2410,13 @@ class Geometry:
     #######################################################
     def to_mem(self, extra_extensions = []):
 
+        writer = ChunkWriter()
+        self.write(writer, extra_extensions)
+        return writer.data
+
+    #######################################################
+    def write(self, writer, extra_extensions = []):
+
         # Set flags
         flags = rpGEOMETRYPOSITIONS
         if self.export_flags["triangle_strip"]:
@@ -2001,78 +2435,76 @@ class Geometry:
 
         flags |= (len(self.uv_layers) & 0xff) << 16
 
-        data = bytearray()
-        data += pack("<IIII",
-                     flags,
-                     len(self.triangles) if not self.export_flags["exclude_geo_faces"] else 0,
-                     len(self.vertices),
-                     1)
+        writer.begin_chunk(types["Geometry"])
+        writer.begin_chunk(types["Struct"])
+
+        writer.write(pack("<IIII",
+                          flags,
+                          len(self.triangles) if not self.export_flags["exclude_geo_faces"] else 0,
+                          len(self.vertices),
+                          1))
 
         # Only present in older RW
         if Sections.get_rw_version() < 0x34000:
-            data += Sections.write(GeomSurfPro, self.surface_properties)
+            writer.write(Sections.write(GeomSurfPro, self.surface_properties))
+
+        # Streams are packed with one call each
 
         # Write pre-lit colors
         if flags & rpGEOMETRYPRELIT:
-            for color in self.prelit_colors:
-                data += Sections.write(RGBA, color)
+            writer.write(Sections.write_stream(RGBA, self.prelit_colors))
 
         # Write UV Layers
         for uv_layer in self.uv_layers:
-            for tex_coord in uv_layer:
-                data += Sections.write(TexCoords, tex_coord)
+            writer.write(Sections.write_stream(TexCoords, uv_layer))
 
         # Write Triangles
         if not self.export_flags["exclude_geo_faces"]:
-            for triangle in self.triangles:
-                data += Sections.write(Triangle, triangle)
+            writer.write(Sections.write_stream(Triangle, self.triangles))
 
         # Bounding sphere and has_vertices, has_normals
-        data += Sections.write(Sphere, self.bounding_sphere)
-        data += pack("<II",
-                     1 if len(self.vertices) > 0 else 0,
-                     1 if flags & rpGEOMETRYNORMALS else 0)
+        writer.write(Sections.write(Sphere, self.bounding_sphere))
+        writer.write(pack("<II",
+                          1 if len(self.vertices) > 0 else 0,
+                          1 if flags & rpGEOMETRYNORMALS else 0))
 
         # Write Vertices
-        for vertex in self.vertices:
-            data += Sections.write(Vector, vertex)
+        writer.write(Sections.write_stream(Vector, self.vertices))
 
         # Write Normals
         if flags & rpGEOMETRYNORMALS:
-            for normal in self.normals:
-                data += Sections.write(Vector, normal)
+            writer.write(Sections.write_stream(Vector, self.normals))
+
+        writer.end_chunk()
 
-        data = Sections.write_chunk(data, types["Struct"])
-        
         # Write Material List and extensions
-        data += self.material_list_to_mem()
-        data += self.extensions_to_mem(extra_extensions)
-        return Sections.write_chunk(data, types["Geometry"])
+        writer.write(self.material_list_to_mem())
+        writer.write(self.extensions_to_mem(extra_extensions))
+
+        writer.end_chunk()
 
 #######################################################
 
 
-class dff:
+class dff(ChunkReader):
 
-    #######################################################
-    def _read(self, size):
-        current_pos = self.pos
-        self.pos += size
-        
-        return current_pos
+    # Compact the streams of every loaded geometry, see Geometry.compact
+    compact_geometry = False
 
-    #######################################################
-    def raw(self, size, offset=None):
+    # Sections to parse, the others are skipped over
+    load_sections = DffSection.ALL
 
-        if offset is None:
-            offset = self.pos
-        
-        return self.data[offset:offset+size]
+    # Decode geometry streams and native data only when first accessed
+    lazy_geometry = False
 
-    #######################################################
-    def read_chunk(self):
-        chunk = Sections.read(Chunk, self.data, self._read(12))
-        return chunk
+    # Clump children that can be left out of load_sections
+    chunk_sections = {
+        types["Frame List"]           : DffSection.FRAMES,
+        types["Geometry List"]        : DffSection.GEOMETRY,
+        types["Atomic"]               : DffSection.ATOMICS,
+        types["Collision Model"]      : DffSection.COLLISION,
+        types["SAMP Collision Model"] : DffSection.COLLISION,
+    }
 
     #######################################################
     def read_frame_list(self, parent_chunk):
@@ -2107,7 +2539,7 @@ class dff:
                 animation_data = None
 
                 if chunk.type == types["Frame"]:
-                    name = self.raw(strlen(self.data,self.pos)).decode("utf-8")
+                    name = bytes(self.raw(strlen(self.data,self.pos))).decode("utf-8")
                     
                 elif chunk.type == types["HAnim PLG"]:
                     bone_data = HAnimPLG.from_mem(self.raw(chunk.size))
@@ -2139,11 +2571,10 @@ class dff:
 
     #######################################################
     def read_mesh_plg(self, parent_chunk, geometry):
-        triangles = []
+        triangles = array('H')
         
         _Header      = namedtuple("_Header","flags mesh_count total_indices")
         _SplitHeader = namedtuple("_SplitHeader","indices_count material")
-        _Triangle    = namedtuple("_Triangle", "a b c")
         
         header = _Header._make(unpack_from("<III", self.data, self._read(12)))
 
@@ -2171,71 +2602,77 @@ class dff:
                 if not has_indices:
                     continue
 
-            unpack_format = "<H" if opengl else "<H2x"
-            total_iterations = split_header.indices_count
-            
-            # Read 3 integers instead of 1 incase of triangle lists
-            if not is_tri_strip: 
-                unpack_format = "<" + (unpack_format[1:] * 3)
-                total_iterations //= 3
+            # Triangle lists ignore trailing indices that don't make a triangle
+            indices_count = split_header.indices_count
+            if not is_tri_strip:
+                indices_count -= indices_count % 3
+
+            indices = self.read_mesh_indices(indices_count, opengl)
 
-            previous_vertices = []
-            for j in range(total_iterations):
+            if is_tri_strip:
+                triangles += dff.strip_to_triangles(indices, split_header.material)
+            else:
+                triangles += dff.list_to_triangles(indices, split_header.material)
 
-                # Read Triangle Strip
-                if is_tri_strip:
+        geometry.extensions['mat_split'] = StreamView(Triangle, 4, triangles)
 
-                    vertex = unpack_from(
-                        unpack_format,
-                        self.data,
-                        self._read(2 if opengl else 4)
-                    )[0]
+    #######################################################
+    def read_mesh_indices(self, count, opengl):
 
-                    if len(previous_vertices) < 2:
-                        previous_vertices.append(vertex)
-                        continue
+        # 16 bit indices, or the low half of 32 bit ones
+        index_size = 2 if opengl else 4
+        size = count * index_size
 
-                    if(j % 2 == 0):
-                        triangle = Triangle(
-                            previous_vertices[1],
-                            previous_vertices[0],
-                            split_header.material,
-                            vertex
-                        )
-                    else:
-                        triangle = Triangle(
-                            previous_vertices[0],
-                            previous_vertices[1],
-                            split_header.material,
-                            vertex
-                        )
-                
-                    previous_vertices[0] = previous_vertices[1]
-                    previous_vertices[1] = vertex
+        data = self.raw(size)
+        if len(data) != size:
+            raise StructError("mesh of %d indices requires a buffer of %d bytes"
+                              % (count, size))
+        self._read(size)
 
-                # Read Triangle List
-                else:
+        indices = array('H')
+        indices.frombytes(data)
+        if sys.byteorder != 'little':
+            indices.byteswap()
 
-                    _triangle = _Triangle._make(
-                        unpack_from(
-                            unpack_format,
-                            self.data,
-                            self._read(6 if opengl else 12)
-                        )
-                    )
+        return indices if opengl else indices[0::2]
 
-                    triangle = Triangle._make(
-                        (
-                            _triangle.b,
-                            _triangle.a,
-                            split_header.material,
-                            _triangle.c
-                        )
-                    )
+    #######################################################
+    @staticmethod
+    def interleave_triangles(b, a, material, c):
 
-                triangles.append(triangle)
+        # Flat "b a material c" stream of Triangles
+        triangles = array('H', bytes(8 * len(c)))
+        triangles[0::4] = b
+        triangles[1::4] = a
+        triangles[2::4] = array('H', [material]) * len(c)
+        triangles[3::4] = c
 
-        geometry.extensions['mat_split'] = triangles
+        return triangles
+
+    #######################################################
+    @staticmethod
+    def list_to_triangles(indices, material):
+        return dff.interleave_triangles(indices[1::3], indices[0::3], material, indices[2::3])
+
+    #######################################################
+    @staticmethod
+    def strip_to_triangles(indices, material):
+
+        # Every index after the first two makes a triangle with the previous two,
+        # with the winding flipped on every other one
+        first, second, third = indices[:-2], indices[1:-1], indices[2:]
+
+        b = array('H', first)
+        b[0::2] = second[0::2]
+        a = array('H', second)
+        a[0::2] = first[0::2]
+
+        # Drop the degenerate triangles used to stitch strips together
+        valid = bytes(map(and_, map(and_, map(ne, a, b), map(ne, b, third)), map(ne, a, third)))
+        if not all(valid):
+            b, a, third = (array('H', compress(s, valid)) for s in (b, a, third))
+
+        return dff.interleave_triangles(b, a, material, third)
 
     #######################################################
     def read_native_data_plg(self, parent_chunk, geometry):
@@ -2245,20 +2682,18 @@ class dff:
             chunk_size = parent_chunk.size - 16
 
             platform = unpack_from("<I", self.data, self._read(4))[0]
+            data = self.raw(chunk_size)
 
             if platform == NativePlatformType.PS2:
-                from .native_ps2 import NativePS2Geometry
-                NativePS2Geometry.unpack(geometry, self.raw(chunk_size))
+                from .native_ps2 import NativePS2Geometry as NativeGeometry
             elif platform == NativePlatformType.XBOX:
-                from .native_xbox import NativeXboxGeometry
-                NativeXboxGeometry.unpack(geometry, self.raw(chunk_size))
+                from .native_xbox import NativeXboxGeometry as NativeGeometry
             elif platform == NativePlatformType.GC:
-                from .native_gc import NativeGCGeometry
-                NativeGCGeometry.unpack(geometry, self.raw(chunk_size))
+                from .native_gc import NativeGCGeometry as NativeGeometry
             elif platform == NativePlatformType.PSP:
-                from .native_psp import NativePSPGeometry
-                NativePSPGeometry.unpack(geometry, self.raw(chunk_size))
+                from .native_psp import NativePSPGeometry as NativeGeometry
             else:
+                NativeGeometry = None
                 print("Unsupported native platform %d" % (platform))
 
             geometry.native_platform_type = platform
@@ -2266,9 +2701,15 @@ class dff:
         else:
             chunk_size = parent_chunk.size
             self.pos -= 12
+            data = self.raw(chunk_size)
+
+            from .native_wdgl import NativeWDGLGeometry as NativeGeometry
 
-            from .native_wdgl import NativeWDGLGeometry
-            NativeWDGLGeometry.unpack(geometry, self.data[self.pos:])
+        if NativeGeometry is not None:
+            # Lazy geometries keep a copy of the data, the file may be unmapped
+            if self.lazy_geometry:
+                data = bytes(data)
+            geometry.defer(lambda: NativeGeometry.unpack(geometry, data))
 
         self._read(chunk_size)
 
@@ -2397,17 +2838,17 @@ class dff:
         
         # Texture Name
         chunk = self.read_chunk()
-        texture.name = self.raw(
+        texture.name = bytes(self.raw(
             strlen(self.data,self.pos)
-        ).decode("utf-8")
+        )).decode("utf-8")
         
         self._read(chunk.size)
         
         # Mask Name
         chunk = self.read_chunk()  
-        texture.mask = self.raw(
+        texture.mask = bytes(self.raw(
             strlen(self.data,self.pos)
-        ).decode("utf-8")
+        )).decode("utf-8")
         
         self._read(chunk.size)
         return texture
@@ -2505,13 +2946,13 @@ class dff:
                                         # Read n animations
                                         for i in range(anim_count[0]):
                                             material.add_plugin('uv_anim',
-                                                                self.raw(
+                                                                bytes(self.raw(
                                                                     strlen(
                                                                         self.data,
                                                                         self.pos
                                                                     ),
                                                                     self._read(32)
-                                                                ).decode('ascii')
+                                                                )).decode('ascii')
                                             )
                                             
                                     self.pos = __chunk_end
@@ -2548,7 +2989,7 @@ class dff:
         chunk_end = self.pos + parent_chunk.size
 
         chunk = self.read_chunk()
-        geometry = Geometry.from_mem(self.data[self.pos:], parent_chunk)
+        geometry = Geometry.from_mem(self.data[self.pos:], parent_chunk, self.lazy_geometry)
 
         self._read(chunk.size)
 
@@ -2562,7 +3003,8 @@ class dff:
                 self.read_material_list(chunk)
 
             elif chunk.type == types["Extension"]:
-                pass
+                if not self.load_sections & DffSection.GEOMETRY_EXTENSIONS:
+                    self._read(chunk.size)
 
             elif chunk.type == types["Delta Morph PLG"]:
                 delta_morph = DeltaMorphPLG.from_mem(self.data[self.pos:])
@@ -2609,6 +3051,9 @@ class dff:
             else:
                 self._read(chunk.size)
 
+        if self.compact_geometry:
+            geometry.defer(geometry.compact)
+
         self.pos = chunk_end
 
     #######################################################
@@ -2705,8 +3150,13 @@ class dff:
             while self.pos < root_end-12:
                 chunk = self.read_chunk()
 
+                # Sections left out of load_sections are skipped over
+                if chunk.type in self.chunk_sections and \
+                   not self.load_sections & self.chunk_sections[chunk.type]:
+                    self.pos += chunk.size
+
                 # FRAMELIST
-                if chunk.type == types["Frame List"]:  
+                elif chunk.type == types["Frame List"]:  
                     self.read_frame_list(chunk)
 
                 # GEOMETRYLIST
@@ -2719,7 +3169,7 @@ class dff:
 
                 elif chunk.type in (types["Collision Model"], types["SAMP Collision Model"]):
                     self.collisions.append(
-                        ExtensionColl(chunk.type, self.data[self.pos:self.pos + chunk.size])
+                        ExtensionColl(chunk.type, bytes(self.raw(chunk.size)))
                     )
                     self.pos += chunk.size
                     
@@ -2752,7 +3202,7 @@ class dff:
     #######################################################
     def load_memory(self, data):
 
-        self.data = data
+        self.data = memoryview(data)
         while self.pos < len(data) - 12:
             chunk = self.read_chunk()
 
@@ -2761,7 +3211,10 @@ class dff:
                 self.rw_version = Sections.get_rw_version(chunk.version)
 
             elif chunk.type == types["UV Animation Dictionary"]:
-                self.read_uv_anim_dict()
+                if self.load_sections & DffSection.UV_ANIMATIONS:
+                    self.read_uv_anim_dict()
+                else:
+                    self._read(chunk.size)
 
             elif chunk.type == types["Atomic"]:
                 self.read_atomic(chunk)
@@ -2781,14 +3234,7 @@ class dff:
         self.rw_version    = ""
             
     #######################################################
-    def load_file(self, filename):
-
-        with open(filename, mode='rb') as file:
-            content = file.read()
-            self.load_memory(content)
-           
-    #######################################################
-    def write_frame_list(self):
+    def write_frame_list(self, writer):
 
         data = bytearray()
 
@@ -2797,36 +3243,30 @@ class dff:
         for frame in self.frame_list:
             data += frame.header_to_mem()
 
-        data = Sections.write_chunk(data, types["Struct"])
-        
-        for frame in self.frame_list:
-            data += frame.extensions_to_mem()
+        with writer.chunk(types["Frame List"]):
+            writer.write_chunk(data, types["Struct"])
 
-        return Sections.write_chunk(data, types["Frame List"])
+            for frame in self.frame_list:
+                writer.write(frame.extensions_to_mem())
 
     #######################################################
-    def write_geometry_list(self):
-        data = bytearray()
-        data += pack("<I", len(self.geometry_list))
+    def write_geometry_list(self, writer):
 
-        data = Sections.write_chunk(data, types["Struct"])
-        
-        for index, geometry in enumerate(self.geometry_list):
+        with writer.chunk(types["Geometry List"]):
+            writer.write_chunk(pack("<I", len(self.geometry_list)), types["Struct"])
 
-            # Append 2dfx to extra extensions in the last geometry
-            extra_extensions = []
-            if index == len(self.geometry_list) - 1 and not self.ext_2dfx.is_empty():
-                extra_extensions.append(self.ext_2dfx)
-            
-            data += geometry.to_mem(extra_extensions)
-        
-        return Sections.write_chunk(data, types["Geometry List"])
+            for index, geometry in enumerate(self.geometry_list):
+
+                # Append 2dfx to extra extensions in the last geometry
+                extra_extensions = []
+                if index == len(self.geometry_list) - 1 and not self.ext_2dfx.is_empty():
+                    extra_extensions.append(self.ext_2dfx)
+
+                geometry.write(writer, extra_extensions)
 
     #######################################################
-    def write_atomic(self, atomic):
+    def write_atomic(self, writer, atomic):
 
-        data = atomic.to_mem()
-        data = Sections.write_chunk(data, types["Struct"])
         geometry = self.geometry_list[atomic.geometry]
 
         ext_data = bytearray()
@@ -2859,65 +3299,75 @@ class dff:
                 types["SkyGFX"]
             )
 
-        data += Sections.write_chunk(ext_data, types["Extension"])
-        return Sections.write_chunk(data, types["Atomic"])
+        with writer.chunk(types["Atomic"]):
+            writer.write_chunk(atomic.to_mem(), types["Struct"])
+            writer.write_chunk(ext_data, types["Extension"])
 
     #######################################################
-    def write_uv_dict(self):
+    def write_uv_dict(self, writer):
 
         if len(self.uvanim_dict) < 1:
-            return bytearray()
-        
-        data = pack("<I", len(self.uvanim_dict))
-        data = Sections.write_chunk(data, types["Struct"])
-        
-        for dictionary in self.uvanim_dict:
-            data += dictionary.to_mem()
+            return
+
+        with writer.chunk(types["UV Animation Dictionary"]):
+            writer.write_chunk(pack("<I", len(self.uvanim_dict)), types["Struct"])
 
-        return Sections.write_chunk(data, types["UV Animation Dictionary"])
+            for dictionary in self.uvanim_dict:
+                writer.write(dictionary.to_mem())
 
     #######################################################
-    def write_clump(self):
+    def write_clump(self, writer):
 
-        data = Sections.write(Clump, (len(self.atomic_list), 0,0), types["Struct"])
+        with writer.chunk(types["Clump"]):
 
-        # Old RW versions didn't have cameras and lights in their clump structure
-        if Sections.get_rw_version() < 0x33000:
-            data = Sections.write_chunk(pack("<I",
-                                             len(self.atomic_list)),
-                                        types["Struct"])
-            
-        data += self.write_frame_list()
-        data += self.write_geometry_list()
+            # Old RW versions didn't have cameras and lights in their clump structure
+            if Sections.get_rw_version() < 0x33000:
+                writer.write_chunk(pack("<I", len(self.atomic_list)), types["Struct"])
+            else:
+                writer.write(Sections.write(Clump, (len(self.atomic_list), 0,0), types["Struct"]))
 
-        for atomic in self.atomic_list:
-            data += self.write_atomic(atomic)
+            self.write_frame_list(writer)
+            self.write_geometry_list(writer)
+
+            for atomic in self.atomic_list:
+                self.write_atomic(writer, atomic)
+
+            for coll in self.collisions:
+                _data = Sections.write_chunk(coll.data, coll.ext_type)
+                writer.write_chunk(_data, types["Extension"])
+
+            writer.write_chunk(b"", types["Extension"])
 
-        for coll in self.collisions:
-            _data = Sections.write_chunk(coll.data, coll.ext_type)
-            data += Sections.write_chunk(_data, types["Extension"])
-            
-        data += Sections.write_chunk(bytearray(), types["Extension"])
-            
-        return Sections.write_chunk(data, types["Clump"])
-    
     #######################################################
-    def write_memory(self, version):
+    def write(self, writer, version):
 
-        data = bytearray()
         Sections.set_library_id(version, 0xFFFF)
 
-        data += self.write_uv_dict()
-        data += self.write_clump()
+        self.write_uv_dict(writer)
+        self.write_clump(writer)
 
-        return data
+    #######################################################
+    def write_memory(self, version):
+
+        writer = ChunkWriter()
+        self.write(writer, version)
+
+        return writer.data
             
+    #######################################################
+    def write_file_object(self, file, version):
+
+        # Stream into the file when it can seek back to patch chunk sizes
+        if file.seekable():
+            self.write(FileChunkWriter(file), version)
+        else:
+            file.write(self.write_memory(version))
+
     #######################################################
     def write_file(self, filename, version):
 
         with open(filename, mode='wb') as file:
-            content = self.write_memory(version)
-            file.write(content)
+            self.write_file_object(file, version)
             
     #######################################################
     def __init__(self):
@@ -14,10 +14,15 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import mmap
 import os
 
+from bisect import bisect_left
 from dataclasses import dataclass
-from struct import unpack, unpack_from
+from struct import iter_unpack, pack, unpack, unpack_from
+
+SECTOR_SIZE = 2048
+COPY_CHUNK_SIZE = 1024 * 1024
 
 #######################################################
 @dataclass
@@ -33,45 +38,117 @@ class DirectoryEntry:
         name = name.split(b'\0', 1)[0].decode('utf-8')
         return cls(offset, size, name)
 
+    #######################################################
+    def write_to_memory(self):
+        return pack("II24s", self.offset, self.size, self.name.encode('utf-8'))
+
 #######################################################
 class img:
 
     #######################################################
     def load_dir_memory(self, data):
-        data_len = len(data)
-        for pos in range(0, data_len, 32):
-            entry = DirectoryEntry.read_from_memory(data, pos)
-            self.directory_entries.append(entry)
+        data_len = len(data) - len(data) % 32
+        for offset, size, name in iter_unpack("II24s", data[:data_len]):
+            name = name.split(b'\0', 1)[0].decode('utf-8')
+            self.directory_entries.append(DirectoryEntry(offset, size, name))
+
+        self.index_entries()
+
+    #######################################################
+    def index_entries(self):
+
+        # Case insensitive name index, the first entry wins on duplicates
+        self.entries_lookup = {}
+        for idx, entry in enumerate(self.directory_entries):
+            self.entries_lookup.setdefault(entry.name.lower(), idx)
 
     #######################################################
     def clear(self):
         self.directory_entries:list[DirectoryEntry] = []
+        self.entries_lookup:dict[str, int] = {}
         self.entry_idx = 0
 
     #######################################################
     @classmethod
-    def open(cls, filename):
-        file = open(filename, mode='rb')
+    def open(cls, filename, writable=False):
+        file = open(filename, mode='r+b' if writable else 'rb')
         self = cls(file)
+        self.writable = writable
 
-        magic, entries_num = unpack("4sI", file.read(8))
+        header = file.read(8)
+        magic, entries_num = unpack("4sI", header) if len(header) == 8 else (b"", 0)
 
         if magic == b"VER2":
+            self.version = 2
             dir_data = file.read(entries_num * 32)
             self.load_dir_memory(dir_data)
 
         else:
-            dir_filename = os.path.splitext(filename)[0] + '.dir'
-            with open(dir_filename, mode='rb') as dir_file:
+            self.version = 1
+            self.dir_filename = os.path.splitext(filename)[0] + '.dir'
+            with open(self.dir_filename, mode='rb') as dir_file:
                 dir_data = dir_file.read()
                 self.load_dir_memory(dir_data)
 
         file.seek(0, os.SEEK_SET)
+        self.map_file()
+
+        return self
+
+    #######################################################
+    @classmethod
+    def create(cls, filename, version=2):
+
+        # Creates an empty archive opened for writing. Version 1 archives
+        # keep their directory in a separate .dir file next to the .img
+        file = open(filename, mode='w+b')
+        self = cls(file)
+        self.writable = True
+        self.version = version
+
+        if version == 1:
+            self.dir_filename = os.path.splitext(filename)[0] + '.dir'
+
+        self._dirty = True
+        self.flush()
 
         return self
 
+    #######################################################
+    def map_file(self):
+
+        # The whole archive is mapped once, entries are then returned as
+        # views into the mapping without reading or copying them
+        try:
+            self._mapping = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._view = memoryview(self._mapping)
+        except ValueError:
+            self._mapping = None # empty archive
+            self._view = memoryview(b"")
+
+    #######################################################
+    def unmap_file(self):
+        view, mapping = self._view, self._mapping
+        self._view, self._mapping = None, None
+
+        try:
+            if view is not None:
+                view.release()
+            if mapping is not None:
+                mapping.close()
+
+        # Entry views are still alive, the mapping is then closed once they
+        # are garbage collected
+        except BufferError:
+            pass
+
     #######################################################
     def close(self):
+        if self._file and not self._file.closed:
+            self.flush()
+
+        self.unmap_file()
+
         if self._file and not self._file.closed:
             self._file.close()
 
@@ -82,21 +159,297 @@ class img:
 
         if 0 <= entry_idx < len(self.directory_entries):
             entry = self.directory_entries[entry_idx]
-            self._file.seek(entry.offset * 2048, os.SEEK_SET)
-            return entry.name, self._file.read(entry.size * 2048)
+
+            # Mapping was dropped by a write
+            if self._view is None:
+                self._file.flush()
+                self.map_file()
+
+            offset = entry.offset * SECTOR_SIZE
+            return entry.name, self._view[offset:offset + entry.size * SECTOR_SIZE]
 
         return "", b""
 
     #######################################################
     def find_entry_idx(self, name):
-        return next(
-            (idx for idx, entry in enumerate(self.directory_entries) if entry.name == name),
-            -1
-        )
+        return self.entries_lookup.get(name.lower(), -1)
+
+    #######################################################
+    def add_entry(self, name, source):
+
+        # Writes an entry from a bytes-like object, a file path or a binary
+        # file object, streaming the latter in chunks. An existing entry with
+        # the same name is overwritten in place if the new data fits into its
+        # sectors, otherwise it's moved to the first free range that fits.
+        # Untouched entries are never rewritten.
+        if isinstance(source, (str, os.PathLike)):
+            with open(source, mode='rb') as file:
+                return self.add_entry(name, file)
+
+        if len(name.encode('utf-8')) > 23:
+            raise ValueError("IMG entry name is too long: %s" % name)
+
+        self.prepare_write()
+
+        entry_idx = self.find_entry_idx(name)
+        if entry_idx < 0:
+            self.reserve_directory(len(self.directory_entries) + 1)
+
+            entry_idx = len(self.directory_entries)
+            self.directory_entries.append(DirectoryEntry(0, 0, name))
+            self.entries_lookup[name.lower()] = entry_idx
+
+        entry = self.directory_entries[entry_idx]
+        size = img.get_source_size(source)
+
+        # Unknown size (non seekable stream), append at the end of the archive
+        if size is None:
+            self.release_sectors(entry.offset, entry.size)
+            offset = self._end_sector
+
+        else:
+            sectors = -(-size // SECTOR_SIZE)
+            if sectors <= entry.size:
+                offset = entry.offset
+                self.release_sectors(offset + sectors, entry.size - sectors)
+            else:
+                self.release_sectors(entry.offset, entry.size)
+                offset = self.allocate_sectors(sectors)
+
+        written = self.write_payload(offset, source, size)
+
+        entry.offset = offset
+        entry.size = -(-written // SECTOR_SIZE)
+        if size is None:
+            self._end_sector = offset + entry.size
+
+        self._dirty = True
+        return entry_idx
+
+    #######################################################
+    def remove_entry(self, name):
+        entry_idx = self.find_entry_idx(name)
+        if entry_idx < 0:
+            return False
+
+        self.prepare_write()
+
+        entry = self.directory_entries.pop(entry_idx)
+        self.release_sectors(entry.offset, entry.size)
+        self.index_entries()
+
+        self._dirty = True
+        return True
+
+    #######################################################
+    def flush(self):
+        if not self._dirty:
+            return
+
+        dir_data = b''.join(entry.write_to_memory() for entry in self.directory_entries)
+
+        if self.version == 2:
+            self._file.seek(0, os.SEEK_SET)
+            self._file.write(pack("4sI", b"VER2", len(self.directory_entries)))
+            self._file.write(dir_data)
+
+        else:
+            with open(self.dir_filename, mode='wb') as dir_file:
+                dir_file.write(dir_data)
+
+        # Drop the space freed at the end of the archive
+        if self._free_ranges is not None:
+            self._file.truncate(max(self._end_sector * SECTOR_SIZE, 8 if self.version == 2 else 0))
+
+        self._file.flush()
+        self._dirty = False
+
+    #######################################################
+    def prepare_write(self):
+        if not self.writable:
+            raise RuntimeError("IMG archive is opened read-only")
+
+        # Writes go through the file object, entries are remapped on the next read
+        self.unmap_file()
+
+        if self._free_ranges is None:
+            self.build_free_ranges()
+
+    #######################################################
+    def build_free_ranges(self):
+
+        # Collects the unused sector ranges between entries. The directory of
+        # version 2 archives occupies the leading sectors.
+        if self.version == 2:
+            self._dir_sectors = img.get_directory_sectors(len(self.directory_entries))
+
+        used = sorted((entry.offset, entry.offset + entry.size)
+                      for entry in self.directory_entries if entry.size > 0)
+
+        self._free_ranges = []
+        pos = self._dir_sectors
+        for start, end in used:
+            if start > pos:
+                self._free_ranges.append([pos, start - pos])
+            pos = max(pos, end)
+
+        self._end_sector = pos
+
+    #######################################################
+    def allocate_sectors(self, sectors):
+        if sectors == 0:
+            return self._end_sector
+
+        # First fit, falling back to appending at the end of the archive
+        for idx, (start, length) in enumerate(self._free_ranges):
+            if length >= sectors:
+                if length == sectors:
+                    del self._free_ranges[idx]
+                else:
+                    self._free_ranges[idx] = [start + sectors, length - sectors]
+                return start
+
+        offset = self._end_sector
+        self._end_sector += sectors
+        return offset
+
+    #######################################################
+    def release_sectors(self, offset, sectors):
+        if sectors <= 0 or offset < self._dir_sectors:
+            return
+
+        idx = bisect_left(self._free_ranges, [offset, 0])
+        self._free_ranges.insert(idx, [offset, sectors])
+
+        # Merge with the following and the preceding range
+        if idx + 1 < len(self._free_ranges):
+            start, length = self._free_ranges[idx + 1]
+            if offset + sectors == start:
+                self._free_ranges[idx][1] += length
+                del self._free_ranges[idx + 1]
+
+        if idx > 0:
+            start, length = self._free_ranges[idx - 1]
+            if start + length == offset:
+                self._free_ranges[idx - 1][1] += self._free_ranges[idx][1]
+                del self._free_ranges[idx]
+
+        # Trailing free space shrinks the archive end instead
+        start, length = self._free_ranges[-1]
+        if start + length >= self._end_sector:
+            self._end_sector = start
+            del self._free_ranges[-1]
+
+    #######################################################
+    def reserve_directory(self, entries_num):
+        if self.version != 2:
+            return
+
+        needed = img.get_directory_sectors(entries_num)
+        while self._dir_sectors < needed:
+            sector = self._dir_sectors
+
+            # Move the entry in the way of the directory somewhere else
+            for entry in self.directory_entries:
+                if entry.offset <= sector < entry.offset + entry.size:
+                    self.move_entry(entry)
+                    break
+
+            # The sector is now either free or past the archive end
+            if self._free_ranges and self._free_ranges[0][0] == sector:
+                start, length = self._free_ranges[0]
+                if length == 1:
+                    del self._free_ranges[0]
+                else:
+                    self._free_ranges[0] = [start + 1, length - 1]
+
+            self._end_sector = max(self._end_sector, sector + 1)
+            self._dir_sectors += 1
+
+    #######################################################
+    def move_entry(self, entry):
+        offset = self.allocate_sectors(entry.size)
+
+        remaining = entry.size * SECTOR_SIZE
+        src, dst = entry.offset * SECTOR_SIZE, offset * SECTOR_SIZE
+        while remaining > 0:
+            self._file.seek(src, os.SEEK_SET)
+            chunk = self._file.read(min(COPY_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+
+            self._file.seek(dst, os.SEEK_SET)
+            self._file.write(chunk)
+
+            src += len(chunk)
+            dst += len(chunk)
+            remaining -= len(chunk)
+
+        self.release_sectors(entry.offset, entry.size)
+        entry.offset = offset
+
+    #######################################################
+    def write_payload(self, offset, source, size):
+        self._file.seek(offset * SECTOR_SIZE, os.SEEK_SET)
+
+        if hasattr(source, 'read'):
+            written = 0
+            while size is None or written < size:
+                chunk_size = COPY_CHUNK_SIZE
+                if size is not None:
+                    chunk_size = min(chunk_size, size - written)
+
+                chunk = source.read(chunk_size)
+                if not chunk:
+                    break
+
+                self._file.write(chunk)
+                written += len(chunk)
+
+        else:
+            written = self._file.write(source)
+
+        # Pad the last sector so the archive always ends on a sector boundary
+        padding = -written % SECTOR_SIZE
+        if padding:
+            self._file.write(bytes(padding))
+
+        return written
+
+    #######################################################
+    @staticmethod
+    def get_source_size(source):
+        if not hasattr(source, 'read'):
+            return memoryview(source).nbytes
+
+        if hasattr(source, 'seekable') and source.seekable():
+            pos = source.tell()
+            end = source.seek(0, os.SEEK_END)
+            source.seek(pos, os.SEEK_SET)
+            return end - pos
+
+        return None
+
+    #######################################################
+    @staticmethod
+    def get_directory_sectors(entries_num):
+        return max(1, -(-(8 + entries_num * 32) // SECTOR_SIZE))
 
     #######################################################
     def __init__(self, file):
         self._file = file
+        self._mapping = None
+        self._view = None
+
+        # used for writing
+        self.writable = False
+        self.version = 2
+        self.dir_filename = None
+        self._dirty = False
+        self._free_ranges = None
+        self._dir_sectors = 0
+        self._end_sector = 0
+
         self.clear()
 
     #######################################################
@@ -14,11 +14,17 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+from array import array
 from struct import unpack_from, calcsize
 from collections import namedtuple
 
 from .dff import RGBA, Sections, TexCoords, Triangle, Vector
-from .txd import ImageDecoder, TextureNative, PaletteType
+from .txd import ImageDecoder, TextureNative, PaletteType, SwizzlePlan
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 # geometry flags
 rpGEOMETRYTRISTRIP              = 0x00000001
@@ -502,6 +508,7 @@ class NativeGCTexture(TextureNative):
 
         self.pos = end_pos
 
+        self.data = None
         return self
 
     #######################################################
@@ -541,22 +548,55 @@ class NativeGCTexture(TextureNative):
     #######################################################
     @staticmethod
     def unswizzle(data, width, height, texture_format):
+        plan = SwizzlePlan.get(
+            ("gc", texture_format, width, height),
+            lambda: NativeGCTexture._build_unswizzle_plan(width, height, texture_format)
+        )
+        return plan.apply(data)
+
+    #######################################################
+    @staticmethod
+    def _build_unswizzle_plan(width, height, texture_format):
         bpp, bw, bh = NativeGCTexture.get_texture_block_attributes(texture_format)
         aligned_width  = NativeGCTexture.get_aligned_len(width, bw)
         aligned_height = NativeGCTexture.get_aligned_len(height, bh)
         strip_size = bpp * bw // 8
 
-        res = bytearray(aligned_width * aligned_height * bpp // 8)
-        pos = 0
+        source_size = aligned_width * aligned_height * bpp // 8
 
-        for y in range(0, aligned_height, bh):
-            for x in range(0, aligned_width, bw):
+        if numpy is not None:
+            # Tiles are stored one after another, each as bh strips
+            res = numpy.arange(source_size).reshape(aligned_height // bh, aligned_width // bw, bh, strip_size)
+            res = res.transpose(0, 2, 1, 3).ravel()
+
+        else:
+            # Source offsets of every strip, in destination order
+            tiles_x = aligned_width // bw
+            res = array('l')
+
+            for tile_y in range(aligned_height // bh):
                 for y2 in range(bh):
-                    idx = (((y + y2) * aligned_width) + x) * bpp // 8
-                    res[idx : idx+strip_size] = data[pos : pos+strip_size]
-                    pos += strip_size
+                    for tile_x in range(tiles_x):
+                        pos = ((tile_y * tiles_x + tile_x) * bh + y2) * strip_size
+                        res.extend(range(pos, pos + strip_size))
+
+        # Crop to the texture size as part of the plan
+        if aligned_width != width or aligned_height != height:
+            cropped_size = width * height * bpp // 8
+            if numpy is not None:
+                cropped = numpy.full(cropped_size, source_size)
+            else:
+                cropped = array('l', [source_size]) * cropped_size
+            lw = width * bpp // 8
+
+            for y in range(height):
+                dst = y * width * bpp // 8
+                src = y * aligned_width * bpp // 8
+                cropped[dst: dst + lw] = res[src: src + lw]
+
+            res = cropped
 
-        return NativeGCTexture.crop(res, aligned_width, aligned_height, bpp, width, height)
+        return SwizzlePlan(source_size, res)
 
     #######################################################
     @staticmethod
@@ -741,4 +781,4 @@ class NativeGCTexture(TextureNative):
     #######################################################
     def _read_raw(self, size):
         offset = self._read(size)
-        return self.data[offset:offset+size]
+        return bytes(self.data[offset:offset+size])
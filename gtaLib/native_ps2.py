@@ -14,12 +14,23 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import operator
+
+from array import array
 from struct import unpack_from, calcsize, pack
 
 from .dff import Chunk, RGBA, Sections, TexCoords, Triangle, Vector
 from .dff import ExtraVertColorExtension
 from .txd import TextureNative, RasterFormat, PaletteType
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Unswizzle tables by raster size
+_unswizzle_tables = {}
+
 # geometry flags
 rpGEOMETRYTRISTRIP              = 0x00000001
 rpGEOMETRYPOSITIONS             = 0x00000002
@@ -475,55 +486,89 @@ class NativePS2Texture(TextureNative):
                 pixels = self._read_raw(pixels_size)
                 self.pixels.append(pixels)
 
+        self.data = None
         return self
 
     #######################################################
     @staticmethod
-    def unswizzle8(data, width, height):
-        res = bytearray(width * height)
-        for y in range(height):
+    def _unswizzle_table(width, height):
+        # Source position of every destination texel, shared by 8 and 4 bit
+        # rasters (the latter are unswizzled as a stream of nibbles)
+        key = (width, height)
+        table = _unswizzle_tables.get(key)
+        if table is not None:
+            return table
+
+        if numpy is not None:
+            y = numpy.arange(height, dtype=numpy.int64)[:, None]
+            x = numpy.arange(width, dtype=numpy.int64)[None, :]
+
             block_y = (y & ~0xf) * width
             posY = (((y & ~3) >> 1) + (y & 1)) & 0x7
             swap_selector = (((y + 2) >> 2) & 0x1) * 4
-            base_column_location = posY * width * 2
+            column_location = posY * width * 2 + ((x + swap_selector) & 0x7) * 4
+            block_x = (x & ~0xf) * 2
+            byte_num = ((y >> 1) & 1) + ((x >> 2) & 2)
+            table = (block_y + block_x + column_location + byte_num).ravel()
+
+        else:
+            table = array('l')
+            for y in range(height):
+                block_y = (y & ~0xf) * width
+                posY = (((y & ~3) >> 1) + (y & 1)) & 0x7
+                swap_selector = (((y + 2) >> 2) & 0x1) * 4
+                base_column_location = posY * width * 2
+
+                table.extend(
+                    block_y + (x & ~0xf) * 2 + base_column_location +
+                    ((x + swap_selector) & 0x7) * 4 + ((y >> 1) & 1) + ((x >> 2) & 2)
+                    for x in range(width)
+                )
+
+        _unswizzle_tables[key] = table
+        return table
 
-            for x in range(width):
-                block_x = (x & ~0xf) * 2
-                column_location = base_column_location + ((x + swap_selector) & 0x7) * 4
-                byte_num = ((y >> 1) & 1) + ((x >> 2) & 2)
-                swizzleid = block_y + block_x + column_location + byte_num
-                res[y * width + x] = data[swizzleid]
+    #######################################################
+    @staticmethod
+    def unswizzle8(data, width, height):
+        table = NativePS2Texture._unswizzle_table(width, height)
 
-        return res
+        if numpy is not None:
+            return numpy.frombuffer(data, numpy.uint8)[table].tobytes()
+        return bytes(map(data.__getitem__, table))
 
     #######################################################
     @staticmethod
     def unswizzle4(data, width, height):
-        pixels = bytearray(width * height)
-        for i in range(width * height // 2):
-            index = data[i]
-            pixels[i*2] = index & 0xf
-            pixels[i*2+1] = (index >> 4) & 0xf
+        table = NativePS2Texture._unswizzle_table(width, height)
+        size = width * height // 2
+
+        if numpy is not None:
+            data = numpy.frombuffer(data, numpy.uint8, size)
+            pixels = numpy.empty(size * 2, numpy.uint8)
+            pixels[0::2] = data & 0xf
+            pixels[1::2] = data >> 4
 
-        pixels = NativePS2Texture.unswizzle8(pixels, width, height)
+            pixels = pixels[table]
+            return ((pixels[1::2] << 4) | pixels[0::2]).tobytes()
 
-        res = bytearray(width * height // 2)
-        for i in range(width * height // 2):
-            idx1 = pixels[i*2]
-            idx2 = pixels[i*2+1]
-            res[i] = (idx2 << 4) | idx1
+        data = data[:size]
+        pixels = bytearray(size * 2)
+        pixels[0::2] = data.translate(bytes(b & 0xf for b in range(0x100)))
+        pixels[1::2] = data.translate(bytes(b >> 4 for b in range(0x100)))
 
-        return res
+        pixels = bytes(map(pixels.__getitem__, table))
+        return bytes(map(operator.or_, pixels[0::2], pixels[1::2].translate(bytes((b << 4) & 0xff for b in range(0x100)))))
 
     #######################################################
     @staticmethod
     def unswizzle_palette(data):
-        palette = bytearray(1024)
-        for p in range(256):
-            pos_l = ((p & 231) | ((p & 8) << 1) | ((p & 16) >> 1)) * 4
-            pos_r = p * 4
-            palette[pos_l:pos_l+4] = data[pos_r:pos_r+4]
-        return bytes(palette)
+        # Swaps the 2nd and 3rd run of 8 colors in each group of 32
+        return b''.join(
+            data[pos:pos+32]
+            for group in range(0, 1024, 128)
+            for pos in (group, group + 64, group + 32, group + 96)
+        )
 
     #######################################################
     def _read_palette(self, size):
@@ -545,7 +590,7 @@ class NativePS2Texture(TextureNative):
     #######################################################
     def _read_raw(self, size):
         offset = self._read(size)
-        return self.data[offset:offset+size]
+        return bytes(self.data[offset:offset+size])
 
     #######################################################
     def _read_chunk(self):
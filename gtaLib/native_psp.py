@@ -14,10 +14,16 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+from array import array
 from struct import unpack_from, calcsize
 
 from .dff import RGBA, TexCoords, Triangle, Vector
-from .txd import TextureNative, PaletteType
+from .txd import TextureNative, PaletteType, SwizzlePlan
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 # geometry flags
 rpGEOMETRYTRISTRIP              = 0x00000001
@@ -383,32 +389,43 @@ class NativePSPTexture(TextureNative):
 
             self.pixels.append(pixels)
 
+        self.data = None
         return self
 
     #######################################################
     @staticmethod
     def unswizzle(data, width, height, depth):
+        plan = SwizzlePlan.get(
+            ("psp", depth, width, height),
+            lambda: NativePSPTexture._build_unswizzle_plan(width, height, depth)
+        )
+        return plan.apply(data)
+
+    #######################################################
+    @staticmethod
+    def _build_unswizzle_plan(width, height, depth):
         width = (width * depth) >> 3
-        res = bytearray(width * height)
 
         row_blocks = width // 16
         block_size = 16 * 8
 
-        for y in range(height):
-            block_y = y // 8
-            y_in_block = y % 8
+        # Offsets within a row of blocks are the same for every row
+        row_offsets = [(x // 16) * block_size + x % 16 for x in range(width)]
 
-            for x in range(width):
-                block_x = x // 16
-                x_in_block = x % 16
+        source_size = width * height
 
-                block_idx = block_x + (block_y * row_blocks)
-                src_off = (block_idx * block_size) + x_in_block + y_in_block * 16
-                dst_off = y * width + x
+        if numpy is not None:
+            y = numpy.arange(height)
+            row_starts = (y // 8) * row_blocks * block_size + (y % 8) * 16
+            res = numpy.minimum(row_starts[:, None] + numpy.array(row_offsets, dtype=numpy.intp), source_size).ravel()
 
-                res[dst_off] = data[src_off]
+        else:
+            res = array('l')
+            for y in range(height):
+                row_start = (y // 8) * row_blocks * block_size + (y % 8) * 16
+                res.extend(min(row_start + x, source_size) for x in row_offsets)
 
-        return res
+        return SwizzlePlan(source_size, res)
 
     #######################################################
     @staticmethod
@@ -434,4 +451,4 @@ class NativePSPTexture(TextureNative):
     #######################################################
     def _read_raw(self, size):
         offset = self._read(size)
-        return self.data[offset:offset+size]
+        return bytes(self.data[offset:offset+size])
@@ -14,9 +14,15 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-from struct import unpack_from
+import sys
+
+from array import array
+from itertools import repeat
+from operator import mul, truediv
+from struct import unpack_from, error as StructError
 
 from .dff import SkinPLG, RGBA, TexCoords, Vector, ExtraVertColorExtension
+from .dff import StreamView
 
 ATTRIB_ID_COORD       = 0
 ATTRIB_ID_TEX_COORD   = 1
@@ -32,6 +38,15 @@ ATTRIB_TYPE_UBYTE  = 2
 ATTRIB_TYPE_SHORT  = 3
 ATTRIB_TYPE_USHORT = 4
 
+# array typecode and normalization divisor of each attribute type
+ATTRIB_TYPE_FORMATS = {
+    ATTRIB_TYPE_FLOAT  : ('f', None),
+    ATTRIB_TYPE_BYTE   : ('b', 127.0),
+    ATTRIB_TYPE_UBYTE  : ('B', 255.0),
+    ATTRIB_TYPE_SHORT  : ('h', 32767.0),
+    ATTRIB_TYPE_USHORT : ('H', 65435.0),
+}
+
 #######################################################
 class NativeOGLSkin:
 
@@ -98,23 +113,21 @@ class NativeWDGLGeometry:
             self.attrib_descs.append(ad)
 
         readers = (
-            self._read_coord,
-            self._read_tex_coord,
-            self._read_normal,
-            self._read_prelit,
-            self._read_bone_weight,
-            self._read_bone_index,
-            self._read_extra_color,
+            self._read_coords,
+            self._read_tex_coords,
+            self._read_normals,
+            self._read_prelits,
+            self._read_bone_weights,
+            self._read_bone_indices,
+            self._read_extra_colors,
         )
 
         attribs_pos = self._pos
         for ad in self.attrib_descs:
-            self._pos = attribs_pos + ad.offset
             reader = readers[ad.id]
-
-            for _ in range(geometry._num_vertices):
-                reader(ad)
-                self._pos += ad.stride
+            stream = NativeWDGLGeometry.unpack_stream(self.data, attribs_pos + ad.offset, ad,
+                                                      geometry._num_vertices)
+            reader(stream, ad)
 
         if self.coords:
             geometry.vertices = self.coords
@@ -143,84 +156,88 @@ class NativeWDGLGeometry:
 
     #######################################################
     @staticmethod
-    def unpack_attrib(data, offset, attrib_desc):
-        attrib_type = attrib_desc.type
-
-        if attrib_type == ATTRIB_TYPE_FLOAT:
-            attrib = unpack_from('<%df' % (attrib_desc.size), data, offset)
-
-        elif attrib_type == ATTRIB_TYPE_BYTE:
-            attrib = unpack_from('<%db' % (attrib_desc.size), data, offset)
-            if attrib_desc.is_normalized:
-                attrib = tuple(a / 127.0 for a in attrib)
+    def unpack_stream(data, offset, attrib_desc, count):
+        # Unpacks one attribute of all vertices into a flat array
+        if attrib_desc.type not in ATTRIB_TYPE_FORMATS:
+            raise Exception("Unknown WDGL vertex attribute type")
 
-        elif attrib_type == ATTRIB_TYPE_UBYTE:
-            attrib = unpack_from('<%dB' % (attrib_desc.size), data, offset)
-            if attrib_desc.is_normalized:
-                attrib = tuple(a / 255.0 for a in attrib)
+        typecode, scale = ATTRIB_TYPE_FORMATS[attrib_desc.type]
+        stream = array(typecode)
 
-        elif attrib_type == ATTRIB_TYPE_SHORT:
-            attrib = unpack_from('<%dh' % (attrib_desc.size), data, offset)
-            if attrib_desc.is_normalized:
-                attrib = tuple(a / 32767.0 for a in attrib)
+        elem_size = attrib_desc.size * stream.itemsize
+        stride = attrib_desc.stride
 
-        elif attrib_type == ATTRIB_TYPE_USHORT:
-            attrib = unpack_from('<%dH' % (attrib_desc.size), data, offset)
-            if attrib_desc.is_normalized:
-                attrib = tuple(a / 65435.0 for a in attrib)
+        if count == 0:
+            return stream
 
+        if stride == elem_size:
+            packed = data[offset:offset + elem_size * count]
         else:
-            raise Exception("Unknown WDGL vertex attribute type")
+            # Gather the interleaved attribute one byte lane at a time
+            packed = bytearray(elem_size * count)
+            end = offset + stride * (count - 1) + 1
+            for i in range(elem_size):
+                packed[i::elem_size] = data[offset + i:end + i:stride]
 
-        return attrib
+        if len(packed) != elem_size * count:
+            raise StructError("WDGL vertex stream is truncated")
 
-    #######################################################
-    def _read_coord(self, attrib_desc):
-        attrib = NativeWDGLGeometry.unpack_attrib(self.data, self._pos, attrib_desc)
+        stream.frombytes(packed)
+        if sys.byteorder != 'little':
+            stream.byteswap()
+
+        if attrib_desc.is_normalized and scale:
+            stream = array('d', map(truediv, stream, repeat(scale)))
 
-        coord = Vector(*attrib)
-        self.coords.append(coord)
+        return stream
 
     #######################################################
-    def _read_tex_coord(self, attrib_desc):
-        attrib = NativeWDGLGeometry.unpack_attrib(self.data, self._pos, attrib_desc)
-        attrib = tuple(a / 512.0 for a in attrib)
+    @staticmethod
+    def _to_colors(stream):
+        try:
+            return array('l', map(int, map(mul, stream, repeat(255.0))))
 
-        tex_coord = TexCoords(*attrib)
-        self.tex_coords.append(tex_coord)
+        # inf or NaN in the stream, clamp to a byte (max returns its first
+        # argument, 0.0, for NaN)
+        except (OverflowError, ValueError):
+            return array('l', map(int, map(min, repeat(255.0),
+                                           map(max, repeat(0.0), map(mul, stream, repeat(255.0))))))
 
     #######################################################
-    def _read_normal(self, attrib_desc):
-        attrib = NativeWDGLGeometry.unpack_attrib(self.data, self._pos, attrib_desc)
+    @staticmethod
+    def _to_tuples(stream, size):
+        return list(zip(*[iter(stream)] * size))
 
-        normal = Vector(*attrib)
-        self.normals.append(normal)
+    #######################################################
+    def _read_coords(self, stream, attrib_desc):
+        self.coords = StreamView(Vector, attrib_desc.size, stream)
 
     #######################################################
-    def _read_prelit(self, attrib_desc):
-        attrib = NativeWDGLGeometry.unpack_attrib(self.data, self._pos, attrib_desc)
-        attrib = tuple(int(a * 255.0) for a in attrib)
+    def _read_tex_coords(self, stream, attrib_desc):
+        stream = array('d', map(truediv, stream, repeat(512.0)))
+        self.tex_coords = StreamView(TexCoords, attrib_desc.size, stream)
 
-        prelit_color = RGBA(*attrib)
-        self.prelits.append(prelit_color)
+    #######################################################
+    def _read_normals(self, stream, attrib_desc):
+        self.normals = StreamView(Vector, attrib_desc.size, stream)
 
     #######################################################
-    def _read_bone_weight(self, attrib_desc):
-        attrib = NativeWDGLGeometry.unpack_attrib(self.data, self._pos, attrib_desc)
-        self.bone_weights.append(attrib)
+    def _read_prelits(self, stream, attrib_desc):
+        stream = NativeWDGLGeometry._to_colors(stream)
+        self.prelits = StreamView(RGBA, attrib_desc.size, stream)
 
     #######################################################
-    def _read_bone_index(self, attrib_desc):
-        attrib = NativeWDGLGeometry.unpack_attrib(self.data, self._pos, attrib_desc)
-        self.bone_indices.append(attrib)
+    def _read_bone_weights(self, stream, attrib_desc):
+        self.bone_weights = NativeWDGLGeometry._to_tuples(stream, attrib_desc.size)
 
     #######################################################
-    def _read_extra_color(self, attrib_desc):
-        attrib = NativeWDGLGeometry.unpack_attrib(self.data, self._pos, attrib_desc)
-        attrib = tuple(int(a * 255.0) for a in attrib)
+    def _read_bone_indices(self, stream, attrib_desc):
+        self.bone_indices = NativeWDGLGeometry._to_tuples(stream, attrib_desc.size)
 
-        extra_color = RGBA(*attrib)
-        self.extra_colors.append(extra_color)
+    #######################################################
+    def _read_extra_colors(self, stream, attrib_desc):
+        stream = NativeWDGLGeometry._to_colors(stream)
+        self.extra_colors = StreamView(RGBA, attrib_desc.size, stream)
 
     #######################################################
     def _read(self, size):
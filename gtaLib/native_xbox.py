@@ -305,6 +305,7 @@ class NativeXboxTexture(TextureNative):
 
             self.pixels.append(pixels)
 
+        self.data = None
         return self
 
     #######################################################
@@ -365,4 +366,4 @@ class NativeXboxTexture(TextureNative):
     #######################################################
     def _read_raw(self, size):
         offset = self._read(size)
-        return self.data[offset:offset+size]
+        return bytes(self.data[offset:offset+size])
@@ -0,0 +1,328 @@
+# GTA DragonFF - Blender scripts to edit basic GTA formats
+# Copyright (C) 2019  Parik
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Per-section timing of the readers and writers. The hooks are installed by
+# wrapping the methods when profiling starts and the originals are put back
+# when it stops, so nothing is added to the code paths otherwise:
+#
+#   with profiler.profile(memory=True) as prof:
+#       model = dff.dff()
+#       model.load_file(filename)
+#
+#   print("\n".join(prof.format()))
+#   prof.write_collapsed("load.folded") # flamegraph.pl / speedscope
+#
+# Other code (e.g. the Blender importers) can be added with instrument().
+
+import json
+import tracemalloc
+
+from functools import wraps
+from time import perf_counter
+
+from .col import coll
+from .dff import dff, ChunkWriter, Geometry
+from .txd import txd, ImageDecoder, TextureNative
+
+_active = None
+
+#######################################################
+class SectionStats:
+
+    __slots__ = [
+        'calls',
+        'seconds',
+        'self_seconds',
+        'bytes',
+        'peak_bytes'
+    ]
+
+    #######################################################
+    def __init__(self):
+        self.calls        = 0
+        self.seconds      = 0.0
+        self.self_seconds = 0.0
+        self.bytes        = 0
+        self.peak_bytes   = 0
+
+    #######################################################
+    def to_dict(self):
+        return {name: getattr(self, name) for name in SectionStats.__slots__}
+
+#######################################################
+class _Frame:
+
+    __slots__ = [
+        'label',
+        'path',
+        'start',
+        'child_seconds',
+        'memory',
+        'peak'
+    ]
+
+    #######################################################
+    def __init__(self, label, path, memory):
+        self.label         = label
+        self.path          = path
+        self.start         = 0.0
+        self.child_seconds = 0.0
+        self.memory        = memory
+        self.peak          = memory
+
+#######################################################
+class Profiler:
+
+    #######################################################
+    def __init__(self, memory=False):
+
+        # Peaks are tracked per section by resetting the tracemalloc peak at
+        # every boundary, which needs Python 3.9
+        self.memory = memory and hasattr(tracemalloc, "reset_peak")
+
+        self.sections = {}
+        self.stacks   = {}
+        self._stack   = []
+        self._patches = []
+        self._started_tracing = False
+
+    #######################################################
+    def instrument(self, owner, name, label=None):
+
+        # Wraps owner.name (a function of a module or a method of a class) until
+        # the profiler is stopped
+        original = owner.__dict__[name]
+        function = original
+
+        if isinstance(original, (staticmethod, classmethod)):
+            function = original.__func__
+
+        if not callable(function):
+            return
+
+        if label is None:
+            label = "%s.%s" % (owner.__name__.rsplit(".", 1)[-1],
+                               name.replace("_%s__" % owner.__name__, "__"))
+
+        wrapper = self._wrap(function, label)
+        if isinstance(original, staticmethod):
+            wrapper = staticmethod(wrapper)
+        elif isinstance(original, classmethod):
+            wrapper = classmethod(wrapper)
+
+        setattr(owner, name, wrapper)
+        self._patches.append((owner, name, original))
+
+    #######################################################
+    def instrument_methods(self, owner, prefixes):
+        for name in list(vars(owner)):
+            method = name.replace("_%s__" % owner.__name__, "", 1)
+            if method.startswith(prefixes):
+                self.instrument(owner, name)
+
+    #######################################################
+    def start(self):
+        global _active
+
+        if _active is not None:
+            raise RuntimeError("A profiler is already running")
+        _active = self
+
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+        # Readers and writers, read_chunk is left out as it's too small to
+        # be worth timing on its own
+        for owner in (dff, txd):
+            self.instrument_methods(owner, ("read_", "write_", "load_"))
+        self.instrument_methods(coll, ("__read", "__write", "load_", "write_"))
+
+        self.instrument(Geometry, "from_mem")
+        self.instrument(Geometry, "write")
+
+        for name, function in vars(ImageDecoder).items():
+            if isinstance(function, staticmethod) and not name.startswith("_"):
+                self.instrument(ImageDecoder, name)
+
+        # Platform textures and geometries, imported here as dff and txd do
+        # to avoid the circular imports
+        from . import native_gc, native_ps2, native_psp, native_wdgl, native_xbox
+
+        for module in (native_gc, native_ps2, native_psp, native_wdgl, native_xbox):
+            for owner in vars(module).values():
+                if isinstance(owner, type) and owner.__module__ == module.__name__:
+                    for name in ("unpack", "from_mem", "to_rgba", "unswizzle",
+                                 "unswizzle4", "unswizzle8"):
+                        if name in vars(owner):
+                            self.instrument(owner, name)
+
+        self.instrument(TextureNative, "to_rgba")
+
+    #######################################################
+    def stop(self):
+        global _active
+
+        for owner, name, original in reversed(self._patches):
+            setattr(owner, name, original)
+        self._patches = []
+
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+        if _active is self:
+            _active = None
+
+    #######################################################
+    def __enter__(self):
+        self.start()
+        return self
+
+    #######################################################
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    #######################################################
+    @staticmethod
+    def _position(args):
+
+        # Readers advance a position and writers a ChunkWriter, the bytes
+        # processed by a section is how far they moved
+        if len(args) > 1 and isinstance(args[1], ChunkWriter):
+            return args[1].tell()
+        if args and isinstance(args[0], (dff, txd)):
+            return args[0].pos
+        if args and isinstance(args[0], coll):
+            return args[0]._pos
+        return None
+
+    #######################################################
+    def _sync_peak(self):
+        peak = tracemalloc.get_traced_memory()[1]
+        if self._stack:
+            frame = self._stack[-1]
+            frame.peak = max(frame.peak, peak)
+        tracemalloc.reset_peak()
+
+    #######################################################
+    def _wrap(self, function, label):
+        profiler = self
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            stack = profiler._stack
+            path = stack[-1].path + ";" + label if stack else label
+
+            memory = 0
+            if profiler.memory:
+                profiler._sync_peak()
+                memory = tracemalloc.get_traced_memory()[0]
+
+            frame = _Frame(label, path, memory)
+            position = Profiler._position(args)
+
+            result = None
+            stack.append(frame)
+            frame.start = perf_counter()
+            try:
+                result = function(*args, **kwargs)
+            finally:
+                elapsed = perf_counter() - frame.start
+
+                if profiler.memory:
+                    profiler._sync_peak()
+                stack.pop()
+
+                processed = 0
+                if position is not None:
+                    processed = Profiler._position(args) - position
+                if not processed and isinstance(result, (bytes, bytearray)):
+                    processed = len(result)
+
+                profiler._record(frame, elapsed, processed)
+
+            return result
+
+        return wrapper
+
+    #######################################################
+    def _record(self, frame, elapsed, processed):
+        stats = self.sections.get(frame.label)
+        if stats is None:
+            stats = self.sections[frame.label] = SectionStats()
+
+        self_seconds = elapsed - frame.child_seconds
+
+        stats.calls        += 1
+        stats.seconds      += elapsed
+        stats.self_seconds += self_seconds
+        stats.bytes        += processed
+        stats.peak_bytes    = max(stats.peak_bytes, frame.peak - frame.memory)
+
+        self.stacks[frame.path] = self.stacks.get(frame.path, 0.0) + self_seconds
+
+        if self._stack:
+            parent = self._stack[-1]
+            parent.child_seconds += elapsed
+            parent.peak = max(parent.peak, frame.peak)
+
+    #######################################################
+    def to_dict(self):
+        return {label: stats.to_dict() for label, stats in self.sections.items()}
+
+    #######################################################
+    def write_json(self, filename):
+        with open(filename, mode='w') as file:
+            json.dump(self.to_dict(), file, indent=2)
+
+    #######################################################
+    def collapsed_stacks(self):
+
+        # Folded stack lines with the self time in microseconds, as read by
+        # flamegraph.pl, speedscope and inferno
+        return ["%s %d" % (path, round(seconds * 1e6))
+                for path, seconds in sorted(self.stacks.items())]
+
+    #######################################################
+    def write_collapsed(self, filename):
+        with open(filename, mode='w') as file:
+            file.write("\n".join(self.collapsed_stacks()) + "\n")
+
+    #######################################################
+    def format(self):
+        lines = ["%-40s %8s %12s %12s %12s %12s" % (
+            "section", "calls", "total (ms)", "self (ms)", "bytes", "peak (KiB)")]
+
+        for label, stats in sorted(self.sections.items(), key=lambda item: -item[1].seconds):
+            lines.append("%-40s %8d %12.2f %12.2f %12d %12.0f" % (
+                label, stats.calls, stats.seconds * 1000, stats.self_seconds * 1000,
+                stats.bytes, stats.peak_bytes / 1024))
+
+        return lines
+
+#######################################################
+def profile(memory=False):
+    return Profiler(memory)
+
+#######################################################
+def instrument(owner, name, label=None):
+
+    # Adds a function to the running profiler, e.g. from the importers
+    if _active is None:
+        raise RuntimeError("No profiler is running")
+
+    _active.instrument(owner, name, label)
@@ -14,14 +14,29 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import sys
+import hashlib
+
+from array import array
 from enum import IntEnum
 from math import ceil
-from struct import unpack_from, pack
-from collections import namedtuple
+from struct import unpack_from, iter_unpack, pack
+from collections import namedtuple, OrderedDict
 
 from .dff import Sections, NativePlatformType
-from .dff import types, Chunk, TexDict, PITexDict, Texture
-from .dff import strlen
+from .dff import types, TexDict, PITexDict, Texture
+from .dff import strlen, ChunkReader
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Lookup tables shared by the image decoders, built on first use
+_lookup_tables = {}
+
+# Unswizzle plans by (platform, format, width, height)
+_swizzle_plans = {}
 
 #######################################################
 class RasterFormat(IntEnum):
@@ -46,6 +61,7 @@ class D3DFormat(IntEnum):
     D3D_1555 = 25
     D3D_4444 = 26
 
+    D3DFMT_P8   = 41
     D3DFMT_L8   = 50
     D3DFMT_A8L8 = 51
 
@@ -82,13 +98,16 @@ class DeviceType(IntEnum):
 
 #######################################################
 class ImageEncoder:
-    
+
+    # Encoders of the raster formats written by the exporter. The block
+    # compressors, palette quantizer and mipmap filters work on whole
+    # textures at once and need numpy.
+
     @staticmethod
     def rgba_to_bgra8888(rgba_data):
-        ret = bytearray()
-        for i in range(0, len(rgba_data), 4):
-            r, g, b, a = rgba_data[i:i+4]
-            ret.extend([b, g, r, a])
+        ret = bytearray(rgba_data)
+        ret[0::4] = rgba_data[2::4]
+        ret[2::4] = rgba_data[0::4]
         return bytes(ret)
     
     @staticmethod
@@ -99,6 +118,316 @@ class ImageEncoder:
             ret.extend([b, g, r])
         return bytes(ret)
 
+    @staticmethod
+    def _require_numpy():
+        if numpy is None:
+            raise RuntimeError("Texture compression and mipmaps require numpy")
+
+    @staticmethod
+    def _rgba_array(rgba, width, height):
+        return numpy.frombuffer(rgba, numpy.uint8, width * height * 4).reshape(height, width, 4)
+
+    @staticmethod
+    def has_alpha(rgba):
+        if numpy is not None:
+            return bool(len(rgba)) and bool(numpy.frombuffer(rgba, numpy.uint8)[3::4].min() < 0xff)
+        return any(a < 0xff for a in rgba[3::4])
+
+    @staticmethod
+    def _kaiser_taps(src_size, dst_size, radius=3, beta=4.0):
+        # Kaiser windowed sinc weights of every destination texel, over the
+        # source texels around it with the edges clamped
+        scale = src_size / dst_size
+        centers = (numpy.arange(dst_size) + 0.5) * scale
+        first = numpy.floor(centers - radius * scale).astype(numpy.intp)
+        positions = first[:, None] + numpy.arange(int(ceil(2 * radius * scale)) + 1)
+
+        t = (positions + 0.5 - centers[:, None]) / scale
+        window = numpy.sqrt(numpy.clip(1 - (t / radius) ** 2, 0, None))
+        weights = numpy.where(numpy.abs(t) < radius,
+                              numpy.sinc(t) * numpy.i0(beta * window) / numpy.i0(beta), 0)
+        weights /= weights.sum(axis=1, keepdims=True)
+
+        return numpy.clip(positions, 0, src_size - 1), weights.astype(numpy.float32)
+
+    @staticmethod
+    def _downsample(image, mip_filter):
+        height, width = image.shape[:2]
+        new_width, new_height = max(width // 2, 1), max(height // 2, 1)
+
+        if mip_filter == 'KAISER':
+            positions, weights = ImageEncoder._kaiser_taps(height, new_height)
+            rows = numpy.zeros((new_height, width, 4), numpy.float32)
+            for k in range(positions.shape[1]):
+                rows += image[positions[:, k]] * weights[:, k, None, None]
+
+            positions, weights = ImageEncoder._kaiser_taps(width, new_width)
+            image = numpy.zeros((new_height, new_width, 4), numpy.float32)
+            for k in range(positions.shape[1]):
+                image += rows[:, positions[:, k]] * weights[None, :, k, None]
+
+            return image
+
+        # Box filter, a side that is already 1 texel stays as it is
+        if height > 1:
+            image = (image[0:2*new_height:2] + image[1:2*new_height:2]) * 0.5
+        if width > 1:
+            image = (image[:, 0:2*new_width:2] + image[:, 1:2*new_width:2]) * 0.5
+        return image
+
+    @staticmethod
+    def mipmaps(rgba, width, height, mip_filter='BOX', min_size=1):
+        # Mipmap chain as (rgba, width, height) levels, the first being the
+        # image itself. Colors are filtered premultiplied by alpha, so the
+        # transparent texels don't bleed into the smaller levels.
+        ImageEncoder._require_numpy()
+
+        image = ImageEncoder._rgba_array(rgba, width, height).astype(numpy.float32)
+        image[..., :3] *= image[..., 3:] / 0xff
+
+        levels = [(bytes(rgba), width, height)]
+        while width > 1 or height > 1:
+            width, height = max(width // 2, 1), max(height // 2, 1)
+            if width < min_size or height < min_size:
+                break
+
+            image = numpy.clip(ImageEncoder._downsample(image, mip_filter), 0, 0xff)
+
+            alpha = image[..., 3:]
+            level = numpy.empty_like(image)
+            level[..., 3:] = alpha
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                level[..., :3] = numpy.where(alpha > 0, image[..., :3] * 0xff / alpha, 0)
+
+            level = numpy.rint(numpy.clip(level, 0, 0xff)).astype(numpy.uint8)
+            levels.append((level.tobytes(), width, height))
+
+        return levels
+
+    @staticmethod
+    def _blocks(rgba, width, height):
+        # 4x4 texel blocks in block order, partial blocks repeat the edge texels
+        image = ImageEncoder._rgba_array(rgba, width, height)
+        image = numpy.pad(image, ((0, -height % 4), (0, -width % 4), (0, 0)), mode='edge')
+
+        blocks_height, blocks_width = image.shape[0] // 4, image.shape[1] // 4
+        image = image.reshape(blocks_height, 4, blocks_width, 4, 4)
+        return image.transpose(0, 2, 1, 3, 4).reshape(-1, 16, 4)
+
+    @staticmethod
+    def _bc_endpoints(colors, weights):
+        # Extremes of the colors along their principal axis, per block
+        count = numpy.maximum(weights.sum(axis=1, keepdims=True), 1)
+        mean = (colors * weights[..., None]).sum(axis=1) / count
+        centered = (colors - mean[:, None]) * weights[..., None]
+        covariance = numpy.einsum('nki,nkj->nij', centered, centered)
+
+        # Iterations start from the texel farthest from the mean, a fixed
+        # start vector can be orthogonal to the axis (e.g. red to green)
+        used = weights > 0
+        farthest = (centered * centered).sum(axis=2).argmax(axis=1)
+        start = centered[numpy.arange(len(colors)), farthest]
+
+        axis = start
+        for _ in range(8):
+            axis = numpy.einsum('nij,nj->ni', covariance, axis)
+            axis /= numpy.maximum(numpy.abs(axis).max(axis=1, keepdims=True), 1e-6)
+
+        # Blocks the iterations collapsed fall back to the start vector, then
+        # to the diagonal of the bounding box
+        high = numpy.where(used[..., None], colors, -numpy.inf).max(axis=1)
+        low  = numpy.where(used[..., None], colors, numpy.inf).min(axis=1)
+        for fallback in (start, high - low):
+            collapsed = numpy.abs(axis).max(axis=1) < 1e-3
+            axis[collapsed] = fallback[collapsed]
+
+        projections = ((colors - mean[:, None]) * axis[:, None]).sum(axis=2)
+        projections /= numpy.maximum((axis * axis).sum(axis=1, keepdims=True), 1e-6)
+
+        high = numpy.where(used, projections, -numpy.inf).max(axis=1, keepdims=True)
+        low  = numpy.where(used, projections, numpy.inf).min(axis=1, keepdims=True)
+
+        return (numpy.clip(mean + axis * high, 0, 0xff),
+                numpy.clip(mean + axis * low, 0, 0xff))
+
+    @staticmethod
+    def _to565(color):
+        r = numpy.rint(color[:, 0] * 0x1f / 0xff).astype(numpy.int32)
+        g = numpy.rint(color[:, 1] * 0x3f / 0xff).astype(numpy.int32)
+        b = numpy.rint(color[:, 2] * 0x1f / 0xff).astype(numpy.int32)
+        return (r << 11) | (g << 5) | b
+
+    @staticmethod
+    def _from565(c):
+        # Same expansion as the decoder
+        return numpy.stack((
+            ((c >> 11) & 0x1f) * 0xff // 0x1f,
+            ((c >> 5) & 0x3f) * 0xff // 0x3f,
+            (c & 0x1f) * 0xff // 0x1f,
+        ), axis=1)
+
+    @staticmethod
+    def _bc_colors(blocks, transparent):
+        # Color part (8 bytes) of every block. Blocks with transparent texels
+        # use the 3-color mode, the others need color0 > color1.
+        colors = blocks[:, :, :3].astype(numpy.float32)
+        three_colors = transparent.any(axis=1)
+        count = len(blocks)
+
+        # Fully transparent blocks keep all of their texels for the endpoints
+        weights = (~transparent).astype(numpy.float32)
+        weights[~weights.any(axis=1)] = 1
+
+        high, low = ImageEncoder._bc_endpoints(colors, weights)
+        color0, color1 = ImageEncoder._to565(high), ImageEncoder._to565(low)
+
+        swap = numpy.where(three_colors, color0 > color1, color0 < color1)
+        color0, color1 = numpy.where(swap, color1, color0), numpy.where(swap, color0, color1)
+
+        c0, c1 = ImageEncoder._from565(color0), ImageEncoder._from565(color1)
+        four_colors = (color0 > color1)[:, None]
+
+        palette = numpy.empty((count, 4, 3), numpy.int32)
+        palette[:, 0] = c0
+        palette[:, 1] = c1
+        palette[:, 2] = numpy.where(four_colors, (2 * c0 + c1) // 3, (c0 + c1) // 2)
+        palette[:, 3] = numpy.where(four_colors, (2 * c1 + c0) // 3, 0)
+
+        distances = ((colors[:, :, None] - palette[:, None]) ** 2).sum(axis=3)
+        distances[~four_colors[:, 0], :, 3] = numpy.inf
+        controls = numpy.where(transparent, 3, distances.argmin(axis=2)).astype(numpy.uint32)
+
+        shifts = numpy.arange(0, 32, 2, dtype=numpy.uint32)
+        ret = numpy.empty((count, 2), "<u4")
+        ret[:, 0] = color0 | (color1 << 16)
+        ret[:, 1] = (controls << shifts).sum(axis=1, dtype=numpy.uint32)
+        return ret.view(numpy.uint8)
+
+    @staticmethod
+    def bc1(rgba, width, height, alpha):
+        ImageEncoder._require_numpy()
+
+        blocks = ImageEncoder._blocks(rgba, width, height)
+        transparent = blocks[:, :, 3] < 0x80 if alpha else numpy.zeros(blocks.shape[:2], bool)
+        return ImageEncoder._bc_colors(blocks, transparent).tobytes()
+
+    @staticmethod
+    def bc2(rgba, width, height):
+        ImageEncoder._require_numpy()
+
+        blocks = ImageEncoder._blocks(rgba, width, height)
+        colors = ImageEncoder._bc_colors(blocks, numpy.zeros(blocks.shape[:2], bool))
+
+        # Explicit 4-bit alphas, low nibble first
+        alphas = numpy.rint(blocks[:, :, 3] / 0x11).astype(numpy.uint8)
+        alphas = alphas[:, 0::2] | (alphas[:, 1::2] << 4)
+
+        return numpy.concatenate((alphas, colors), axis=1).tobytes()
+
+    @staticmethod
+    def bc3(rgba, width, height):
+        ImageEncoder._require_numpy()
+
+        blocks = ImageEncoder._blocks(rgba, width, height)
+        colors = ImageEncoder._bc_colors(blocks, numpy.zeros(blocks.shape[:2], bool))
+        count = len(blocks)
+
+        # 8 interpolated alphas between the extremes, evaluated as the
+        # decoder does. Equal extremes leave every index at 0.
+        texel_alphas = blocks[:, :, 3].astype(numpy.float64)
+        alpha0 = texel_alphas.max(axis=1, keepdims=True)
+        alpha1 = texel_alphas.min(axis=1, keepdims=True)
+
+        alphas = numpy.empty((count, 8))
+        alphas[:, 0:1], alphas[:, 1:2] = alpha0, alpha1
+        alphas[:, 2:8] = numpy.rint(alpha0 * numpy.array([6/7, 5/7, 4/7, 3/7, 2/7, 1/7]) +
+                                    alpha1 * numpy.array([1/7, 2/7, 3/7, 4/7, 5/7, 6/7]))
+
+        indices = numpy.abs(texel_alphas[:, :, None] - alphas[:, None]).argmin(axis=2)
+        indices[(alpha0 == alpha1)[:, 0]] = 0
+
+        shifts = numpy.arange(0, 48, 3, dtype=numpy.uint64)
+        bits = (indices.astype(numpy.uint64) << shifts).sum(axis=1, dtype=numpy.uint64)
+
+        ret = numpy.empty((count, 16), numpy.uint8)
+        ret[:, 0], ret[:, 1] = alpha0[:, 0], alpha1[:, 0]
+        ret[:, 2:8] = bits.astype("<u8").view(numpy.uint8).reshape(count, 8)[:, :6]
+        ret[:, 8:] = colors
+        return ret.tobytes()
+
+    @staticmethod
+    def check_block_compression():
+        # Round trips a block going from green to red through the DXT encoders.
+        # Its colors vary at a constant sum of the channels, which is what an
+        # endpoint fit started along the gray axis flattens. Returns the
+        # formats that came back too far off (4 colors over the full range
+        # are at most ~43 apart from a texel).
+        values = [round(i * 255 / 15) for i in range(16)]
+        block = bytes(channel for v in values for channel in (v, 0xff - v, 0, 0xff))
+
+        codecs = (
+            ("DXT1", ImageEncoder.bc1(block, 4, 4, False), lambda data: ImageDecoder.bc1(data, 4, 4, 0)),
+            ("DXT3", ImageEncoder.bc2(block, 4, 4), lambda data: ImageDecoder.bc2(data, 4, 4, False)),
+            ("DXT5", ImageEncoder.bc3(block, 4, 4), lambda data: ImageDecoder.bc3(data, 4, 4, False)),
+        )
+
+        failures = []
+        for name, data, decode in codecs:
+            error = max(abs(a - b) for a, b in zip(decode(data), block))
+            if error > 48:
+                failures.append("%s (error %d)" % (name, error))
+
+        return failures
+
+    @staticmethod
+    def pal8(levels):
+        # Shared 256 color palette of all the (rgba, width, height) levels by
+        # median cut over their distinct colors. Returns the RGBA palette and
+        # the indices of every level.
+        ImageEncoder._require_numpy()
+
+        texels = numpy.concatenate([numpy.frombuffer(rgba, numpy.uint8) for rgba, _, _ in levels])
+        colors, inverse, counts = numpy.unique(texels.view("<u4"), return_inverse=True,
+                                               return_counts=True)
+        colors = colors.astype("<u4").view(numpy.uint8).reshape(-1, 4)
+        inverse = inverse.ravel()
+
+        boxes = [numpy.arange(len(colors))]
+        ranges = [numpy.ptp(colors, axis=0) if len(colors) else numpy.zeros(4)]
+
+        while len(boxes) < 256:
+
+            # Split the box with the widest channel at its weighted median
+            index = max(range(len(boxes)), key=lambda i: ranges[i].max())
+            if ranges[index].max() == 0:
+                break
+
+            box = boxes[index]
+            channel = int(ranges[index].argmax())
+            box = box[numpy.argsort(colors[box, channel], kind='stable')]
+
+            cumulative = numpy.cumsum(counts[box])
+            split = int(numpy.searchsorted(cumulative, cumulative[-1] / 2)) + 1
+            split = min(max(split, 1), len(box) - 1)
+
+            boxes[index:index+1] = [box[:split], box[split:]]
+            ranges[index:index+1] = [numpy.ptp(colors[box[:split]], axis=0),
+                                     numpy.ptp(colors[box[split:]], axis=0)]
+
+        palette = numpy.zeros((256, 4), numpy.uint8)
+        color_indices = numpy.empty(len(colors), numpy.uint8)
+        for i, box in enumerate(boxes):
+            weights = counts[box][:, None]
+            palette[i] = numpy.rint((colors[box] * weights).sum(axis=0) / weights.sum())
+            color_indices[box] = i
+
+        indices, start = [], 0
+        for _, width, height in levels:
+            indices.append(color_indices[inverse[start:start + width * height]].tobytes())
+            start += width * height
+
+        return palette.tobytes(), indices
+
 #######################################################
 class ImageDecoder:
 
@@ -153,298 +482,443 @@ class ImageDecoder:
         return (2 * b + a) // 3
 
     @staticmethod
-    def bc1(data, width, height, alpha_flag):
-        pos = 0
-        ret = bytearray(4 * width * height)
+    def _lookup_table(name, builder):
+        table = _lookup_tables.get(name)
+        if table is None:
+            table = _lookup_tables[name] = builder()
+        return table
 
-        for y in range(0, height, 4):
-            for x in range(0, width, 4):
-                color0, color1, bits = unpack_from("<HHI", data, pos)
-                pos += 8
+    @staticmethod
+    def _bc_rgb565_table():
+        return [ImageDecoder._decode565(bits) for bits in range(0x10000)]
 
-                r0, g0, b0 = ImageDecoder._decode565(color0)
-                r1, g1, b1 = ImageDecoder._decode565(color1)
+    @staticmethod
+    def _bc_controls_table():
+        # 2-bit control codes of one byte, lowest bits first
+        return [(b & 3, (b >> 2) & 3, (b >> 4) & 3, b >> 6) for b in range(0x100)]
 
-                # Decode this block into 4x4 pixels
-                for j in range(4):
-                    for i in range(4):
-                        # Get next control op and generate a pixel
-                        control = bits & 3
-                        bits = bits >> 2
-                        if control == 0:
-                            r, g, b, a = r0, g0, b0, 0xff
-                        elif control == 1:
-                            r, g, b, a = r1, g1, b1, 0xff
-                        elif control == 2:
-                            if color0 > color1:
-                                r, g, b, a = ImageDecoder._c2a(r0, r1), ImageDecoder._c2a(g0, g1), ImageDecoder._c2a(b0, b1), 0xff
-                            else:
-                                r, g, b, a = ImageDecoder._c2b(r0, r1), ImageDecoder._c2b(g0, g1), ImageDecoder._c2b(b0, b1), 0xff
-                        elif control == 3:
-                            if color0 > color1:
-                                r, g, b, a = ImageDecoder._c3(r0, r1),ImageDecoder. _c3(g0, g1), ImageDecoder._c3(b0, b1), 0xff
-                            else:
-                                r, g, b, a = 0, 0, 0, 0
+    @staticmethod
+    def _bc_unpremultiply_table():
+        table = [bytes(range(0x100))]
+        for a in range(1, 0x100):
+            table.append(bytes(min(round(c * 255 / a), 255) for c in range(0x100)))
+        return table
 
-                        idx = 4 * ((y + j) * width + (x + i))
-                        ret[idx:idx+4] = bytes([r, g, b, a | alpha_flag])
+    @staticmethod
+    def _bc3_alphas(alpha0, alpha1):
+        if alpha0 > alpha1:
+            return bytes((
+                alpha0,
+                alpha1,
+                round(alpha0 * (6 / 7) + alpha1 * (1 / 7)),
+                round(alpha0 * (5 / 7) + alpha1 * (2 / 7)),
+                round(alpha0 * (4 / 7) + alpha1 * (3 / 7)),
+                round(alpha0 * (3 / 7) + alpha1 * (4 / 7)),
+                round(alpha0 * (2 / 7) + alpha1 * (5 / 7)),
+                round(alpha0 * (1 / 7) + alpha1 * (6 / 7))
+            ))
+
+        return bytes((
+            alpha0,
+            alpha1,
+            round(alpha0 * (4 / 5) + alpha1 * (1 / 5)),
+            round(alpha0 * (3 / 5) + alpha1 * (2 / 5)),
+            round(alpha0 * (2 / 5) + alpha1 * (3 / 5)),
+            round(alpha0 * (1 / 5) + alpha1 * (4 / 5)),
+            0,
+            255
+        ))
 
-        return bytes(ret)
+    @staticmethod
+    def _bc3_indices_table():
+        # 3-bit alpha indices of 12 bits, lowest bits first
+        return [(b & 7, (b >> 3) & 7, (b >> 6) & 7, b >> 9) for b in range(0x1000)]
 
     @staticmethod
-    def bc2(data, width, height, premultiplied):
+    def _bc_blocks_count(width, height):
+        return ((width + 3) // 4) * ((height + 3) // 4)
+
+    @staticmethod
+    def _bc_colors(data, count, stride, alpha_flag):
+        # Decodes the color part of every block into 16 RGBA texels in block order.
+        # Alpha is 0xff apart from the transparent control of 3-color blocks
+        rgb565 = ImageDecoder._lookup_table('rgb565', ImageDecoder._bc_rgb565_table)
+        controls = ImageDecoder._lookup_table('bc_controls', ImageDecoder._bc_controls_table)
+        unpacker = "<HHI" if stride == 8 else "<8xHHI"
+
+        ret = bytearray()
+        for color0, color1, bits in iter_unpack(unpacker, data[:count * stride]):
+            r0, g0, b0 = rgb565[color0]
+            r1, g1, b1 = rgb565[color1]
+
+            if color0 > color1:
+                colors = (
+                    bytes((r0, g0, b0, 0xff)),
+                    bytes((r1, g1, b1, 0xff)),
+                    bytes(((2 * r0 + r1) // 3, (2 * g0 + g1) // 3, (2 * b0 + b1) // 3, 0xff)),
+                    bytes(((2 * r1 + r0) // 3, (2 * g1 + g0) // 3, (2 * b1 + b0) // 3, 0xff)),
+                )
+            else:
+                colors = (
+                    bytes((r0, g0, b0, 0xff)),
+                    bytes((r1, g1, b1, 0xff)),
+                    bytes(((r0 + r1) // 2, (g0 + g1) // 2, (b0 + b1) // 2, 0xff)),
+                    bytes((0, 0, 0, alpha_flag)),
+                )
+
+            ret += b''.join(map(colors.__getitem__,
+                                controls[bits & 0xff] + controls[(bits >> 8) & 0xff] +
+                                controls[(bits >> 16) & 0xff] + controls[bits >> 24]))
+
+        return ret
+
+    @staticmethod
+    def _bc_colors_numpy(blocks, offset, alpha_flag):
+        colors = blocks[:, offset:offset+4].copy().view("<u2").astype(numpy.int32)
+        bits = blocks[:, offset+4:offset+8].copy().view("<u4")
+        color0, color1 = colors[:, 0], colors[:, 1]
+
+        def decode565(c):
+            return numpy.stack((
+                ((c >> 11) & 0x1f) * 0xff // 0x1f,
+                ((c >> 5) & 0x3f) * 0xff // 0x3f,
+                (c & 0x1f) * 0xff // 0x1f,
+            ), axis=1)
+
+        c0, c1 = decode565(color0), decode565(color1)
+        four_colors = (color0 > color1)[:, None]
+
+        palette = numpy.empty((len(blocks), 4, 4), numpy.uint8)
+        palette[:, 0, :3] = c0
+        palette[:, 1, :3] = c1
+        palette[:, 2, :3] = numpy.where(four_colors, (2 * c0 + c1) // 3, (c0 + c1) // 2)
+        palette[:, 3, :3] = numpy.where(four_colors, (2 * c1 + c0) // 3, 0)
+        palette[:, :, 3] = 0xff
+        palette[:, 3, 3] = numpy.where(four_colors[:, 0], 0xff, alpha_flag)
+
+        shifts = numpy.arange(0, 32, 2, dtype=numpy.uint32)
+        controls = (bits >> shifts) & 3
+        return palette[numpy.arange(len(blocks))[:, None], controls]
+
+    @staticmethod
+    def _bc_unpremultiply(texels):
+        if numpy is not None:
+            rgb = texels[:, :, :3]
+            a = texels[:, :, 3:].astype(numpy.float64)
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                unpremultiplied = numpy.minimum(numpy.rint(rgb.astype(numpy.float64) * 255 / a), 255)
+            texels[:, :, :3] = numpy.where(a > 0, unpremultiplied, rgb)
+            return texels
+
+        table = ImageDecoder._lookup_table('bc_unpremultiply', ImageDecoder._bc_unpremultiply_table)
+        for i in range(0, len(texels), 4):
+            a = texels[i+3]
+            if a:
+                texels[i:i+3] = texels[i:i+3].translate(table[a])
+        return texels
+
+    @staticmethod
+    def _bc_assemble(texels, width, height):
+        # Places the decoded 4x4 blocks into rows of the final image
+        blocks_width, blocks_height = (width + 3) // 4, (height + 3) // 4
+
+        if width % 4 == 0 and height % 4 == 0:
+            if numpy is not None:
+                texels = texels.reshape(blocks_height, blocks_width, 4, 4, 4)
+                return texels.transpose(0, 2, 1, 3, 4).tobytes()
+
+            view = memoryview(texels)
+            rows = []
+            for by in range(blocks_height):
+                row_start = by * blocks_width * 64
+                for j in range(0, 64, 16):
+                    start = row_start + j
+                    rows.extend(view[pos:pos+16] for pos in range(start, start + blocks_width * 64, 64))
+            return b''.join(rows)
+
+        # Partial blocks wrap into the next rows, keep the exact per texel placement there
+        if numpy is not None:
+            texels = texels.tobytes()
+
         pos = 0
         ret = bytearray(4 * width * height)
-
         for y in range(0, height, 4):
             for x in range(0, width, 4):
-                alpha0, alpha1, alpha2, alpha3, color0, color1, bits = unpack_from("<4H2HI", data, pos)
-                pos += 16
-
-                r0, g0, b0 = ImageDecoder._decode565(color0)
-                r1, g1, b1 = ImageDecoder._decode565(color1)
-                alphas = (alpha0, alpha1, alpha2, alpha3)
-
-                # Decode this block into 4x4 pixels
                 for j in range(4):
                     for i in range(4):
-                        # Get next control op and generate a pixel
-                        control = bits & 3
-                        bits = bits >> 2
-                        if control == 0:
-                            r, g, b = r0, g0, b0
-                        elif control == 1:
-                            r, g, b = r1, g1, b1
-                        elif control == 2:
-                            if color0 > color1:
-                                r, g, b = ImageDecoder._c2a(r0, r1), ImageDecoder._c2a(g0, g1), ImageDecoder._c2a(b0, b1)
-                            else:
-                                r, g, b = ImageDecoder._c2b(r0, r1), ImageDecoder._c2b(g0, g1), ImageDecoder._c2b(b0, b1)
-                        elif control == 3:
-                            if color0 > color1:
-                                r, g, b = ImageDecoder._c3(r0, r1),ImageDecoder. _c3(g0, g1), ImageDecoder._c3(b0, b1)
-                            else:
-                                r, g, b = 0, 0, 0
-
-                        a = ((alphas[j] >> (i * 4)) & 0xf) * 0x11
                         idx = 4 * ((y + j) * width + (x + i))
-                        if premultiplied and a > 0:
-                            r = min(round(r * 255 / a), 255)
-                            g = min(round(g * 255 / a), 255)
-                            b = min(round(b * 255 / a), 255)
-                        ret[idx:idx+4] = bytes([r, g, b, a])
+                        ret[idx:idx+4] = texels[pos:pos+4]
+                        pos += 4
 
         return bytes(ret)
 
+    @staticmethod
+    def bc1(data, width, height, alpha_flag):
+        count = ImageDecoder._bc_blocks_count(width, height)
+
+        if numpy is not None:
+            blocks = numpy.frombuffer(data, numpy.uint8, count * 8).reshape(count, 8)
+            texels = ImageDecoder._bc_colors_numpy(blocks, 0, alpha_flag)
+        else:
+            texels = ImageDecoder._bc_colors(data, count, 8, alpha_flag)
+
+        return ImageDecoder._bc_assemble(texels, width, height)
+
+    @staticmethod
+    def bc2(data, width, height, premultiplied):
+        count = ImageDecoder._bc_blocks_count(width, height)
+
+        if numpy is not None:
+            blocks = numpy.frombuffer(data, numpy.uint8, count * 16).reshape(count, 16)
+            texels = ImageDecoder._bc_colors_numpy(blocks, 8, 0)
+
+            # Explicit 4-bit alphas, low nibble first
+            alphas = numpy.empty((count, 16), numpy.uint8)
+            alphas[:, 0::2] = blocks[:, :8] & 0xf
+            alphas[:, 1::2] = blocks[:, :8] >> 4
+            texels[:, :, 3] = alphas * 0x11
+
+        else:
+            texels = ImageDecoder._bc_colors(data, count, 16, 0)
+
+            alpha_bits = bytearray(count * 8)
+            for i in range(8):
+                alpha_bits[i::8] = data[i:count*16:16]
+
+            alphas = bytearray(count * 16)
+            alphas[0::2] = alpha_bits.translate(bytes((b & 0xf) * 0x11 for b in range(0x100)))
+            alphas[1::2] = alpha_bits.translate(bytes((b >> 4) * 0x11 for b in range(0x100)))
+            texels[3::4] = alphas
+
+        if premultiplied:
+            texels = ImageDecoder._bc_unpremultiply(texels)
+
+        return ImageDecoder._bc_assemble(texels, width, height)
+
     @staticmethod
     def bc3(data, width, height, premultiplied):
-        pos = 0
-        ret = bytearray(4 * width * height)
+        count = ImageDecoder._bc_blocks_count(width, height)
+
+        if numpy is not None:
+            blocks = numpy.frombuffer(data, numpy.uint8, count * 16).reshape(count, 16)
+            texels = ImageDecoder._bc_colors_numpy(blocks, 8, 0)
+
+            # Interpolated alphas, evaluated in the same order as the scalar decoder
+            alpha0 = blocks[:, 0].astype(numpy.float64)[:, None]
+            alpha1 = blocks[:, 1].astype(numpy.float64)[:, None]
+            eight_alphas = blocks[:, 0] > blocks[:, 1]
+
+            alphas = numpy.empty((count, 8), numpy.uint8)
+            alphas[:, 0], alphas[:, 1] = blocks[:, 0], blocks[:, 1]
+            alphas[:, 2:8] = numpy.where(
+                eight_alphas[:, None],
+                numpy.rint(alpha0 * numpy.array([6/7, 5/7, 4/7, 3/7, 2/7, 1/7]) +
+                           alpha1 * numpy.array([1/7, 2/7, 3/7, 4/7, 5/7, 6/7])),
+                numpy.concatenate((
+                    numpy.rint(alpha0 * numpy.array([4/5, 3/5, 2/5, 1/5]) +
+                               alpha1 * numpy.array([1/5, 2/5, 3/5, 4/5])),
+                    numpy.broadcast_to([0, 255], (count, 2))
+                ), axis=1)
+            )
 
-        for y in range(0, height, 4):
-            for x in range(0, width, 4):
-                alpha0 = data[pos]
-                alpha1 = data[pos + 1]
-                alpha_bits = unpack_from("<6B", data, pos + 2)
-                pos += 8
-
-                # Combine alpha bits into 48-bit integer
-                alpha_indices = (alpha_bits[0] | (alpha_bits[1] << 8) | (alpha_bits[2] << 16) |
-                                (alpha_bits[3] << 24) | (alpha_bits[4] << 32) | (alpha_bits[5] << 40))
-
-                color0, color1, bits = unpack_from("<2HI", data, pos)
-                pos += 8
-
-                r0, g0, b0 = ImageDecoder._decode565(color0)
-                r1, g1, b1 = ImageDecoder._decode565(color1)
-
-                # Calculate alpha values
-                if alpha0 > alpha1:
-                    alphas = (
-                        alpha0,
-                        alpha1,
-                        round(alpha0 * (6 / 7) + alpha1 * (1 / 7)),
-                        round(alpha0 * (5 / 7) + alpha1 * (2 / 7)),
-                        round(alpha0 * (4 / 7) + alpha1 * (3 / 7)),
-                        round(alpha0 * (3 / 7) + alpha1 * (4 / 7)),
-                        round(alpha0 * (2 / 7) + alpha1 * (5 / 7)),
-                        round(alpha0 * (1 / 7) + alpha1 * (6 / 7))
-                    )
-                else:
-                    alphas = (
-                        alpha0,
-                        alpha1,
-                        round(alpha0 * (4 / 5) + alpha1 * (1 / 5)),
-                        round(alpha0 * (3 / 5) + alpha1 * (2 / 5)),
-                        round(alpha0 * (2 / 5) + alpha1 * (3 / 5)),
-                        round(alpha0 * (1 / 5) + alpha1 * (4 / 5)),
-                        0,
-                        255
-                    )
+            alpha_bits = numpy.zeros(count, numpy.uint64)
+            for i in range(6):
+                alpha_bits |= blocks[:, 2 + i].astype(numpy.uint64) << numpy.uint64(8 * i)
 
-                # Decode this block into 4x4 pixels
-                for j in range(4):
-                    for i in range(4):
-                        # Get next control op and generate a pixel
-                        control = bits & 3
-                        bits = bits >> 2
-                        if control == 0:
-                            r, g, b = r0, g0, b0
-                        elif control == 1:
-                            r, g, b = r1, g1, b1
-                        elif control == 2:
-                            if color0 > color1:
-                                r, g, b = ImageDecoder._c2a(r0, r1), ImageDecoder._c2a(g0, g1), ImageDecoder._c2a(b0, b1)
-                            else:
-                                r, g, b = ImageDecoder._c2b(r0, r1), ImageDecoder._c2b(g0, g1), ImageDecoder._c2b(b0, b1)
-                        elif control == 3:
-                            if color0 > color1:
-                                r, g, b = ImageDecoder._c3(r0, r1), ImageDecoder._c3(g0, g1), ImageDecoder._c3(b0, b1)
-                            else:
-                                r, g, b = 0, 0, 0
-
-                        # Get alpha index (3 bits per pixel)
-                        pixel_idx = j * 4 + i
-                        alpha_index = (alpha_indices >> (3 * pixel_idx)) & 0x7
-                        a = alphas[alpha_index]
+            shifts = numpy.arange(0, 48, 3, dtype=numpy.uint64)
+            indices = ((alpha_bits[:, None] >> shifts) & numpy.uint64(7)).astype(numpy.intp)
+            texels[:, :, 3] = alphas[numpy.arange(count)[:, None], indices]
 
-                        idx = 4 * ((y + j) * width + (x + i))
-                        if premultiplied and a > 0:
-                            r = min(round(r * 255 / a), 255)
-                            g = min(round(g * 255 / a), 255)
-                            b = min(round(b * 255 / a), 255)
-                        ret[idx:idx+4] = bytes([r, g, b, a])
+        else:
+            texels = ImageDecoder._bc_colors(data, count, 16, 0)
+            alphas_cache = ImageDecoder._lookup_table('bc3_alphas', dict)
+            indices_table = ImageDecoder._lookup_table('bc3_indices', ImageDecoder._bc3_indices_table)
 
-        return bytes(ret)
+            alphas = bytearray()
+            for pos in range(0, count * 16, 16):
+                key = (data[pos] << 8) | data[pos+1]
+                palette = alphas_cache.get(key)
+                if palette is None:
+                    palette = alphas_cache[key] = ImageDecoder._bc3_alphas(data[pos], data[pos+1])
+
+                bits = int.from_bytes(data[pos+2:pos+8], 'little')
+                alphas += bytes(map(palette.__getitem__,
+                                    indices_table[bits & 0xfff] + indices_table[(bits >> 12) & 0xfff] +
+                                    indices_table[(bits >> 24) & 0xfff] + indices_table[bits >> 36]))
+            texels[3::4] = alphas
+
+        if premultiplied:
+            texels = ImageDecoder._bc_unpremultiply(texels)
+
+        return ImageDecoder._bc_assemble(texels, width, height)
 
     @staticmethod
-    def bgra1555(data, width, height):
-        pos = 0
-        ret = bytearray(4 * width * height)
+    def _rgba1555(bits):
+        a, r, g, b = ImageDecoder._decode1555(bits)
+        return bytes((r, g, b, a))
 
-        for i in range(0, len(data), 2):
-            color = unpack_from("<H", data, i)[0]
-            a, r, g, b = ImageDecoder._decode1555(color)
-            ret[pos:pos+4] = r, g, b, a
-            pos += 4
-        return bytes(ret)
+    @staticmethod
+    def _rgba4444(bits):
+        a, r, g, b = ImageDecoder._decode4444(bits)
+        return bytes((r, g, b, a))
 
     @staticmethod
-    def bgra4444(data, width, height):
-        pos = 0
-        ret = bytearray(4 * width * height)
+    def _rgba555(bits):
+        r, g, b = ImageDecoder._decode555(bits)
+        return bytes((r, g, b, 0xff))
 
-        for i in range(0, len(data), 2):
-            color = unpack_from("<H", data, i)[0]
-            a, r, g, b = ImageDecoder._decode4444(color)
-            ret[pos:pos+4] = r, g, b, a
-            pos += 4
-        return bytes(ret)
+    @staticmethod
+    def _rgba565(bits):
+        r, g, b = ImageDecoder._decode565(bits)
+        return bytes((r, g, b, 0xff))
 
     @staticmethod
-    def bgra555(data, width, height):
-        pos = 0
-        ret = bytearray(4 * width * height)
+    def _convert16(data, width, height, decode):
+        # Every 16-bit texel value is looked up in a 65536 entry RGBA table
+        def build_table():
+            table = [decode(bits) for bits in range(0x10000)]
+            if numpy is not None:
+                return numpy.frombuffer(b''.join(table), numpy.uint32)
+            return table
+
+        table = ImageDecoder._lookup_table(decode.__name__, build_table)
+
+        if numpy is not None:
+            ret = table[numpy.frombuffer(data, "<u2")].tobytes()
+        else:
+            texels = array('H', data)
+            if sys.byteorder != 'little':
+                texels.byteswap()
+            ret = b''.join(map(table.__getitem__, texels))
 
-        for i in range(0, len(data), 2):
-            color = unpack_from("<H", data, i)[0]
-            r, g, b = ImageDecoder._decode555(color)
-            ret[pos:pos+4] = r, g, b, 0xff
-            pos += 4
-        return bytes(ret)
+        return ImageDecoder._pad_rgba(ret, width, height)
 
     @staticmethod
-    def bgra565(data, width, height):
-        pos = 0
-        ret = bytearray(4 * width * height)
+    def _pad_rgba(data, width, height):
+        size = 4 * width * height
+        if len(data) < size:
+            data += bytes(size - len(data))
+        return bytes(data)
 
-        for i in range(0, len(data), 2):
-            color = unpack_from("<H", data, i)[0]
-            r, g, b = ImageDecoder._decode565(color)
-            ret[pos:pos+4] = r, g, b, 0xff
-            pos += 4
-        return bytes(ret)
+    @staticmethod
+    def _palette_channels(palette, colors_num):
+        # Splits the palette into per channel translation tables
+        palette = bytes(palette[:colors_num * 4]).ljust(1024, b'\0')
+        return [palette[i::4] for i in range(4)]
+
+    @staticmethod
+    def _translate_indices(indices, channels, width, height):
+        ret = bytearray(4 * len(indices))
+        for i, channel in enumerate(channels):
+            if channel is None:
+                ret[i::4] = b'\xff' * len(indices)
+            else:
+                ret[i::4] = indices.translate(channel)
+        return ImageDecoder._pad_rgba(ret, width, height)
+
+    @staticmethod
+    def _unpack_nibbles(data):
+        # Two indices per byte, high nibble first
+        indices = bytearray(2 * len(data))
+        indices[0::2] = data.translate(bytes(b >> 4 for b in range(0x100)))
+        indices[1::2] = data.translate(bytes(b & 0xf for b in range(0x100)))
+        return indices
+
+    @staticmethod
+    def bgra1555(data, width, height):
+        return ImageDecoder._convert16(data, width, height, ImageDecoder._rgba1555)
+
+    @staticmethod
+    def bgra4444(data, width, height):
+        return ImageDecoder._convert16(data, width, height, ImageDecoder._rgba4444)
+
+    @staticmethod
+    def bgra555(data, width, height):
+        return ImageDecoder._convert16(data, width, height, ImageDecoder._rgba555)
+
+    @staticmethod
+    def bgra565(data, width, height):
+        return ImageDecoder._convert16(data, width, height, ImageDecoder._rgba565)
 
     @staticmethod
     def bgra888(data, width, height):
-        ret = bytearray(4 * width * height)
-        for i in range(0, len(data), 4):
-            ret[i:i+4] = data[i+2], data[i+1], data[i+0], 0xff
-        return bytes(ret)
+        ret = bytearray(data[:len(data) // 4 * 4])
+        ret[0::4] = data[2::4][:len(ret) // 4]
+        ret[2::4] = data[0::4][:len(ret) // 4]
+        ret[3::4] = b'\xff' * (len(ret) // 4)
+        return ImageDecoder._pad_rgba(ret, width, height)
 
     @staticmethod
     def bgra8888(data, width, height):
-        ret = bytearray(4 * width * height)
-        for i in range(0, len(data), 4):
-            ret[i:i+4] = data[i+2], data[i+1], data[i+0], data[i+3]
-        return bytes(ret)
+        ret = bytearray(data[:len(data) // 4 * 4])
+        ret[0::4] = data[2::4][:len(ret) // 4]
+        ret[2::4] = data[0::4][:len(ret) // 4]
+        return ImageDecoder._pad_rgba(ret, width, height)
 
     @staticmethod
     def lum8(data, width, height):
-        ret = bytearray(4 * width * height)
-        for i, c in enumerate(data):
-            pos = i * 4
-            ret[pos:pos+4] = c, c, c, 0xff
-        return bytes(ret)
+        ret = bytearray(4 * len(data))
+        ret[0::4] = ret[1::4] = ret[2::4] = data
+        ret[3::4] = b'\xff' * len(data)
+        return ImageDecoder._pad_rgba(ret, width, height)
 
     @staticmethod
     def lum8a8(data, width, height):
-        pos = 0
-        ret = bytearray(4 * width * height)
-
-        for i in range(0, len(data), 2):
-            c, a = data[i], data[i+1]
-            ret[pos:pos+4] = c, c, c, a
-            pos += 4
-        return bytes(ret)
+        ret = bytearray(2 * len(data))
+        ret[0::4] = ret[1::4] = ret[2::4] = data[0::2]
+        ret[3::4] = data[1::2]
+        return ImageDecoder._pad_rgba(ret, width, height)
 
     @staticmethod
     def pal4(data, palette, width, height):
-        pos = 0
-        ret = bytearray(4 * width * height)
-
-        for i in data:
-            idx1, idx2 = (i >> 4) & 0xf, i & 0xf
-            ret[pos+0:pos+4] = palette[idx1*4:idx1*4+4]
-            ret[pos+4:pos+8] = palette[idx2*4:idx2*4+4]
-            pos += 8
-
-        return bytes(ret)
+        channels = ImageDecoder._palette_channels(palette, 16)
+        return ImageDecoder._translate_indices(ImageDecoder._unpack_nibbles(data), channels, width, height)
 
     @staticmethod
     def pal4_noalpha(data, palette, width, height):
-        pos = 0
-        ret = bytearray(4 * width * height)
-
-        for i in data:
-            idx1, idx2 = (i >> 4) & 0xf, i & 0xf
-            ret[pos+0:pos+4] = palette[idx1*4:idx1*4+3] + b'\xff'
-            ret[pos+4:pos+8] = palette[idx2*4:idx2*4+3] + b'\xff'
-            pos += 8
-
-        return bytes(ret)
+        channels = ImageDecoder._palette_channels(palette, 16)[:3] + [None]
+        return ImageDecoder._translate_indices(ImageDecoder._unpack_nibbles(data), channels, width, height)
 
     @staticmethod
     def pal8(data, palette, width, height):
-        pos = 0
-        ret = bytearray(4 * width * height)
-
-        for idx in data:
-            ret[pos:pos+4] = palette[idx*4:idx*4+4]
-            pos += 4
-
-        return bytes(ret)
+        channels = ImageDecoder._palette_channels(palette, 256)
+        return ImageDecoder._translate_indices(data, channels, width, height)
 
     @staticmethod
     def pal8_noalpha(data, palette, width, height):
-        pos = 0
-        ret = bytearray(4 * width * height)
+        channels = ImageDecoder._palette_channels(palette, 256)[:3] + [None]
+        return ImageDecoder._translate_indices(data, channels, width, height)
 
-        for idx in data:
-            ret[pos:pos+4] = palette[idx*4:idx*4+3] + b'\xff'
-            pos += 4
+#######################################################
+class SwizzlePlan:
 
-        return bytes(ret)
+    __slots__ = [
+        'source_size',
+        'indices'
+    ]
+
+    #######################################################
+    def __init__(self, source_size, indices):
+        # Source byte of every destination byte, source_size marks bytes left blank
+        self.source_size = source_size
+        self.indices = numpy.asarray(indices, dtype=numpy.intp) if numpy is not None else indices
+
+    #######################################################
+    def apply(self, data):
+        data = bytes(data[:self.source_size]).ljust(self.source_size + 1, b'\0')
+
+        if numpy is not None:
+            return numpy.frombuffer(data, numpy.uint8)[self.indices].tobytes()
+        return bytes(map(data.__getitem__, self.indices))
+
+    #######################################################
+    @staticmethod
+    def get(key, builder):
+        # Plans are shared by every texture of the same platform, format and size
+        plan = _swizzle_plans.get(key)
+        if plan is None:
+            plan = _swizzle_plans[key] = builder()
+        return plan
 
 #######################################################
 class TextureNative:
@@ -604,7 +1078,7 @@ class TextureNative:
     #######################################################
     def read_pixels(self, data, offset):
         pixels_len = unpack_from("<I", data, offset)[0]
-        return data[offset+4:offset+4+pixels_len]
+        return bytes(data[offset+4:offset+4+pixels_len])
 
     #######################################################
     def read_palette(self, data, offset):
@@ -612,13 +1086,13 @@ class TextureNative:
 
         if palette_format != PaletteType.PALETTE_NONE:
             if palette_format == PaletteType.PALETTE_8:
-                return data[offset:offset+1024]
+                return bytes(data[offset:offset+1024])
 
             else:
                 if self.depth == 4:
-                    return data[offset:offset+64]
+                    return bytes(data[offset:offset+64])
 
-                return data[offset:offset+128]
+                return bytes(data[offset:offset+128])
 
         return b''
 
@@ -699,6 +1173,81 @@ class TextureNative:
 
         return self
 
+    #######################################################
+    def from_rgba(name, rgba, width, height, texture_format='8888', mipmaps=False,
+                  mip_filter='BOX'):
+
+        # D3D9 texture of an RGBA image, texture_format is one of 8888, DXT1,
+        # DXT3, DXT5 and PAL8
+        self = TextureNative()
+
+        self.platform_id   = NativePlatformType.D3D9
+        self.filter_mode   = 0x06       # Linear Mip Linear (Trilinear)
+        self.uv_addressing = 0b00010001 # Wrap for both U and V
+        self.name          = name
+        self.mask          = ""
+        self.width         = width
+        self.height        = height
+        self.raster_type   = 4          # Texture
+
+        alpha = ImageEncoder.has_alpha(rgba)
+        compressed = texture_format in ('DXT1', 'DXT3', 'DXT5')
+
+        # Block compression needs whole blocks on the first level
+        if compressed and (width % 4 or height % 4):
+            raise RuntimeError("%s needs a size in multiples of 4, '%s' is %dx%d" % (
+                texture_format, name, width, height))
+
+        levels = [(rgba, width, height)]
+        if mipmaps:
+            levels = ImageEncoder.mipmaps(rgba, width, height, mip_filter, 4 if compressed else 1)
+
+        palette_type = PaletteType.PALETTE_NONE
+
+        if texture_format == 'DXT1':
+            raster_format = RasterFormat.RASTER_1555 if alpha else RasterFormat.RASTER_565
+            self.d3d_format = D3DFormat.D3D_DXT1
+            self.depth = 16
+            self.pixels = [ImageEncoder.bc1(*level, alpha) for level in levels]
+
+        elif texture_format == 'DXT3':
+            raster_format = RasterFormat.RASTER_4444
+            self.d3d_format = D3DFormat.D3D_DXT3
+            self.depth = 16
+            self.pixels = [ImageEncoder.bc2(*level) for level in levels]
+
+        elif texture_format == 'DXT5':
+            raster_format = RasterFormat.RASTER_4444
+            self.d3d_format = D3DFormat.D3D_DXT5
+            self.depth = 16
+            self.pixels = [ImageEncoder.bc3(*level) for level in levels]
+
+        elif texture_format == 'PAL8':
+            raster_format = RasterFormat.RASTER_8888 if alpha else RasterFormat.RASTER_888
+            palette_type = PaletteType.PALETTE_8
+            self.d3d_format = D3DFormat.D3DFMT_P8
+            self.depth = 8
+            self.palette, self.pixels = ImageEncoder.pal8(levels)
+
+        else:
+            raster_format = RasterFormat.RASTER_8888
+            self.d3d_format = D3DFormat.D3D_8888
+            self.depth = 32
+            self.pixels = [ImageEncoder.rgba_to_bgra8888(level[0]) for level in levels]
+
+        self.num_levels = len(levels)
+        self.raster_format_flags = (raster_format << 8) | 0x05 | (palette_type << 13)
+        if self.num_levels > 1:
+            self.raster_format_flags |= 0x8000
+
+        PlatformProperties = namedtuple(
+            "PlatformProperties",
+            ["alpha", "cube_texture", "auto_mipmaps", "compressed"]
+        )
+        self.platform_properties = PlatformProperties(alpha, False, False, compressed)
+
+        return self
+
     #######################################################
     def to_mem(self):
 
@@ -791,27 +1340,70 @@ class Image:
         return self
 
 #######################################################
-class txd:
+class TextureCache:
+
+    __slots__ = [
+        'max_size',
+        'size',
+        '_entries'
+    ]
+
+    #######################################################
+    def __init__(self, max_size=256 * 1024 * 1024):
+        self.max_size = max_size
+        self.size = 0
+        self._entries = OrderedDict()
 
     #######################################################
-    def _read(self, size):
-        current_pos = self.pos
-        self.pos += size
+    def __len__(self):
+        return len(self._entries)
 
-        return current_pos
+    #######################################################
+    def get(self, key):
+        rgba = self._entries.get(key)
+        if rgba is not None:
+            self._entries.move_to_end(key)
+        return rgba
 
     #######################################################
-    def raw(self, size, offset=None):
+    def put(self, key, rgba):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.size -= len(old)
+
+        # Don't let a single texture flush the whole cache
+        if len(rgba) > self.max_size:
+            return
 
-        if offset is None:
-            offset = self.pos
+        self._entries[key] = rgba
+        self.size += len(rgba)
 
-        return self.data[offset:offset+size]
+        while self.size > self.max_size:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted)
 
     #######################################################
-    def read_chunk(self):
-        chunk = Sections.read(Chunk, self.data, self._read(12))
-        return chunk
+    def get_rgba(self, content_hash, name, texture, level=0):
+        # Decoded texture level, keyed by the content of the file it came from
+        key = (content_hash, name, level)
+
+        rgba = self.get(key)
+        if rgba is None:
+            rgba = bytes(texture.to_rgba(level))
+            self.put(key, rgba)
+
+        return rgba
+
+    #######################################################
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+# Decoded textures shared by every loaded TXD
+texture_cache = TextureCache()
+
+#######################################################
+class txd(ChunkReader):
 
     #######################################################
     def read_texture_native(self, parent_chunk):
@@ -886,7 +1478,7 @@ class txd:
 
         # Pixels
         pixels_len = image.pitch * image.height
-        image.pixels = self.raw(pixels_len)
+        image.pixels = bytes(self.raw(pixels_len))
         self._read(pixels_len)
 
         # Palette
@@ -896,7 +1488,7 @@ class txd:
         elif image.depth == 4:
             palette_len = 64
 
-        image.palette = self.raw(palette_len)
+        image.palette = bytes(self.raw(palette_len))
         self._read(palette_len)
 
         return image
@@ -915,17 +1507,17 @@ class txd:
 
         # Texture Name
         chunk = self.read_chunk()
-        texture.name = self.raw(
+        texture.name = bytes(self.raw(
             strlen(self.data, self.pos)
-        ).decode("utf-8")
+        )).decode("utf-8")
 
         self._read(chunk.size)
 
         # Mask Name
         chunk = self.read_chunk()
-        texture.mask = self.raw(
+        texture.mask = bytes(self.raw(
             strlen(self.data, self.pos)
-        ).decode("utf-8")
+        )).decode("utf-8")
 
         self._read(chunk.size)
 
@@ -988,7 +1580,8 @@ class txd:
 
     #######################################################
     def load_memory(self, data):
-        self.data = data
+        self.data = memoryview(data)
+        self.content_hash = hashlib.blake2b(self.data, digest_size=16).digest()
 
         chunk = self.read_chunk()
         self.rw_version = Sections.get_rw_version(chunk.version)
@@ -1005,16 +1598,10 @@ class txd:
         self.images          = []
         self.pos             = 0
         self.data            = ""
+        self.content_hash    = b""
         self.rw_version      = ""
         self.device_id       = DeviceType.DEVICE_NONE
 
-    #######################################################
-    def load_file(self, filename):
-
-        with open(filename, mode='rb') as file:
-            content = file.read()
-            self.load_memory(content)
-
     #######################################################
     def write_native_texture(self, texture):
 
@@ -1055,3 +1642,10 @@ class txd:
     #######################################################
     def __init__(self):
         self.clear()
+
+# Encoder round trip check: python -m gtaLib.txd
+if __name__ == "__main__":
+    failures = ImageEncoder.check_block_compression()
+    if failures:
+        sys.exit("Block compression round trip failed: %s" % ", ".join(failures))
+    print("Block compression round trip ok")
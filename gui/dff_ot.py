@@ -700,12 +700,46 @@ class EXPORT_OT_txd(bpy.types.Operator, ExportHelper):
         default         = True
     )
 
+    texture_format      : bpy.props.EnumProperty(
+        name            = "Format",
+        description     = "Raster format of the exported textures",
+        items           = (
+            ('8888', "Uncompressed", "32 bit RGBA"),
+            ('DXT1', "DXT1", "Block compression with 1 bit alpha"),
+            ('DXT3', "DXT3", "Block compression with explicit alpha"),
+            ('DXT5', "DXT5", "Block compression with interpolated alpha"),
+            ('PAL8', "PAL8", "8 bit palette")
+        ),
+        default         = '8888'
+    )
+
+    mipmaps             : bpy.props.BoolProperty(
+        name            = "Generate Mipmaps",
+        description     = "Generate the mipmap levels of the exported textures",
+        default         = False
+    )
+
+    mip_filter          : bpy.props.EnumProperty(
+        name            = "Mipmap Filter",
+        items           = (
+            ('BOX', "Box", "Average of 2x2 texels"),
+            ('KAISER', "Kaiser", "Kaiser windowed sinc, sharper than the box filter")
+        ),
+        default         = 'BOX'
+    )
+
     #######################################################
     def draw(self, context):
         layout = self.layout
 
         layout.prop(self, "mass_export")
         layout.prop(self, "only_used_textures")
+        layout.prop(self, "texture_format")
+        layout.prop(self, "mipmaps")
+
+        row = layout.row()
+        row.enabled = self.mipmaps
+        row.prop(self, "mip_filter")
 
         return None
 
@@ -714,16 +748,22 @@ class EXPORT_OT_txd(bpy.types.Operator, ExportHelper):
         start = time.time()
         try:
             from ..ops import txd_exporter
-            txd_exporter.export_txd(
+            exporter = txd_exporter.export_txd(
                 {
                     "file_name"          : self.filepath,
                     "directory"          : self.directory,
                     "mass_export"        : self.mass_export,
                     "only_used_textures" : self.only_used_textures,
+                    "texture_format"     : self.texture_format,
+                    "mipmaps"            : self.mipmaps,
+                    "mip_filter"         : self.mip_filter,
                     "version"            : 0x36003, # TODO: more versions support
                 }
             )
             end = time.time()
+            for warning in exporter.warnings:
+                self.report({'WARNING'}, warning)
+
             self.report({"INFO"}, f"Finished export in {end - start:.2f}s")
             print("Exported TXD successfully in %.4f seconds" % (end - start))
 
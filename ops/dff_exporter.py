@@ -17,6 +17,7 @@
 import bpy
 import bmesh
 import mathutils
+import numpy
 
 from collections import OrderedDict
 
@@ -615,9 +616,17 @@ class dff_exporter:
 
     #######################################################
     @staticmethod
-    def populate_geometry_from_vertices_data(vertices_list, skin_plg, dm_entries,
-                                             obj, geometry, num_vcols):
+    def foreach_get(collection, attribute, dtype, width=1):
+        data = numpy.empty(len(collection) * width, dtype=dtype)
+        collection.foreach_get(attribute, data)
+        return data.reshape(-1, width) if width > 1 else data
 
+    #######################################################
+    @staticmethod
+    def populate_geometry_from_vertices_data(vertices_data, skin_plg, dm_entries,
+                                             obj, geometry):
+
+        num_vcols = len(vertices_data['vert_cols'])
         has_prelit_colors = num_vcols > 0 and obj.dff.day_cols
         has_night_colors  = num_vcols > 1 and obj.dff.night_cols
 
@@ -636,53 +645,45 @@ class dff_exporter:
             delta_morph_plg = dff.DeltaMorphPLG()
             for entrie in dm_entries:
                 delta_morph_plg.append_entry(entrie)
-           
-        for idx, vertex in enumerate(vertices_list):
-            geometry.vertices.append(dff.Vector._make(vertex['co']))
-            geometry.normals.append(dff.Vector._make(vertex['normal']))
-
-            # vcols
-            #######################################################
-            if has_prelit_colors:
-                geometry.prelit_colors.append(dff.RGBA._make(
-                    int(col * 255) for col in vertex['vert_cols'][0]))
-            if has_night_colors:
-                extra_vert.colors.append(dff.RGBA._make(
-                    int(col * 255) for col in vertex['vert_cols'][1]))
-
-            # uv layers
-            #######################################################
-            for index, uv in enumerate(vertex['uvs']):
-                if index >= max_uv_layers:
-                    break
 
-                while index >= len(geometry.uv_layers):
-                    geometry.uv_layers.append([])
+        if len(vertices_data['co']) == 0:
+            max_uv_layers = 0
 
-                geometry.uv_layers[index].append(dff.TexCoords(uv.x, 1-uv.y))
+        geometry.vertices.extend(map(dff.Vector._make, vertices_data['co'].tolist()))
+        geometry.normals.extend(map(dff.Vector._make, vertices_data['normal'].tolist()))
 
-            # bones
-            #######################################################
-            if skin_plg is not None:
-                skin_plg.vertex_bone_indices.append([0,0,0,0])
-                skin_plg.vertex_bone_weights.append([0,0,0,0])
+        # vcols
+        #######################################################
+        def to_rgba(colors):
+            colors = numpy.clip((colors.astype(numpy.float64) * 255).astype(numpy.int32), 0, 255)
+            return map(dff.RGBA._make, colors.tolist())
 
-                for index, bone in enumerate(vertex['bones']):
-                    skin_plg.vertex_bone_indices[-1][index] = bone[0]
-                    skin_plg.vertex_bone_weights[-1][index] = bone[1]
+        if has_prelit_colors:
+            geometry.prelit_colors.extend(to_rgba(vertices_data['vert_cols'][0]))
+        if has_night_colors:
+            extra_vert.colors.extend(to_rgba(vertices_data['vert_cols'][1]))
 
-            # delta_morph
-            #######################################################
-            if delta_morph_plg is not None:
-                sk_cos = vertex['sk_cos']
-                for index, co in enumerate(sk_cos[1:]):
-                    pos = mathutils.Vector(co) - mathutils.Vector(sk_cos[0])
-                    if pos.length == 0.0:
-                        continue
+        # uv layers
+        #######################################################
+        for uvs in vertices_data['uvs'][:max_uv_layers]:
+            geometry.uv_layers.append([dff.TexCoords(u, 1-v) for u, v in uvs.tolist()])
+
+        # bones
+        #######################################################
+        if skin_plg is not None:
+            skin_plg.vertex_bone_indices = vertices_data['bone_indices'].tolist()
+            skin_plg.vertex_bone_weights = vertices_data['bone_weights'].tolist()
+
+        # delta_morph
+        #######################################################
+        if delta_morph_plg is not None:
+            sk_cos = vertices_data['sk_cos']
+            for entrie, cos in zip(dm_entries, sk_cos[1:]):
+                positions = cos - sk_cos[0]
+                indices = numpy.flatnonzero(positions.any(axis=1))
 
-                    entrie = dm_entries[index]
-                    entrie.indices.append(idx)
-                    entrie.positions.append(pos)
+                entrie.indices.extend(indices.tolist())
+                entrie.positions.extend(map(dff.Vector._make, positions[indices].tolist()))
 
         if skin_plg is not None:
             geometry.extensions['skin'] = skin_plg
@@ -693,60 +694,72 @@ class dff_exporter:
 
     #######################################################
     @staticmethod
-    def populate_geometry_from_faces_data(faces_list, geometry):
-        triangles = [
-            dff.Triangle._make((
-                verts[1], #b
-                verts[0], #a
-                face['mat_idx'], #material
-                verts[2] #c
-            ))
-            for face in faces_list
-            for verts in [face['verts']]
-        ]
-        geometry.triangles.extend(triangles)
-        geometry.triangles.sort(key=lambda triangle: triangle.material)
+    def populate_geometry_from_faces_data(faces, materials, geometry):
+
+        # Sorted by material, keeping the order of the faces within each one
+        order = numpy.argsort(materials, kind='stable')
+        triangles = numpy.stack((
+            faces[order, 1], #b
+            faces[order, 0], #a
+            materials[order], #material
+            faces[order, 2] #c
+        ), axis=1)
+
+        geometry.triangles.extend(map(dff.Triangle._make, triangles.tolist()))
 
     #######################################################
     @staticmethod
-    def convert_slinear_to_srgb (col):
-        color = mathutils.Color (col[:3])
-        color_srgb = color.from_scene_linear_to_srgb()
-        return tuple(max(0, min(1, channel)) for channel in color_srgb) + (col[3],)  # Including alpha unchanged
+    def linear_to_srgb(colors):
+        return numpy.where(colors < 0.0031308, colors * 12.92,
+                           1.055 * numpy.power(numpy.maximum(colors, 0.0031308), 1 / 2.4) - 0.055)
 
     #######################################################
     @staticmethod
-    def get_vertex_colors(mesh : bpy.types.Mesh):
+    def get_vertex_colors(mesh : bpy.types.Mesh, loop_vertices):
         self = dff_exporter
 
+        # Per loop colors of each layer, as (loops, 4) arrays
         v_cols = []
 
         if bpy.app.version < (3, 2, 0):
             for layer in mesh.vertex_colors:
-                v_cols.append([list(i.color) for i in layer.data])
+                v_cols.append(self.foreach_get(layer.data, "color", numpy.float32, 4))
             return v_cols
 
         for attrib in mesh.color_attributes[:2]:
-            # Already per loop
-            if attrib.domain == 'CORNER':
-                v_cols.append(
-                    [
-                        list(self.convert_slinear_to_srgb(i.color))
-                        for i in attrib.data
-                    ]
-                )
+            if "color_srgb" in attrib.bl_rna.properties['data'].fixed_type.properties:
+                colors = self.foreach_get(attrib.data, "color_srgb", numpy.float32, 4)
+            else:
+                colors = self.foreach_get(attrib.data, "color", numpy.float32, 4)
+                colors[:, :3] = self.linear_to_srgb(colors[:, :3])
+            colors[:, :3] = numpy.clip(colors[:, :3], 0, 1)
 
             # Per-vertex, need to convert to per-loop
-            else:
-                colors = {}
-                for polygon in mesh.polygons:
-                    for v_ix, l_ix in zip(polygon.vertices, polygon.loop_indices):
-                        colors[l_ix] = self.convert_slinear_to_srgb(
-                            list(attrib.data[v_ix].color))
-                v_cols.append(colors)
+            if attrib.domain != 'CORNER':
+                colors = colors[loop_vertices]
+
+            v_cols.append(colors)
 
         return v_cols
 
+    #######################################################
+    @staticmethod
+    def get_vertex_bones(mesh, bone_groups):
+
+        # Up to 4 bones of each vertex, vertex groups have no bulk access
+        indices = numpy.zeros((len(mesh.vertices), 4), numpy.int32)
+        weights = numpy.zeros((len(mesh.vertices), 4), numpy.float32)
+
+        for vertex in mesh.vertices:
+            bones = [(bone_groups[group.group], group.weight) for group in vertex.groups
+                     if group.group in bone_groups and group.weight > 0]
+
+            for index, (bone, weight) in enumerate(bones[:4]):
+                indices[vertex.index, index] = bone
+                weights[vertex.index, index] = weight
+
+        return indices, weights
+
     #######################################################
     @staticmethod
     def populate_geometry_with_mesh_data(obj, geometry):
@@ -763,11 +776,6 @@ class dff_exporter:
         if bpy.app.version < (4, 1, 0):
             mesh.calc_normals_split()
 
-        vcols = self.get_vertex_colors (mesh)
-        verts_indices = {}
-        vertices_list = []
-        faces_list = []
-
         skin_plg, bone_groups = self.get_skin_plg_and_bone_groups(obj, mesh)
         dm_entries = self.get_delta_morph_entries(obj, shape_keys)
 
@@ -775,65 +783,66 @@ class dff_exporter:
         if not self.exclude_geo_faces and len(mesh.vertices) > 0xFFFF:
             raise DffExportException(f"Too many vertices in mesh ({obj.name}): {len(mesh.vertices)}/65535")
 
-        for polygon in mesh.polygons:
-            face = {"verts": [], "mat_idx": polygon.material_index}
-
-            for loop_index in polygon.loop_indices:
-                loop = mesh.loops[loop_index]
-                vertex = mesh.vertices[loop.vertex_index]
-                uvs = []
-                vert_cols = []
-                bones = []
-                sk_cos = []
+        # Loops in the order of the polygons, triangulated polygons have 3 each
+        loop_start = self.foreach_get(mesh.polygons, "loop_start", numpy.int32)
+        loops = (loop_start[:, None] + numpy.arange(3)).ravel()
+
+        mesh_loop_vertices = self.foreach_get(mesh.loops, "vertex_index", numpy.int32)
+        loop_vertices = mesh_loop_vertices[loops]
+        loop_normals = self.foreach_get(mesh.loops, "normal", numpy.float32, 3)[loops]
+        uvs = [self.foreach_get(uv_layer.data, "uv", numpy.float32, 2)[loops]
+               for uv_layer in mesh.uv_layers]
+        vcols = [colors[loops] for colors in self.get_vertex_colors(mesh, mesh_loop_vertices)]
+
+        # Loops with the same vertex, normal and uvs share a vertex. The rows
+        # are compared as raw bits, adding 0 turns -0.0 into 0.0 first.
+        keys = numpy.concatenate(
+            [loop_vertices[:, None], (loop_normals + 0).view(numpy.int32)] +
+            [(uv + 0).view(numpy.int32) for uv in uvs], axis=1
+        )
+        keys = numpy.ascontiguousarray(keys)
+        keys = keys.view(numpy.dtype((numpy.void, keys.itemsize * keys.shape[1]))).ravel()
+        _, first_loops, inverse = numpy.unique(keys, return_index=True, return_inverse=True)
 
-                for uv_layer in mesh.uv_layers:
-                    uvs.append(uv_layer.data[loop_index].uv)
+        # Vertices are numbered in the order their first loop appears
+        order = numpy.argsort(first_loops)
+        remap = numpy.empty(len(order), numpy.int32)
+        remap[order] = numpy.arange(len(order), dtype=numpy.int32)
 
-                for vert_col in vcols:
-                    vert_cols.append(vert_col[loop_index])
+        first_loops = first_loops[order]
+        faces = remap[inverse.ravel()].reshape(-1, 3)
 
-                for group in vertex.groups:
-                    # Only upto 4 vertices per group are supported
-                    if len(bones) >= 4:
-                        break
+        # Check vertices count again since duplicate vertices may have increased
+        # vertices count above the limit
+        if not self.exclude_geo_faces and len(first_loops) > 0xFFFF:
+            raise DffExportException(f"Too many vertices in mesh ({obj.name}): {len(first_loops)}/65535")
+
+        vertices = loop_vertices[first_loops]
+        vertices_data = {
+            "co"        : self.foreach_get(mesh.vertices, "co", numpy.float32, 3)[vertices],
+            "uvs"       : [uv[first_loops] for uv in uvs],
+            "vert_cols" : [colors[first_loops] for colors in vcols],
+        }
 
-                    if group.group in bone_groups and group.weight > 0:
-                        bones.append((bone_groups[group.group], group.weight))
-
-                if shape_keys:
-                    for kb in shape_keys.key_blocks:
-                        sk_cos.append(kb.data[loop.vertex_index].co)
-
-                key = (loop.vertex_index,
-                       tuple(loop.normal),
-                       tuple(tuple(uv) for uv in uvs))
-
-                normal = loop.normal if obj.dff.export_split_normals else vertex.normal
-
-                if key not in verts_indices:
-                    face['verts'].append (len(vertices_list))
-                    verts_indices[key] = len(vertices_list)
-                    vertices_list.append({"idx": loop.vertex_index,
-                                          "co": vertex.co,
-                                          "normal": normal,
-                                          "uvs": uvs,
-                                          "vert_cols": vert_cols,
-                                          "bones": bones,
-                                          "sk_cos": sk_cos})
-                else:
-                    face['verts'].append (verts_indices[key])
+        if obj.dff.export_split_normals:
+            vertices_data["normal"] = loop_normals[first_loops]
+        else:
+            vertices_data["normal"] = self.foreach_get(mesh.vertices, "normal", numpy.float32, 3)[vertices]
 
-            faces_list.append(face)
+        if skin_plg is not None:
+            bone_indices, bone_weights = self.get_vertex_bones(mesh, bone_groups)
+            vertices_data["bone_indices"] = bone_indices[vertices]
+            vertices_data["bone_weights"] = bone_weights[vertices]
 
-        # Check vertices count again since duplicate vertices may have increased
-        # vertices count above the limit
-        if not self.exclude_geo_faces and len(vertices_list) > 0xFFFF:
-            raise DffExportException(f"Too many vertices in mesh ({obj.name}): {len(vertices_list)}/65535")
+        if dm_entries:
+            vertices_data["sk_cos"] = [self.foreach_get(kb.data, "co", numpy.float32, 3)[vertices]
+                                       for kb in shape_keys.key_blocks]
 
         self.populate_geometry_from_vertices_data(
-            vertices_list, skin_plg, dm_entries, obj, geometry, len(vcols))
+            vertices_data, skin_plg, dm_entries, obj, geometry)
 
-        self.populate_geometry_from_faces_data(faces_list, geometry)
+        materials = self.foreach_get(mesh.polygons, "material_index", numpy.int32)
+        self.populate_geometry_from_faces_data(faces, materials, geometry)
         
     
     #######################################################
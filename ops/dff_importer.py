@@ -17,6 +17,7 @@
 import os
 import bpy
 import bmesh
+import numpy
 import math
 import mathutils
 
@@ -95,7 +96,6 @@ class dff_importer:
             geom = self.dff.geometry_list[atomic.geometry]
 
             mesh = bpy.data.meshes.new(self.clean_object_name(frame.name))
-            bm   = bmesh.new()
 
             # Create a material order sorted by geometry splits
             mat_order = [split.material for split in geom.split_headers] + list(range(len(geom.materials)))
@@ -110,16 +110,6 @@ class dff_importer:
                 (geom.flags & dff.rpGEOMETRYMODULATEMATERIALCOLOR) != 0
             mesh['dragon_triangle_strip'] = (geom.flags & dff.rpGEOMETRYTRISTRIP) != 0
 
-            uv_layers = []
-            normals = []
-
-            # Vertices
-            for v in geom.vertices:
-                bm.verts.new(v)
-
-            bm.verts.ensure_lookup_table()
-            bm.verts.index_update()
-
             # Will use this later when creating frames to construct an armature
             if 'skin' in geom.extensions:
                 if atomic.frame not in self.skin_data:
@@ -127,112 +117,19 @@ class dff_importer:
                     
             if 'user_data' in geom.extensions:
                 mesh['dff_user_data'] = geom.extensions['user_data'].to_mem()[12:]
-            
-            # Add UV Layers
-            for layer in geom.uv_layers:
-                uv_layers.append(bm.loops.layers.uv.new())
-                
-            # Add Vertex Colors
-            if geom.flags & dff.rpGEOMETRYPRELIT:
-                vertex_color = bm.loops.layers.color.new()
-
-            extra_vertex_color = None
-            if 'extra_vert_color' in geom.extensions:
-                extra_vertex_color = bm.loops.layers.color.new()
 
             if (dff_importer.use_mat_split or not geom.triangles) and 'mat_split' in geom.extensions:
                 faces = geom.extensions['mat_split']
             else:
                 faces = geom.triangles
 
-            use_face_loops = geom.native_platform_type == dff.NativePlatformType.GC
-            use_custom_normals = geom.has_normals and self.import_normals
-            last_face_index = len(faces) - 1
-            vert_index = -1
-            skipped_backfaces_num = 0
-
-            for fi, f in enumerate(faces):
-
-                # Skip double face (keep the last one)
-                if fi < last_face_index:
-                    next_face = faces[fi + 1]
-                    if set((f.a, f.b, f.c)) == set((next_face.a, next_face.b, next_face.c)):
-                        vert_index += 3
-                        continue
-
-                face_vertices = (f.a, f.b, f.c)
-
-                try:
-                    face = bm.faces.new(
-                        [
-                            bm.verts[f.a],
-                            bm.verts[f.b],
-                            bm.verts[f.c]
-                        ])
-
-                except ValueError:
+            # Filled from flat arrays, bmesh is only used when backfaces need
+            # their own vertices
+            result = self.build_mesh_arrays(geom, mesh, faces, mat_indices)
+            if result is None:
+                result = self.build_mesh_bmesh(geom, mesh, faces, mat_indices)
 
-                    # Skip a face with less than 3 vertices
-                    if len(set(face_vertices)) < 3:
-                        vert_index += 3
-                        continue
-
-                    # Create backface
-                    if self.create_backfaces:
-                        bm.verts.new(geom.vertices[f.a])
-                        bm.verts.new(geom.vertices[f.b])
-                        bm.verts.new(geom.vertices[f.c])
-
-                        bm.verts.ensure_lookup_table()
-                        bm.verts.index_update()
-
-                        face = bm.faces.new(bm.verts[-3:])
-
-                    else:
-                        skipped_backfaces_num += 1
-                        vert_index += 3
-                        continue
-
-                if len(mat_indices) > 0:
-                    face.material_index = mat_indices[f.material]
-
-                # Setting UV coordinates
-                for loop_index, loop in enumerate(face.loops):
-                    if use_face_loops:
-                        vert_index += 1
-                    else:
-                        vert_index = face_vertices[loop_index]
-                    for i, layer in enumerate(geom.uv_layers):
-
-                        bl_layer = uv_layers[i]
-
-                        uv_coords = layer[vert_index]
-
-                        loop[bl_layer].uv = (
-                            uv_coords.u,
-                            1 - uv_coords.v # Y coords are flipped in Blender
-                        )
-                    # Vertex colors
-                    if geom.flags & dff.rpGEOMETRYPRELIT:
-                        loop[vertex_color] = [
-                            c / 255.0 for c in
-                            geom.prelit_colors[vert_index]
-                        ]
-                    # Night/Extra Vertex Colors
-                    if extra_vertex_color:
-                        extension = geom.extensions['extra_vert_color']
-                        loop[extra_vertex_color] = [
-                            c / 255.0 for c in
-                            extension.colors[vert_index]
-                        ]
-
-                    # Normals
-                    if use_custom_normals:
-                        normals.append(geom.normals[vert_index])
-
-                face.smooth = True
-
-            bm.to_mesh(mesh)
+            normals, skipped_backfaces_num = result
 
             if skipped_backfaces_num:
                 print('Skipped %d backfaces for atomic %d' % (skipped_backfaces_num, atomic_index))
@@ -302,6 +199,242 @@ class dff_importer:
                 self.delta_morph[atomic.frame] = [geom.extensions.get('delta_morph')]
 
                 
+    #######################################################
+    def stream_array(items, width, dtype):
+
+        # Geometry streams are read as their flat typed arrays, plain lists of
+        # namedtuples are packed first
+        if isinstance(items, dff.StreamView):
+            array = numpy.asarray(items.buffer).reshape(-1, items.width)[:, :width]
+        else:
+            array = numpy.array(items).reshape(-1, width)
+
+        return array.astype(dtype)
+
+    #######################################################
+    def add_loop_colors(mesh, colors, loop_attribs):
+        colors = dff_importer.stream_array(colors, 4, numpy.float32)[loop_attribs] / 255.0
+        colors = colors.astype(numpy.float32).ravel()
+
+        # Colors are stored as they are (sRGB) like the bmesh color layers,
+        # color_srgb is needed to do that with color attributes
+        if hasattr(mesh, "color_attributes") and \
+           "color_srgb" in bpy.types.ByteColorAttributeValue.bl_rna.properties:
+            layer = mesh.color_attributes.new("Col", 'BYTE_COLOR', 'CORNER')
+            layer.data.foreach_set("color_srgb", colors)
+        else:
+            layer = mesh.vertex_colors.new()
+            layer.data.foreach_set("color", colors)
+
+    #######################################################
+    def build_mesh_arrays(geom, mesh, faces, mat_indices):
+        self = dff_importer
+
+        vertices  = self.stream_array(geom.vertices, 3, numpy.float32)
+        triangles = self.stream_array(faces, 4, numpy.int64)
+
+        # Triangles are stored as (b, a, material, c)
+        face_vertices = triangles[:, [1, 0, 3]]
+        materials = triangles[:, 2]
+
+        if len(face_vertices) and face_vertices.max() >= len(vertices):
+            return None
+
+        # Vertex indices are 16 bit, so a sorted face packs into one key
+        sorted_vertices = numpy.sort(face_vertices, axis=1)
+        keys = (sorted_vertices[:, 0] << 42) | (sorted_vertices[:, 1] << 21) | sorted_vertices[:, 2]
+
+        # Skip double face (keep the last one)
+        keep = numpy.ones(len(keys), dtype=bool)
+        keep[:-1] = keys[:-1] != keys[1:]
+
+        # Skip a face with less than 3 vertices
+        keep &= (sorted_vertices[:, 0] != sorted_vertices[:, 1]) & \
+                (sorted_vertices[:, 1] != sorted_vertices[:, 2])
+
+        # Faces using the vertices of an earlier face are backfaces, which
+        # need their own vertices when created
+        kept = numpy.flatnonzero(keep)
+        _, first = numpy.unique(keys[kept], return_index=True)
+
+        skipped_backfaces_num = len(kept) - len(first)
+        if skipped_backfaces_num and self.create_backfaces:
+            return None
+
+        kept = kept[numpy.sort(first)]
+        loop_vertices = face_vertices[kept].ravel()
+
+        # GameCube geometries have their attributes per face corner
+        if geom.native_platform_type == dff.NativePlatformType.GC:
+            loop_attribs = (kept[:, None] * 3 + numpy.arange(3)).ravel()
+        else:
+            loop_attribs = loop_vertices
+
+        num_polygons = len(kept)
+        num_loops = len(loop_vertices)
+
+        mesh.vertices.add(len(vertices))
+        mesh.vertices.foreach_set("co", vertices.ravel())
+
+        mesh.loops.add(num_loops)
+        mesh.loops.foreach_set("vertex_index", loop_vertices.astype(numpy.int32))
+
+        mesh.polygons.add(num_polygons)
+        mesh.polygons.foreach_set("loop_start", numpy.arange(0, num_loops, 3, dtype=numpy.int32))
+        if not bpy.types.MeshPolygon.bl_rna.properties['loop_total'].is_readonly:
+            mesh.polygons.foreach_set("loop_total", numpy.full(num_polygons, 3, dtype=numpy.int32))
+        mesh.polygons.foreach_set("use_smooth", numpy.ones(num_polygons, dtype=bool))
+
+        if len(mat_indices) > 0:
+            material_indices = numpy.array(mat_indices, dtype=numpy.int32)[materials[kept]]
+            mesh.polygons.foreach_set("material_index", material_indices)
+
+        # Setting UV coordinates
+        for layer in geom.uv_layers:
+            uvs = self.stream_array(layer, 2, numpy.float32)[loop_attribs]
+            uvs[:, 1] = 1 - uvs[:, 1] # Y coords are flipped in Blender
+
+            bl_layer = mesh.uv_layers.new(do_init=False)
+            bl_layer.data.foreach_set("uv", uvs.ravel())
+
+        # Vertex colors
+        if geom.flags & dff.rpGEOMETRYPRELIT:
+            self.add_loop_colors(mesh, geom.prelit_colors, loop_attribs)
+
+        # Night/Extra Vertex Colors
+        extension = geom.extensions.get('extra_vert_color')
+        if extension is not None:
+            self.add_loop_colors(mesh, extension.colors, loop_attribs)
+
+        mesh.update(calc_edges=True)
+
+        # Normals
+        normals = []
+        if geom.has_normals and self.import_normals:
+            normals = self.stream_array(geom.normals, 3, numpy.float32)[loop_attribs].tolist()
+
+        return normals, skipped_backfaces_num
+
+    #######################################################
+    def build_mesh_bmesh(geom, mesh, faces, mat_indices):
+        self = dff_importer
+
+        bm = bmesh.new()
+
+        uv_layers = []
+        normals = []
+
+        # Vertices
+        for v in geom.vertices:
+            bm.verts.new(v)
+
+        bm.verts.ensure_lookup_table()
+        bm.verts.index_update()
+
+        # Add UV Layers
+        for layer in geom.uv_layers:
+            uv_layers.append(bm.loops.layers.uv.new())
+            
+        # Add Vertex Colors
+        if geom.flags & dff.rpGEOMETRYPRELIT:
+            vertex_color = bm.loops.layers.color.new()
+
+        extra_vertex_color = None
+        if geom.extensions.get('extra_vert_color') is not None:
+            extra_vertex_color = bm.loops.layers.color.new()
+
+        use_face_loops = geom.native_platform_type == dff.NativePlatformType.GC
+        use_custom_normals = geom.has_normals and self.import_normals
+        last_face_index = len(faces) - 1
+        vert_index = -1
+        skipped_backfaces_num = 0
+
+        for fi, f in enumerate(faces):
+
+            # Skip double face (keep the last one)
+            if fi < last_face_index:
+                next_face = faces[fi + 1]
+                if set((f.a, f.b, f.c)) == set((next_face.a, next_face.b, next_face.c)):
+                    vert_index += 3
+                    continue
+
+            face_vertices = (f.a, f.b, f.c)
+
+            try:
+                face = bm.faces.new(
+                    [
+                        bm.verts[f.a],
+                        bm.verts[f.b],
+                        bm.verts[f.c]
+                    ])
+
+            except ValueError:
+
+                # Skip a face with less than 3 vertices
+                if len(set(face_vertices)) < 3:
+                    vert_index += 3
+                    continue
+
+                # Create backface
+                if self.create_backfaces:
+                    bm.verts.new(geom.vertices[f.a])
+                    bm.verts.new(geom.vertices[f.b])
+                    bm.verts.new(geom.vertices[f.c])
+
+                    bm.verts.ensure_lookup_table()
+                    bm.verts.index_update()
+
+                    face = bm.faces.new(bm.verts[-3:])
+
+                else:
+                    skipped_backfaces_num += 1
+                    vert_index += 3
+                    continue
+
+            if len(mat_indices) > 0:
+                face.material_index = mat_indices[f.material]
+
+            # Setting UV coordinates
+            for loop_index, loop in enumerate(face.loops):
+                if use_face_loops:
+                    vert_index += 1
+                else:
+                    vert_index = face_vertices[loop_index]
+                for i, layer in enumerate(geom.uv_layers):
+
+                    bl_layer = uv_layers[i]
+
+                    uv_coords = layer[vert_index]
+
+                    loop[bl_layer].uv = (
+                        uv_coords.u,
+                        1 - uv_coords.v # Y coords are flipped in Blender
+                    )
+                # Vertex colors
+                if geom.flags & dff.rpGEOMETRYPRELIT:
+                    loop[vertex_color] = [
+                        c / 255.0 for c in
+                        geom.prelit_colors[vert_index]
+                    ]
+                # Night/Extra Vertex Colors
+                if extra_vertex_color:
+                    extension = geom.extensions['extra_vert_color']
+                    loop[extra_vertex_color] = [
+                        c / 255.0 for c in
+                        extension.colors[vert_index]
+                    ]
+
+                # Normals
+                if use_custom_normals:
+                    normals.append(geom.normals[vert_index])
+
+            face.smooth = True
+
+        bm.to_mesh(mesh)
+        bm.free()
+
+        return normals, skipped_backfaces_num
+
     #######################################################
     def set_empty_draw_properties(empty):
         empty.empty_display_type = 'CUBE'
@@ -15,12 +15,13 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import bpy
+import numpy
 import os
 import re
 
+from concurrent.futures import ThreadPoolExecutor
+
 from ..gtaLib import txd
-from ..gtaLib.txd import ImageEncoder
-from ..gtaLib.dff import NativePlatformType
 
 #######################################################
 def clear_extension(string):
@@ -32,60 +33,54 @@ class txd_exporter:
 
     mass_export = False
     only_used_textures = True
+    texture_format = '8888'
+    mipmaps = False
+    mip_filter = 'BOX'
     version = None
     file_name = ""
     path = ""
     txd = None
+    warnings = []
 
     #######################################################
     @staticmethod
-    def _create_texture_native_from_image(image, image_name):
-        pixels = list(image.pixels)
+    def _read_image_rgba(image):
         width, height = image.size
 
-        rgba_data = bytearray()
-        for h in range(height - 1, -1, -1):
-            offset = h * width * 4
-            row_pixels = pixels[offset:offset + width * 4]
-            rgba_data.extend(int(round(p * 0xff)) for p in row_pixels)
+        pixels = numpy.empty(width * height * 4, dtype=numpy.float32)
+        if hasattr(image.pixels, "foreach_get"):
+            image.pixels.foreach_get(pixels)
+        else:
+            pixels[:] = image.pixels[:]
+
+        # Flip the rows back (Blender images start at the bottom) and
+        # quantize to bytes
+        pixels = pixels.reshape(height, width, 4)[::-1]
+        return numpy.rint(numpy.clip(pixels, 0, 1) * 0xff).astype(numpy.uint8).tobytes()
+
+    #######################################################
+    @staticmethod
+    def _create_texture_native(image_name, rgba, width, height):
+        self = txd_exporter
 
-        texture_native = txd.TextureNative()
-        texture_native.platform_id = NativePlatformType.D3D9
-        texture_native.filter_mode = 0x06  # Linear Mip Linear (Trilinear)
-        texture_native.uv_addressing = 0b00010001  # Wrap for both U and V
-        
         # Clean texture name - remove invalid characters and limit length
         clean_name = "".join(c for c in image_name if c.isalnum() or c in "_-.")
         clean_name = clean_name[:31]  # Limit to 31 chars (32 with null terminator)
         if not clean_name:
             clean_name = "texture"
-        texture_native.name = clean_name
-        texture_native.mask = ""
-        
-        # Raster format flags for RGBA8888: format type (8888=5) at bit 8-11, no mipmaps, no palette
-        texture_native.raster_format_flags = (txd.RasterFormat.RASTER_8888 << 8) | 0x05
-        texture_native.d3d_format = txd.D3DFormat.D3D_8888
-        texture_native.width = width
-        texture_native.height = height
-        texture_native.depth = 32
-        texture_native.num_levels = 1
-        texture_native.raster_type = 4  # Texture
-        
-        texture_native.platform_properties = type('PlatformProperties', (), {
-            'alpha': True,
-            'cube_texture': False,
-            'auto_mipmaps': False,
-            'compressed': False
-        })()
-        
-        # No palette for RGBA8888 format
-        texture_native.palette = b''
-        
-        # Convert RGBA to BGRA8888 format
-        pixel_data = ImageEncoder.rgba_to_bgra8888(rgba_data)
-        texture_native.pixels = [pixel_data]
-        
-        return texture_native
+
+        # Returns the texture along with a warning when it couldn't be
+        # exported in the requested format
+        try:
+            texture_native = txd.TextureNative.from_rgba(clean_name, rgba, width, height,
+                                                         self.texture_format, self.mipmaps,
+                                                         self.mip_filter)
+            return texture_native, None
+
+        except RuntimeError as e:
+            texture_native = txd.TextureNative.from_rgba(clean_name, rgba, width, height,
+                                                         '8888', self.mipmaps, self.mip_filter)
+            return texture_native, "%s, exported as 8888" % e
 
     #######################################################
     @staticmethod
@@ -159,15 +154,26 @@ class txd_exporter:
                 texture_name = clear_extension(texture_name)
                 used_textures.add((texture_name, image))
 
+        # Pixels are read here as bpy isn't thread safe, the textures are then
+        # encoded in threads as numpy releases the GIL for most of the work
+        textures = []
         for texture_name, image in used_textures:
             # Skip images without pixel data
             if not hasattr(image, 'pixels') or len(image.pixels) == 0:
                 continue
 
-            texture_native = txd_exporter._create_texture_native_from_image(
-                image, texture_name
-            )
+            width, height = image.size
+            textures.append((texture_name, self._read_image_rgba(image), width, height))
+
+        with ThreadPoolExecutor() as executor:
+            results = list(executor.map(
+                lambda texture: self._create_texture_native(*texture), textures
+            ))
+
+        for texture_native, warning in results:
             self.txd.native_textures.append(texture_native)
+            if warning:
+                self.warnings.append(warning)
 
     #######################################################
     @staticmethod
@@ -222,8 +228,13 @@ def export_txd(options):
 
     txd_exporter.mass_export        = options.get('mass_export', False)
     txd_exporter.only_used_textures = options.get('only_used_textures', True)
+    txd_exporter.texture_format     = options.get('texture_format', '8888')
+    txd_exporter.mipmaps            = options.get('mipmaps', False)
+    txd_exporter.mip_filter         = options.get('mip_filter', 'BOX')
     txd_exporter.version            = options.get('version', 0x36003)
 
     txd_exporter.path               = options['directory']
+    txd_exporter.warnings           = []
 
     txd_exporter.export_txd(options['file_name'])
+    return txd_exporter
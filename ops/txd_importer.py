@@ -15,6 +15,7 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import bpy
+import numpy
 import os
 
 from ..gtaLib import txd
@@ -42,13 +43,17 @@ class txd_importer:
 
     #######################################################
     def _create_image(name, rgba, width, height, pack=False):
-        pixels = []
-        for h in range(height - 1, -1, -1):
-            offset = h * width * 4
-            pixels += list(map(lambda b: b / 0xff, rgba[offset:offset+width*4]))
+
+        # Rows are flipped as Blender images start at the bottom
+        pixels = numpy.frombuffer(rgba, dtype=numpy.uint8, count=width * height * 4)
+        pixels = pixels.reshape(height, width * 4)[::-1].ravel()
+        pixels = numpy.multiply(pixels, 1 / 0xff, dtype=numpy.float32)
 
         image = bpy.data.images.new(name, width, height, alpha=True)
-        image.pixels = pixels
+        if hasattr(image.pixels, "foreach_set"):
+            image.pixels.foreach_set(pixels)
+        else:
+            image.pixels[:] = pixels
 
         if pack:
             image.pack()
@@ -70,8 +75,9 @@ class txd_importer:
                 image_name = "%s/%s/%d" % (txd_name, tex.name, level)
                 image = bpy.data.images.get(image_name)
                 if not image:
+                    rgba = txd.texture_cache.get_rgba(self.txd.content_hash, tex.name, tex, level)
                     image = txd_importer._create_image(image_name,
-                                                        tex.to_rgba(level),
+                                                        rgba,
                                                         tex.get_width(level),
                                                         tex.get_height(level),
                                                         self.pack)
@@ -87,8 +93,9 @@ class txd_importer:
             for level in range(num_levels):
                 img = imgs[level]
                 image_name = "%s/%s/%d" % (txd_name, tex.name, level)
+                rgba = txd.texture_cache.get_rgba(self.txd.content_hash, tex.name, img, level)
                 image = txd_importer._create_image(image_name,
-                                                    img.to_rgba(),
+                                                    rgba,
                                                     img.width,
                                                     img.height,
                                                     self.pack)